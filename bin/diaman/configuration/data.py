@@ -5,11 +5,37 @@ import json
 import yaml
 from collections import namedtuple
 
+from ..utils.word_dict import load_word_dict
+
 
 ProcessingParameters = namedtuple('ProcessingParameters', [
     'strip_accents', 'lowercase', 'max_df', 'min_df', 'ngram_range', 'max_iter',
     'evaluate_every', 'perp_tol', 'n_components', 'learning_method', 'random_state'])
 
+RefineParameters = namedtuple('RefineParameters', ['engine', 'time_budget', 'batch_size'])
+
+LdaSweepParameters = namedtuple('LdaSweepParameters', [
+    'enabled', 'min_n_components', 'max_n_components', 'held_out_ratio',
+    'max_documents', 'max_workers'])
+
+ServingParameters = namedtuple('ServingParameters', [
+    'lazy_loading', 'memory_budget', 'preload', 'load_workers', 'load_executor',
+    'reload_interval', 'search_workers', 'n_shards'])
+
+ServerParameters = namedtuple('ServerParameters', [
+    'host', 'port', 'workers', 'max_workers', 'max_pending', 'max_body_size', 'batch_window',
+    'max_batch_size'])
+
+CacheParameters = namedtuple('CacheParameters', ['enabled', 'max_memory', 'ttl'])
+
+TrainParameters = namedtuple('TrainParameters', ['max_workers', 'min_available_memory',
+                                                 'staging_path', 'distributed_preprocessing',
+                                                 'incremental', 'full_rebuild_days',
+                                                 'preprocessing_cache_size', 'skip_unchanged'])
+
+RefinePrecomputeParameters = namedtuple('RefinePrecomputeParameters', [
+    'enabled', 'n_equipments', 'n_queries', 'min_count', 'shop_col', 'search_col'])
+
 
 class DataConfig:
     def __init__(self, language=None):
@@ -20,8 +46,10 @@ class DataConfig:
         # General files
         self._perimeter_filepath = os.path.join(base_path, 'perimeter.json')
         self._processing_filepath = os.path.join(base_path, 'processing_conf.yml')
+        self._serving_filepath = os.path.join(base_path, 'serving_conf.yml')
         self._prepare_perimeter_configuration()
         self._prepare_processing_params_configuration()
+        self._prepare_serving_params_configuration()
 
         # Language specific files
         if language is not None:
@@ -57,6 +85,14 @@ class DataConfig:
                 raise(KeyError("vect_parameters configuration not found."))
             if 'lda_parameters' not in config:
                 raise(KeyError("lda_parametersconfiguration not found."))
+            if 'refine_parameters' not in config:
+                raise(KeyError("refine_parameters configuration not found."))
+            if 'lda_sweep_parameters' not in config:
+                raise(KeyError("lda_sweep_parameters configuration not found."))
+            if 'refine_precompute_parameters' not in config:
+                raise(KeyError("refine_precompute_parameters configuration not found."))
+            if 'train_parameters' not in config:
+                raise(KeyError("train_parameters configuration not found."))
             self.processing_params = \
                 ProcessingParameters(strip_accents=config['vect_parameters']['strip_accents'],
                                      lowercase=config['vect_parameters']['lowercase'],
@@ -70,6 +106,70 @@ class DataConfig:
                                      n_components=config['lda_parameters']['n_components'],
                                      learning_method=config['lda_parameters']['learning_method'],
                                      random_state=config['lda_parameters']['random_state'])
+            self.refine_params = \
+                RefineParameters(engine=config['refine_parameters']['engine'],
+                                 time_budget=config['refine_parameters']['time_budget'],
+                                 batch_size=config['refine_parameters']['batch_size'])
+            self.lda_sweep_params = \
+                LdaSweepParameters(enabled=config['lda_sweep_parameters']['enabled'],
+                                   min_n_components=config['lda_sweep_parameters']['n_components']['min'],
+                                   max_n_components=config['lda_sweep_parameters']['n_components']['max'],
+                                   held_out_ratio=config['lda_sweep_parameters']['held_out_ratio'],
+                                   max_documents=config['lda_sweep_parameters']['max_documents'],
+                                   max_workers=config['lda_sweep_parameters']['max_workers'])
+            precompute_config = config['refine_precompute_parameters']
+            self.refine_precompute_params = \
+                RefinePrecomputeParameters(enabled=precompute_config['enabled'],
+                                           n_equipments=precompute_config['n_equipments'],
+                                           n_queries=precompute_config['n_queries'],
+                                           min_count=precompute_config['min_count'],
+                                           shop_col=precompute_config['user_actions']['shop_col'],
+                                           search_col=precompute_config['user_actions']['search_col'])
+            self.train_params = \
+                TrainParameters(max_workers=config['train_parameters']['max_workers'],
+                                min_available_memory=config['train_parameters']['min_available_memory'],
+                                staging_path=config['train_parameters']['staging_path'],
+                                distributed_preprocessing=config['train_parameters']['distributed_preprocessing'],
+                                incremental=config['train_parameters']['incremental'],
+                                full_rebuild_days=config['train_parameters']['full_rebuild_days'],
+                                preprocessing_cache_size=config['train_parameters']['preprocessing_cache_size'],
+                                skip_unchanged=config['train_parameters']['skip_unchanged'])
+
+    def _prepare_serving_params_configuration(self):
+        """Load the 'serving_params' attribute.
+        These parameters control the kernels resident in memory & have no
+        scientific impact.
+        """
+        logging.info("  - Loading the Serving Parameters")
+        with open(self._serving_filepath) as f:
+            config = yaml.load(f.read(), Loader=yaml.FullLoader)
+            if 'kernels' not in config:
+                raise(KeyError("kernels configuration not found."))
+            self.serving_params = \
+                ServingParameters(lazy_loading=config['kernels']['lazy_loading'],
+                                  memory_budget=config['kernels']['memory_budget'],
+                                  preload=config['kernels']['preload'],
+                                  load_workers=config['kernels']['load_workers'],
+                                  load_executor=config['kernels']['load_executor'],
+                                  reload_interval=config['kernels']['reload_interval'],
+                                  search_workers=config['kernels']['search_workers'],
+                                  n_shards=config['kernels']['n_shards'])
+            if 'cache' not in config:
+                raise(KeyError("cache configuration not found."))
+            self.cache_params = CacheParameters(enabled=config['cache']['enabled'],
+                                                max_memory=config['cache']['max_memory'],
+                                                ttl=config['cache']['ttl'])
+            if 'server' not in config:
+                raise(KeyError("server configuration not found."))
+            self.server_params = \
+                ServerParameters(host=config['server']['host'],
+                                 port=config['server']['port'],
+                                 workers=config['server']['workers'],
+                                 max_workers=config['server']['max_workers'],
+                                 max_pending=config['server']['max_pending'],
+                                 max_body_size=config['server']['max_body_size'],
+                                 batch_window=config['server']['batch_window'],
+                                 max_batch_size=config['server']['max_batch_size'])
 
     def _prepare_stopwords_configuration(self):
         """Load the personalized list of stopwords."""
@@ -80,8 +180,7 @@ class DataConfig:
     def _prepare_word_dict_configuration(self):
         """Load the personalized correction dictionnary."""
         logging.info("  - Loading 'word_dict' attribute")
-        with open(self._word_dict_filepath) as json_file:
-            self.word_dict = json.load(json_file)
+        self.word_dict = load_word_dict(self._word_dict_filepath)
 
     def get_shops(self, language):
         """Get shops of a specific language.
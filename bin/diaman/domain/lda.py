@@ -1,11 +1,17 @@
 import logging
 import datetime
+import time
+import copy
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
 
-from sklearn.feature_extraction.text import CountVectorizer
-from sklearn.decomposition import LatentDirichletAllocation
+from sklearn.feature_extraction.text import CountVectorizer, TfidfVectorizer
+from sklearn.decomposition import LatentDirichletAllocation, NMF
+from sklearn.utils import gen_batches
 
 
-def extract_topics(df, processing_params, corpus_col='corpus_lda', n_top_words=4):
+def extract_topics(df, processing_params, corpus_col='corpus_lda', n_top_words=4,
+                   refine_params=None):
     """Extract topics from a corpus of text documents.
 
     Parameters
@@ -18,12 +24,54 @@ def extract_topics(df, processing_params, corpus_col='corpus_lda', n_top_words=4
         name of the column containing the text information
     n_top_words : int
         number of top words of each topic to return
+    refine_params : configuration.data.RefineParameters
+        refine parameters recorded in conf/data/processing_conf.yml, the
+        topics are extracted by a LDA trained in batch mode if None
 
     Returns
     -------
     top_words_topics : list
         list of the top words of each topic
 
+    """
+    # Get the topic extraction engine
+    engine = 'lda' if refine_params is None else refine_params.engine
+    if engine not in TOPIC_ENGINES:
+        raise KeyError("Unknown topic engine '{}', the available engines are: {}."
+                       .format(engine, ', '.join(TOPIC_ENGINES)))
+
+    # Fit the topic model to the corpus
+    model, feature_names = TOPIC_ENGINES[engine](df, processing_params, corpus_col,
+                                                 refine_params)
+
+    # Get top words of each topic
+    top_words_topics = get_top_words_topics(model, feature_names, n_top_words)
+
+    return top_words_topics
+
+
+def fit_lda(df, processing_params, corpus_col='corpus_lda', refine_params=None):
+    """Fit a LatentDirichletAllocation to the counts of the words of a corpus.
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        dataframe with a corpus column
+    processing_params : configuration.data.ProcessingParameters
+        vectorization & lda parameters recorded in conf/data/processing_conf.yml
+    corpus_col : string
+        name of the column containing the text information
+    refine_params : configuration.data.RefineParameters
+        refine parameters recorded in conf/data/processing_conf.yml, the LDA
+        is trained in batch mode without time limit if None
+
+    Returns
+    -------
+    lda : LatentDirichletAllocation
+        lda fitted to the document-term matrix of the corpus
+    feature_names : list
+        list of the words (columns) of the document-term matrix
+
     """
     # Create vectorizer & dt_matrix from corpus
     (vectorizer,
@@ -31,15 +79,66 @@ def extract_topics(df, processing_params, corpus_col='corpus_lda', n_top_words=4
      feature_names) = vectorize_corpus(df, processing_params, corpus_col)
 
     # Train LDA
-    lda = train(vectorizer, dt_matrix, processing_params)
+    if (refine_params is not None) and (refine_params.time_budget is not None):
+        lda = train_with_budget(dt_matrix, processing_params,
+                                refine_params.time_budget,
+                                refine_params.batch_size)
+    else:
+        lda = train(vectorizer, dt_matrix, processing_params)
 
-    # Get top words of each topic
-    top_words_topics = get_top_words_topics(lda, feature_names, n_top_words)
+    return lda, feature_names
 
-    return top_words_topics
 
+def fit_nmf(df, processing_params, corpus_col='corpus_lda', refine_params=None):
+    """Fit a Non-negative Matrix Factorization to the TF-IDF of a corpus.
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        dataframe with a corpus column
+    processing_params : configuration.data.ProcessingParameters
+        vectorization & lda parameters recorded in conf/data/processing_conf.yml
+    corpus_col : string
+        name of the column containing the text information
+    refine_params : configuration.data.RefineParameters
+        refine parameters recorded in conf/data/processing_conf.yml, unused
+
+    Returns
+    -------
+    nmf : NMF
+        nmf fitted to the tf-idf matrix of the corpus
+    feature_names : list
+        list of the words (columns) of the tf-idf matrix
+
+    """
+    # Create vectorizer & tf-idf matrix from corpus
+    (_,
+     tfidf_matrix,
+     feature_names) = vectorize_corpus(df, processing_params, corpus_col,
+                                       vectorizer_class=TfidfVectorizer)
+
+    # Train NMF
+    logging.info('Training NMF')
+    start_time = datetime.datetime.now()
+    nmf = NMF(n_components=processing_params.n_components,
+              init='nndsvd',
+              max_iter=processing_params.max_iter,
+              random_state=processing_params.random_state)
+    nmf.fit(tfidf_matrix)
 
-def vectorize_corpus(df, vect_params, corpus_col='corpus_lda'):
+    training_time = round((datetime.datetime.now() - start_time).total_seconds())
+    logging.info('NMF training time: {}'.format(training_time))
+
+    return nmf, feature_names
+
+
+# Topic extraction engines selectable with the 'engine' refine parameter
+TOPIC_ENGINES = {'lda': fit_lda,
+                 'nmf': fit_nmf}
+
+
+def vectorize_corpus(df, vect_params, corpus_col='corpus_lda',
+                     vectorizer_class=CountVectorizer):
     """Create and fit a CountVectorizer.
 
     Parameters
@@ -50,10 +149,12 @@ def vectorize_corpus(df, vect_params, corpus_col='corpus_lda'):
         vectorization parameters recorded in conf/data/processing_conf.yml
     corpus_col : string
         name of the column containing the text information
+    vectorizer_class : class
+        CountVectorizer or TfidfVectorizer
 
     Returns
     -------
-    vectorizer : CountVectorizer
+    vectorizer : CountVectorizer or TfidfVectorizer
         vectorizer fitted to a corpus of text documents
     dt_matrix : Document-term matrix
         document-term matrix of the corpus text documents
@@ -71,9 +172,9 @@ def vectorize_corpus(df, vect_params, corpus_col='corpus_lda'):
     min_df = vect_params.min_df
     ngram_range = vect_params.ngram_range
 
-    vectorizer = CountVectorizer(strip_accents=strip_accents,
-                                 lowercase=lowercase, max_df=max_df,
-                                 min_df=min_df, ngram_range=ngram_range)
+    vectorizer = vectorizer_class(strip_accents=strip_accents,
+                                  lowercase=lowercase, max_df=max_df,
+                                  min_df=min_df, ngram_range=ngram_range)
 
     vectorizer = vectorizer.fit(corpus)
     feature_names = vectorizer.get_feature_names()
@@ -125,13 +226,190 @@ def train(vectorizer, dt_matrix, lda_params):
     return lda
 
 
+def train_with_budget(dt_matrix, lda_params, time_budget, batch_size=128):
+    """Train a LatentDirichletAllocation by mini-batches within a time budget.
+
+    The LDA is updated with online learning, one mini-batch at a time. Once the
+    deadline is reached, the model with the best perplexity found so far is
+    returned. The training also stops when the perplexity has converged or
+    after 'max_iter' passes over the dt_matrix. The perplexity is evaluated on
+    a sample of 'batch_size' documents so that an evaluation costs about as
+    much as a mini-batch update.
+
+    Parameters
+    ----------
+    dt_matrix : array of floats
+        document-term matrix of the corpus text documents
+    lda_params : configuration.data.ProcessingParameters
+        lda parameters recorded in conf/data/processing_conf.yml
+    time_budget : float
+        wall-clock time budget of the training, in seconds
+    batch_size : int
+        number of documents in each mini-batch
+
+    Returns
+    -------
+    lda : LatentDirichletAllocation
+        lda fitted to a dt_matrix
+
+    """
+    logging.info('Training LDA with a time budget of {}s'.format(time_budget))
+    start_time = time.monotonic()
+    deadline = start_time + time_budget
+    n_samples = dt_matrix.shape[0]
+    random_state = np.random.RandomState(lda_params.random_state)
+    eval_idx = random_state.choice(n_samples, min(n_samples, batch_size), replace=False)
+    eval_matrix = dt_matrix[np.sort(eval_idx)]
+
+    lda = LatentDirichletAllocation(n_components=lda_params.n_components,
+                                    learning_method='online',
+                                    batch_size=batch_size,
+                                    total_samples=n_samples,
+                                    random_state=lda_params.random_state)
+
+    best_lda, best_perplexity, last_perplexity = None, np.inf, None
+    n_iter, n_batches, deadline_reached = 0, 0, False
+    while n_iter < lda_params.max_iter:
+        for batch in gen_batches(n_samples, batch_size):
+            lda.partial_fit(dt_matrix[batch])
+            n_batches += 1
+            if time.monotonic() >= deadline:
+                deadline_reached = True
+                break
+        n_iter += 1
+
+        # Keep the best model every 'evaluate_every' iterations & at the deadline
+        if (lda_params.evaluate_every > 0) and \
+           ((n_iter % lda_params.evaluate_every == 0) or deadline_reached):
+            perplexity = lda.perplexity(eval_matrix)
+            if perplexity < best_perplexity:
+                best_lda, best_perplexity = copy.deepcopy(lda), perplexity
+            if (last_perplexity is not None) and \
+               (abs(last_perplexity - perplexity) < lda_params.perp_tol):
+                break
+            last_perplexity = perplexity
+
+        if deadline_reached:
+            break
+
+    training_time = time.monotonic() - start_time
+    logging.info(('LDA training: {} iterations ({} mini-batches) in {:.3f}s '
+                  'out of a {}s budget{}').format(n_iter, n_batches, training_time,
+                                                  time_budget,
+                                                  ', deadline reached' if deadline_reached else ''))
+
+    return best_lda if best_lda is not None else lda
+
+
+def sweep_n_components(dt_matrices, lda_params, sweep_params):
+    """Select the number of topics of the LDA of each corpus by held-out perplexity.
+
+    An LDA is fitted for each corpus and each number of topics of the sweep
+    range. All the fits run concurrently in a single process pool, across the
+    numbers of topics and across the corpora.
+
+    Parameters
+    ----------
+    dt_matrices : dict of arrays of floats
+        document-term matrices of the corpora, e.g. by tuple (language, shop)
+    lda_params : configuration.data.ProcessingParameters
+        lda parameters recorded in conf/data/processing_conf.yml
+    sweep_params : configuration.data.LdaSweepParameters
+        sweep parameters recorded in conf/data/processing_conf.yml
+
+    Returns
+    -------
+    sweeps : dict of dicts
+        for each corpus, the selected 'n_components' and the held-out
+        'perplexities' of each number of topics
+
+    """
+    logging.info('Sweeping the number of topics of {} corpora'.format(len(dt_matrices)))
+    start_time = datetime.datetime.now()
+    n_components_range = range(sweep_params.min_n_components,
+                               sweep_params.max_n_components + 1)
+
+    with ProcessPoolExecutor(max_workers=sweep_params.max_workers) as executor:
+        futures = {}
+        for key, dt_matrix in dt_matrices.items():
+            dt_train, dt_test = split_held_out(dt_matrix, sweep_params.held_out_ratio,
+                                               sweep_params.max_documents,
+                                               lda_params.random_state)
+            for n_components in n_components_range:
+                futures[(key, n_components)] = executor.submit(
+                    held_out_perplexity, dt_train, dt_test,
+                    lda_params._replace(n_components=n_components))
+
+        sweeps = {}
+        for (key, n_components), future in futures.items():
+            sweeps.setdefault(key, {'perplexities': {}})
+            sweeps[key]['perplexities'][n_components] = future.result()
+
+    for key, sweep in sweeps.items():
+        sweep['n_components'] = min(sweep['perplexities'], key=sweep['perplexities'].get)
+        logging.info('Selected {} topics for {}'.format(sweep['n_components'], key))
+
+    sweep_time = round((datetime.datetime.now() - start_time).total_seconds())
+    logging.info('LDA sweep time: {}'.format(sweep_time))
+
+    return sweeps
+
+
+def split_held_out(dt_matrix, held_out_ratio, max_documents=None, random_state=None):
+    """Split the documents of a dt_matrix into a train & a held-out set.
+
+    Parameters
+    ----------
+    dt_matrix : array of floats
+        document-term matrix of the corpus text documents
+    held_out_ratio : float
+        proportion of the documents in the held-out set
+    max_documents : int
+        maximum number of documents to sample from the dt_matrix, all the
+        documents are used if None
+    random_state : int
+        seed of the documents shuffle
+
+    Returns
+    -------
+    dt_train : array of floats
+        document-term matrix of the train documents
+    dt_test : array of floats
+        document-term matrix of the held-out documents
+
+    """
+    documents = np.random.RandomState(random_state).permutation(dt_matrix.shape[0])
+    if max_documents is not None:
+        documents = documents[:max_documents]
+    n_test = max(1, int(len(documents) * held_out_ratio))
+
+    return dt_matrix[np.sort(documents[n_test:])], dt_matrix[np.sort(documents[:n_test])]
+
+
+def held_out_perplexity(dt_train, dt_test, lda_params):
+    """Train a LatentDirichletAllocation & compute its held-out perplexity.
+
+    Parameters
+    ----------
+    dt_train : array of floats
+        document-term matrix of the train documents
+    dt_test : array of floats
+        document-term matrix of the held-out documents
+    lda_params : configuration.data.ProcessingParameters
+        lda parameters recorded in conf/data/processing_conf.yml
+
+    """
+    lda = train(None, dt_train, lda_params)
+    return lda.perplexity(dt_test)
+
+
 def get_top_words_topics(model, feature_names, n_top_words):
     """Get the most frequent words of each topic.
 
     Parameters
     ----------
-    model : LatentDirichletAllocation
-        lda fitted to a dt_matrix
+    model : LatentDirichletAllocation or NMF
+        topic model fitted to a dt_matrix
     feature_names : list
         list of the words (columns) of the dt_matrix
     n_top_words : int
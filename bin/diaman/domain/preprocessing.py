@@ -1,7 +1,13 @@
 import logging
 import unicodedata
 import re
+import numpy as np
 import pandas as pd
+from collections import defaultdict
+
+
+# Corpora preprocessed for the training: (corpus_col, True for the lda variant)
+PREPROCESSED_CORPORA = [('DESCR_ORDER', False), ('COMMENT', False), ('COMMENT', True)]
 
 
 def preprocess_corpus(df, corpus_col, stopwords, word_dict,
@@ -42,6 +48,96 @@ def preprocess_corpus(df, corpus_col, stopwords, word_dict,
     return corpus
 
 
+def preprocess_corpus_by_language(corpus, languages, corpus_col, stopwords, word_dicts,
+                                  remove_numbers=False, remove_small_words=False):
+    """Preprocess a corpus whose documents are in several languages, e.g. a
+    batch of reports preprocessed on a Spark executor.
+
+    Parameters
+    ----------
+    corpus : pd.Series
+        text documents of the corpus_col to preprocess
+    languages : pd.Series
+        language of each document
+    corpus_col : string
+        name of the column containing the text information
+    stopwords : dict of lists of strings
+        list containing the stopwords of each language
+    word_dicts : dict of dicts
+        personalized correction dictionnary of each language
+    remove_numbers : bool
+        True if numbers are removed
+    remove_small_words : bool
+        True if small words are removed
+
+    Returns
+    -------
+    corpus : pd.Series
+        preprocessed documents, with the index of the input corpus
+
+    """
+    preprocessed_corpus = pd.Series(index=corpus.index, dtype=object)
+    for language in languages.unique():
+        mask = (languages == language).values
+        df = pd.DataFrame({corpus_col: corpus.values[mask]})
+        preprocessed_corpus[mask] = preprocess_corpus(df, corpus_col, stopwords[language],
+                                                      word_dicts[language], remove_numbers,
+                                                      remove_small_words).values
+    return preprocessed_corpus
+
+
+def hash_reports(df):
+    """Hash the content of each report, e.g. to find the reports which changed
+    since a previous training.
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        dataframe with the reports
+
+    Returns
+    -------
+    hashes : array of uint64
+        hash of the values of each report, independent of its index
+
+    """
+    return pd.util.hash_pandas_object(df.apply(lambda col: col
+                                               if pd.api.types.is_numeric_dtype(col)
+                                               else col.map(repr)),
+                                      index=False).values
+
+
+def get_preprocessed_col(corpus_col, lda=False):
+    """Get the name of the column of a corpus preprocessed before the training.
+
+    Parameters
+    ----------
+    corpus_col : string
+        name of the column containing the text information
+    lda : bool
+        True for the corpus preprocessed for the lda training, without
+        numbers & small words
+
+    """
+    return '{}_{}'.format('corpus_lda' if lda else 'corpus', corpus_col)
+
+
+def normalize_query(search):
+    """Normalize a user search into a lookup key: lower case, no accents and
+    single spaces between words.
+
+    Parameters
+    ----------
+    search : string
+        user search
+
+    """
+    search = unicodedata.normalize('NFKD', search.lower()) \
+        .encode('ascii', 'ignore') \
+        .decode('utf-8')
+    return ' '.join(search.split())
+
+
 def refine_corpus(df, corpus_col, stopwords, remove_numbers, remove_small_words):
     """Perform conventional text processing.
 
@@ -135,7 +231,8 @@ def correct_words(corpus, word_dict):
     corpus : pd.Series
         One-dimensional ndarray containing the corpus_col to preprocess
     word_dict : dict
-        personalized correction dictionnary: {'true word': [words to replace]}
+        personalized correction dictionnary: {'true word': [words to replace]},
+        e.g. a CompiledWordDict with its precomputed corrections
 
     Returns
     -------
@@ -144,19 +241,89 @@ def correct_words(corpus, word_dict):
 
     """
     logging.info('Correcting words')
-    corrected_corpus = []
-    for sentence in corpus.values.tolist():
-        corrected_sentence = ''
-        tokenized_sentence = sentence.split(' ')
-        for word in tokenized_sentence:
-            for key, value in word_dict.items():
-                if word in value:
-                    word = key
-                    break
-            corrected_sentence = ' '.join([corrected_sentence, word])
-        corrected_sentence = corrected_sentence.lstrip(' ')
-        corrected_corpus.append(corrected_sentence)
+    corrections = getattr(word_dict, 'corrections', None)
+    if corrections is None:
+        corrections = get_corrections(word_dict)
+    corrected_corpus = [' '.join([corrections.get(word, word) for word in sentence.split(' ')])
+                        .lstrip(' ')
+                        for sentence in corpus.values.tolist()]
 
     corpus = pd.Series(data=corrected_corpus)
 
     return corpus
+
+
+def get_corrections(word_dict):
+    """Get the correction of each incorrect word of a word dictionary, the
+    first correct word listing it being used as in correct_words.
+
+    Parameters
+    ----------
+    word_dict : dict
+        personalized correction dictionnary: {'true word': [words to replace]}
+
+    Returns
+    -------
+    corrections : dict
+        dictionary {incorrect word: correct word}
+
+    """
+    corrections = {}
+    for correct_word, incorrect_words in word_dict.items():
+        for incorrect_word in incorrect_words:
+            corrections.setdefault(incorrect_word, correct_word)
+    return corrections
+
+
+def get_changed_tokens(old_word_dict, new_word_dict):
+    """Get the tokens of the corpora corrected with old_word_dict whose
+    documents may be corrected differently with new_word_dict.
+
+    A word whose correction changed appears in the corrected corpora as its
+    old correction, e.g. as the correct word it was replaced by.
+
+    Parameters
+    ----------
+    old_word_dict : dict
+        correction dictionnary used to preprocess the corpora
+    new_word_dict : dict
+        new correction dictionnary, e.g. enriched after a doccano labelling
+
+    Returns
+    -------
+    changed_tokens : set of strings
+        tokens of the documents to correct again
+
+    """
+    old_corrections = get_corrections(old_word_dict)
+    new_corrections = get_corrections(new_word_dict)
+    return {old_corrections.get(word, word)
+            for word in set(old_corrections) | set(new_corrections)
+            if old_corrections.get(word, word) != new_corrections.get(word, word)}
+
+
+def build_token_index(corpus):
+    """Build the index of the documents containing each token of a corpus.
+
+    Parameters
+    ----------
+    corpus : array of strings
+        preprocessed documents, whose tokens are separated by spaces
+
+    Returns
+    -------
+    token_index : dict
+        dictionary {token: list of the positions of the documents}
+
+    """
+    token_index = defaultdict(list)
+    for row, document in enumerate(corpus):
+        for token in set(document.split(' ')):
+            token_index[token].append(row)
+    return token_index
+
+
+def get_token_rows(token_index, tokens):
+    """Get the sorted positions of the documents containing any of the tokens."""
+    rows = [row for token in tokens for row in token_index.get(token, [])]
+    return np.unique(np.array(rows, dtype=np.int64))
@@ -1,6 +1,9 @@
 import numpy as np
+import pandas as pd
+from itertools import chain
+from operator import itemgetter
 
-from . import preprocessing
+from . import preprocessing, vectorizer
 
 
 """ ----------------------------------------------------------------------------
@@ -8,7 +11,7 @@ from . import preprocessing
 ---------------------------------------------------------------------------- """
 
 
-def get_matching_reports(kernel, search):
+def get_matching_reports(kernel, search, similarity=None, rows=None):
     """Get reports which correspond to the user search.
 
     Parameters
@@ -17,6 +20,10 @@ def get_matching_reports(kernel, search):
         instance
     search : string
         user search
+    similarity : array of floats
+        similarity of each report with the user search, computed if None
+    rows : array of ints
+        sorted positions of the candidate reports, all the reports if None
 
     Returns
     -------
@@ -24,30 +31,18 @@ def get_matching_reports(kernel, search):
         dataframe with the matching reports, which are filtered and sorted
 
     """
-    # User search preprocessing
-    input_data = preprocessing.preprocess_corpus(search, 'user_input',
-                                                 kernel.stopwords,
-                                                 kernel.word_dict)
-    input_data = input_data[0]
-
-    # Compute the distances between the input and the text columns
-    kernel.description_vect.compute_distance(input_data)
-    kernel.comment_vect.compute_distance(input_data)
+    # Compute the similarity between the search and the text columns
+    if similarity is None:
+        similarity = score_reports(kernel, [search], rows=rows)[0]
+    elif rows is not None:
+        similarity = similarity[rows]
 
     # Create df_reports
-    df_reports = kernel.comment_vect.df_preprocessed \
-        .rename(columns={'similarity': 'sim_comment'})
-    df_reports['sim_failure'] = kernel.description_vect.df_preprocessed['similarity']
-
-    # Compute the final similarity
-    w = kernel.slider_sim_weight
-    df_reports['similarity'] = ((1.-w) * df_reports['sim_failure']
-                                + w * df_reports['sim_comment']) / 2
-
-    df_reports = df_reports \
-        .loc[df_reports['similarity'] > 0] \
+    df_preprocessed = kernel.comment_vect.df_preprocessed
+    if rows is not None:
+        df_preprocessed = df_preprocessed.iloc[rows]
+    df_reports = select_reports(df_preprocessed, similarity) \
         .sort_values(by='similarity', ascending=False) \
-        .drop(columns=['sim_comment', 'sim_failure']) \
         .reset_index(drop=True)
 
     if len(df_reports) == 0:
@@ -57,6 +52,66 @@ def get_matching_reports(kernel, search):
         return df_reports
 
 
+def select_reports(df_preprocessed, similarity):
+    """Select the reports with a positive similarity, without modifying the
+    dataframe of the kernel.
+
+    Parameters
+    ----------
+    df_preprocessed : pd.DataFrame
+        dataframe with the reports
+    similarity : array of floats
+        similarity of each report with the user search
+
+    Returns
+    -------
+    df_reports : pd.DataFrame
+        dataframe with the selected reports & their 'similarity' column
+
+    """
+    mask = similarity > 0
+    df_reports = df_preprocessed.loc[mask]
+    if 'similarity' in df_reports.columns:
+        df_reports = df_reports.drop(columns=['similarity'])
+    return df_reports.assign(similarity=similarity[mask])
+
+
+def score_reports(kernel, searches, executor=None, rows=None):
+    """Compute the similarity between each user search and each report, in a
+    single scoring pass over the reports.
+
+    Parameters
+    ----------
+    kernel : interface.kernel.AppKernel
+        instance
+    searches : list of strings
+        user searches
+    executor : concurrent.futures.Executor
+        executor scoring the shards of the kernel concurrently
+    rows : array of ints
+        sorted positions of the reports to score, all the reports if None
+
+    Returns
+    -------
+    similarities : array of floats
+        similarities of shape (number of searches, number of scored reports)
+
+    """
+    # User searches preprocessing
+    inputs = preprocessing.preprocess_corpus(pd.DataFrame({'user_input': searches}),
+                                             'user_input', kernel.stopwords,
+                                             kernel.word_dict).tolist()
+
+    # Compute the similarities between the inputs and the text columns
+    sim_failure = vectorizer.description_similarities(kernel.description_vect, inputs,
+                                                      executor, rows)
+    sim_comment = vectorizer.comment_similarities(kernel.comment_vect, inputs, executor, rows)
+
+    # Compute the final similarity
+    w = kernel.slider_sim_weight
+    return ((1.-w) * sim_failure + w * sim_comment) / 2
+
+
 """ ----------------------------------------------------------------------------
 -------------------------------- FILTER REPORTS --------------------------------
 ---------------------------------------------------------------------------- """
@@ -164,14 +219,54 @@ def sort_reports(df_reports, slider_coeff_detail):
     # Evaluate the level of detail of each document of the corpus
     df_reports = compute_detail_level(df_reports)
 
-    # Get the particular values
-    max_similarity = df_reports['similarity'].max()
-    min_similarity = df_reports['similarity'].min()
+    # Compute the sort
+    df_reports = compute_sorting_score(df_reports, slider_coeff_detail,
+                                       get_sorting_ranges(df_reports))
+
+    return df_reports.sort_values(by='sorting_score', ascending=False) \
+                     .reset_index(drop=True)
+
 
-    max_detail_level = df_reports['detail_level'].max()
-    min_detail_level = df_reports['detail_level'].min()
+def get_sorting_ranges(df_reports):
+    """Get the ranges of the similarity & of the level of detail of the
+    reports, used to normalize them in the sorting score.
+
+    Parameters
+    ----------
+    df_reports : pd.DataFrame
+        dataframe with the 'similarity' & 'detail_level' columns
+
+    Returns
+    -------
+    sorting_ranges : tuple of floats
+        (min_similarity, max_similarity, min_detail_level, max_detail_level)
+
+    """
+    return (df_reports['similarity'].min(), df_reports['similarity'].max(),
+            df_reports['detail_level'].min(), df_reports['detail_level'].max())
+
+
+def compute_sorting_score(df_reports, slider_coeff_detail, sorting_ranges):
+    """Compute the sorting score of the reports from their normalized
+    similarity & level of detail.
+
+    Parameters
+    ----------
+    df_reports : pd.DataFrame
+        dataframe with the 'similarity' & 'detail_level' columns
+    slider_coeff_detail : float
+        weight given at the level of detail
+    sorting_ranges : tuple of floats
+        (min_similarity, max_similarity, min_detail_level, max_detail_level)
+
+    Returns
+    -------
+    df_reports : pd.DataFrame
+        dataframe with the 'sorting_score' column
+
+    """
+    min_similarity, max_similarity, min_detail_level, max_detail_level = sorting_ranges
 
-    # Compute the sort
     df_reports['sorting_score'] = ((1. - slider_coeff_detail)
                                    * (df_reports['similarity'] - min_similarity)
                                    / (max_similarity - min_similarity)
@@ -179,17 +274,19 @@ def sort_reports(df_reports, slider_coeff_detail):
                                    * (df_reports['detail_level'] - min_detail_level)
                                    / (max_detail_level - min_detail_level))
 
-    return df_reports.sort_values(by='sorting_score', ascending=False) \
-                     .reset_index(drop=True)
+    return df_reports
 
 
-def compute_detail_level(df_reports):
+def compute_detail_level(df_reports, max_detail_level=None):
     """Evaluate the level of detail of each document of the corpus.
 
     Parameters
     ----------
     df_reports : pd.DataFrame
         dataframe with the filtered reports
+    max_detail_level : int
+        max level of detail used to normalize the level of detail, the one of
+        the documents of df_reports if None
 
     Returns
     -------
@@ -205,7 +302,8 @@ def compute_detail_level(df_reports):
         corpus = df_reports['corpus'].values.tolist()
 
     # Calculate max_detail_level
-    max_detail_level = calculate_max_detail_level(corpus)
+    if max_detail_level is None:
+        max_detail_level = calculate_max_detail_level(corpus)
 
     # Evaluate the level of detail of each document
     detail_level = []
@@ -238,3 +336,250 @@ def calculate_max_detail_level(corpus):
             max_detail_level = len(words_list)
 
     return max_detail_level
+
+
+def boost_recent_reports(df_reports, recency_boost, date_range):
+    """Blend the sorting score of the reports with the recency of their
+    creation date.
+
+    Parameters
+    ----------
+    df_reports : pd.DataFrame
+        dataframe with the 'sorting_score' column
+    recency_boost : float
+        weight given at the recency, between 0 and 1
+    date_range : tuple of pd.Timestamp
+        (first date, last date) used to normalize the creation dates
+
+    Returns
+    -------
+    df_reports : pd.DataFrame
+        dataframe with the boosted 'sorting_score' column
+
+    """
+    first_date, last_date = date_range
+    dates = pd.to_datetime(df_reports['ERDAT'], errors='coerce')
+    recency = ((dates - first_date) / (last_date - first_date)).fillna(0.)
+
+    df_reports['sorting_score'] = ((1. - recency_boost) * df_reports['sorting_score']
+                                   + recency_boost * recency)
+    return df_reports
+
+
+def get_date_range(df_reports):
+    """Get the (first date, last date) of creation of the reports."""
+    dates = pd.to_datetime(df_reports['ERDAT'], errors='coerce')
+    return dates.min(), dates.max()
+
+
+""" ---------------------------------------------------------------------------
+---------------------------------- DATE INDEX ---------------------------------
+--------------------------------------------------------------------------- """
+
+
+def build_date_index(df_preprocessed):
+    """Build the index of the reports sorted by creation date ('ERDAT').
+
+    Parameters
+    ----------
+    df_preprocessed : pd.DataFrame
+        dataframe with the reports of a kernel
+
+    Returns
+    -------
+    date_index : tuple of arrays
+        sorted creation dates & positions of the corresponding reports,
+        without the reports with no valid date
+
+    """
+    dates = pd.to_datetime(df_preprocessed['ERDAT'], errors='coerce').values
+    valid_rows = np.flatnonzero(~pd.isnull(dates))
+    rows = valid_rows[np.argsort(dates[valid_rows], kind='mergesort')]
+    return dates[rows], rows
+
+
+def get_date_rows(date_index, date_from=None, date_to=None):
+    """Get the positions of the reports created between two dates, by binary
+    search in the date index.
+
+    Parameters
+    ----------
+    date_index : tuple of arrays
+        sorted creation dates & positions of the corresponding reports
+    date_from : string
+        first creation date of the reports, no lower bound if None
+    date_to : string
+        last creation date of the reports, included, no upper bound if None
+
+    Returns
+    -------
+    rows : array of ints
+        sorted positions of the reports
+
+    """
+    dates, rows = date_index
+    start = 0 if date_from is None \
+        else np.searchsorted(dates, pd.Timestamp(date_from).to_datetime64(), side='left')
+    stop = len(dates) if date_to is None \
+        else np.searchsorted(dates, pd.Timestamp(date_to).to_datetime64(), side='right')
+    return np.sort(rows[start:stop])
+
+
+""" ---------------------------------------------------------------------------
+--------------------------------- MERGE REPORTS -------------------------------
+--------------------------------------------------------------------------- """
+
+
+def merge_reports(shop_results, n_reports):
+    """Merge the search results of several shops into their global top reports.
+
+    The top reports of each shop are merged on their sorting score, which
+    must be comparable across the shops, i.e. normalized with ranges reduced
+    over all the shops (see search_pipeline.rank_report_groups).
+
+    Parameters
+    ----------
+    shop_results : list of tuples
+        (df_reports, matching_sites, matching_constructors, matching_equipments)
+        of each shop, with the reports sorted by decreasing sorting score
+    n_reports : int
+        number of reports to return
+
+    Returns
+    -------
+    df_reports : pd.DataFrame
+        dataframe with the top reports of all the shops, sorted by decreasing
+        sorting score
+    matching_sites : list
+        union of the matching sites of the shops
+    matching_constructors : list
+        union of the matching constructors of the shops
+    matching_equipments : list
+        union of the matching equipments of the shops
+
+    """
+    df_reports = pd.concat([df_shop.head(n_reports) for df_shop, _, _, _ in shop_results],
+                           ignore_index=True, sort=False) \
+        .sort_values(by='sorting_score', ascending=False, kind='mergesort') \
+        .head(n_reports) \
+        .reset_index(drop=True)
+
+    matching_entities = [sorted(set().union(*[shop_result[idx] for shop_result in shop_results]))
+                         for idx in (1, 2, 3)]
+
+    return (df_reports, *matching_entities)
+
+
+""" ---------------------------------------------------------------------------
+---------------------------- FLATTEN NESTED COLUMNS ---------------------------
+--------------------------------------------------------------------------- """
+
+
+def flatten_nested_col(nested_values, fields):
+    """Flatten a column of lists of structs, e.g. the spare parts of
+    'COMPONENTS' or the medias of 'MEDIAS', into a columnar child table.
+
+    The structs of all the reports are gathered once, then each field is
+    extracted as a flat list; the structs of the i-th report are the rows
+    offsets[i]:offsets[i + 1] of the child table.
+
+    Parameters
+    ----------
+    nested_values : array of lists of tuples
+        structs of each report, None for a report without structs
+    fields : list of ints
+        positions of the fields of the structs to extract
+
+    Returns
+    -------
+    offsets : array of int64
+        position of the first struct of each report in the child table,
+        followed by the number of structs
+    child_fields : list of lists
+        values of each extracted field, for all the structs
+
+    """
+    lengths = [0 if values is None else len(values) for values in nested_values]
+    offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    structs = list(chain.from_iterable(values for values in nested_values if values is not None))
+    return offsets, [list(map(itemgetter(field), structs)) for field in fields]
+
+
+def split_child_values(offsets, child_values):
+    """Split the values of a child table into the list of values of each report.
+
+    Parameters
+    ----------
+    offsets : array of int64
+        position of the first value of each report in the child table,
+        followed by the number of values
+    child_values : list
+        values of the child table
+
+    """
+    return [child_values[start:stop]
+            for start, stop in zip(offsets[:-1].tolist(), offsets[1:].tolist())]
+
+
+def build_child_tables(df_reports):
+    """Flatten the nested columns of the reports into their columnar child
+    tables, once at training time: they are saved with the COMMENT
+    vectorizer, see serializer.format_nested_cols.
+
+    Parameters
+    ----------
+    df_reports : pd.DataFrame
+        dataframe with the reports & their nested columns
+
+    Returns
+    -------
+    child_tables : dict of tuples
+        (offsets, values of each field) of each column of NESTED_COLUMN_FIELDS
+        found in df_reports
+
+    """
+    child_tables = {}
+    for col, fields in NESTED_COLUMN_FIELDS.items():
+        if col in df_reports.columns:
+            offsets, values = flatten_nested_col(df_reports[col].values, list(fields.values()))
+            child_tables[col] = (offsets, dict(zip(fields, values)))
+    return child_tables
+
+
+def join_child_values(offsets, child_values, sep=' ', empty=''):
+    """Concatenate the string values of a child table of each report, each
+    value being preceded by the separator.
+
+    The separator is added to all the values at once, then the values of
+    each report are concatenated by a single reduceat over the child table.
+
+    Parameters
+    ----------
+    offsets : array of int64
+        position of the first value of each report in the child table,
+        followed by the number of values
+    child_values : list of strings
+        values of the child table
+    sep : string
+        separator preceding each value
+    empty : string
+        text of the reports without values
+
+    Returns
+    -------
+    texts : array of strings
+        concatenated values of each report
+
+    """
+    texts = np.full(len(offsets) - 1, empty, dtype=object)
+    filled = offsets[1:] > offsets[:-1]
+    if filled.any():
+        values = np.char.add(sep, np.asarray(child_values, dtype=str)).astype(object)
+        texts[filled] = np.add.reduceat(values, offsets[:-1][filled])
+    return texts
+
+
+# Positions of the fields of the structs kept in the child tables of the nested columns
+NESTED_COLUMN_FIELDS = {'COMPONENTS': {'MATNR': 0, 'QUANTITY': 2},
+                        'MEDIAS': {'DOC_URL': 0, 'DOC_TYPE': 1}}
@@ -1,8 +1,12 @@
 import logging
 import os
+import sys
 import datetime
 import pickle
+import numpy as np
+import pandas as pd
 from sklearn.feature_extraction.text import CountVectorizer, TfidfVectorizer
+from scipy.sparse import csr_matrix, diags
 from sklearn.metrics.pairwise import cosine_similarity
 
 from . import preprocessing
@@ -23,6 +27,17 @@ class CorpusVect():
         vectorizer fitted to a corpus of text documents
     dt_matrix : array of floats
         document-term matrix of the corpus text documents
+    word_totals : array of floats
+        sum of each column of the dt_matrix over all the documents
+    vect_filepath : string
+        path to the loaded file
+    dt_shards : list of sparse matrices
+        row shards of the dt_matrix, sharing its memory, empty if the
+        dt_matrix isn't sharded
+    child_tables : dict of tuples
+        child tables of the nested columns of the reports flattened at
+        training time (see report.build_child_tables), saved with the
+        'COMMENT' CorpusVect, None if not flattened
 
     """
     def __init__(self, language, shop, corpus_col):
@@ -41,9 +56,11 @@ class CorpusVect():
         self.histo_path = os.path.join(os.environ['REPO'], 'histo',
                                        language, shop)
         self.corpus_col = corpus_col
+        self.dt_shards = []
+        self.child_tables = None
 
-    def preprocess_corpus(self, df, stopwords, word_dict,
-                          remove_numbers, remove_small_words):
+    def preprocess_corpus(self, df, stopwords, word_dict, remove_numbers,
+                          remove_small_words, previous_vect=None, corpus_cache=None):
         """Make pipeline to preprocess the 'corpus_col' column.
 
         Parameters
@@ -58,24 +75,82 @@ class CorpusVect():
             True if numbers are removed
         remove_small_words : bool
             True if small words are removed
+        previous_vect : CorpusVect
+            CorpusVect of a previous training with the same stopwords &
+            word_dict, whose preprocessed corpus is reused for the reports
+            which didn't change, None to preprocess all the reports
+        corpus_cache : utils.cache.CorpusCache
+            cache of the documents preprocessed with the same stopwords &
+            word_dict, looked up for the reports not reused from
+            previous_vect & filled with the preprocessed ones
+
+        Returns
+        -------
+        n_reused : int
+            number of reports whose preprocessed corpus is reused from
+            previous_vect
 
         """
         # Create df_preprocessed attribute
         self.df_preprocessed = df.copy()
 
-        # Preprocess the corpus_col column
-        self.df_preprocessed['corpus'] = preprocessing.preprocess_corpus(df,
-                                                                         self.corpus_col,
-                                                                         stopwords,
-                                                                         word_dict,
-                                                                         remove_numbers,
-                                                                         remove_small_words)
+        # Find the reports preprocessed by the previous training
+        reused = np.zeros(len(df), dtype=bool)
+        if previous_vect is not None:
+            positions = get_previous_positions(df, previous_vect.df_preprocessed)
+            reused = positions >= 0
 
-        # Preprocess the 'comment' column for the lda training
+        # Preprocess the corpus_col column, & the 'comment' column for the lda training
+        corpus_cols = [('corpus', remove_numbers, remove_small_words)]
         if self.corpus_col == 'COMMENT':
-            self.df_preprocessed['corpus_lda'] = preprocessing.preprocess_corpus(
-                df, self.corpus_col, stopwords, word_dict,
-                remove_numbers=True, remove_small_words=True)
+            corpus_cols.append(('corpus_lda', True, True))
+        for col, col_remove_numbers, col_remove_small_words in corpus_cols:
+            corpus = np.empty(len(df), dtype=object)
+            if reused.any():
+                corpus[reused] = previous_vect.df_preprocessed[col].values[positions[reused]]
+            missing = ~reused
+
+            # Look up the cached documents
+            variant = '{}_{}_{}'.format(self.corpus_col, col_remove_numbers,
+                                        col_remove_small_words)
+            if corpus_cache is not None and missing.any():
+                cached_corpus, found = corpus_cache.get(df[self.corpus_col].values[missing],
+                                                        variant)
+                missing_rows = np.flatnonzero(missing)
+                corpus[missing_rows[found]] = cached_corpus[found]
+                missing[missing_rows[found]] = False
+
+            if missing.any():
+                corpus[missing] = preprocessing.preprocess_corpus(
+                    df[missing], self.corpus_col, stopwords, word_dict,
+                    col_remove_numbers, col_remove_small_words).values
+                if corpus_cache is not None:
+                    corpus_cache.put(df[self.corpus_col].values[missing], corpus[missing],
+                                     variant)
+            self.df_preprocessed[col] = corpus
+
+        return int(reused.sum())
+
+    def set_preprocessed_corpus(self, df):
+        """Use the 'corpus_col' column preprocessed beforehand, e.g. on the
+        Spark executors, instead of preprocessing it.
+
+        Parameters
+        ----------
+        df : pd.DataFrame
+            input dataframe with the corpus_col & its preprocessed columns,
+            named by preprocessing.get_preprocessed_col
+
+        """
+        preprocessed_cols = [preprocessing.get_preprocessed_col(corpus_col, lda)
+                             for corpus_col, lda in preprocessing.PREPROCESSED_CORPORA]
+        self.df_preprocessed = df[[col for col in df.columns
+                                   if col not in preprocessed_cols]].copy()
+        self.df_preprocessed['corpus'] = df[preprocessing.get_preprocessed_col(
+            self.corpus_col)].values
+        if self.corpus_col == 'COMMENT':
+            self.df_preprocessed['corpus_lda'] = df[preprocessing.get_preprocessed_col(
+                self.corpus_col, lda=True)].values
 
     def create_vectorizer(self):
         """Create and fit a vectorizer to the corpus_col column."""
@@ -92,6 +167,80 @@ class CorpusVect():
 
         # Create document-term matrix
         self.dt_matrix = self.vectorizer.transform(corpus)
+        self.word_totals = get_word_totals(self.dt_matrix)
+
+    def recorrect_corpus(self, stopwords, word_dict, changed_tokens, remove_numbers=False,
+                         remove_small_words=False):
+        """Preprocess again the documents containing tokens whose correction
+        changed, e.g. after the enrichment of the word_dict, & update their
+        rows of the dt_matrix with the fitted vectorizer.
+
+        The documents are found with a token index of each preprocessed
+        corpus & preprocessed from the 'corpus_col' column of the
+        df_preprocessed, so they are the same as after a full training. The
+        vocabulary & the idf are kept until the next training.
+
+        Parameters
+        ----------
+        stopwords : list of strings
+            list containing the stopwords
+        word_dict : dict
+            new personalized correction dictionnary
+        changed_tokens : set of strings
+            tokens of the documents to preprocess again, see
+            preprocessing.get_changed_tokens
+        remove_numbers : bool
+            True if numbers are removed
+        remove_small_words : bool
+            True if small words are removed
+
+        Returns
+        -------
+        n_recorrected : int
+            number of documents whose 'corpus' changed
+
+        """
+        corpus_cols = [('corpus', remove_numbers, remove_small_words)]
+        if self.corpus_col == 'COMMENT':
+            corpus_cols.append(('corpus_lda', True, True))
+        for col, col_remove_numbers, col_remove_small_words in corpus_cols:
+            corpus = self.df_preprocessed[col].values.copy()
+            token_index = preprocessing.build_token_index(corpus)
+            rows = preprocessing.get_token_rows(token_index, changed_tokens)
+            if len(rows) > 0:
+                corpus[rows] = preprocessing.preprocess_corpus(
+                    self.df_preprocessed.iloc[rows], self.corpus_col, stopwords, word_dict,
+                    col_remove_numbers, col_remove_small_words).values
+                rows = rows[corpus[rows] != self.df_preprocessed[col].values[rows]]
+                self.df_preprocessed[col] = corpus
+            if col == 'corpus':
+                recorrected_rows = rows
+
+        if len(recorrected_rows) > 0:
+            self.update_dt_matrix(recorrected_rows)
+        return len(recorrected_rows)
+
+    def update_dt_matrix(self, rows):
+        """Replace rows of the dt_matrix by the vectorization of their
+        documents with the fitted vectorizer.
+
+        Parameters
+        ----------
+        rows : array of ints
+            positions of the documents whose 'corpus' changed
+
+        """
+        dt_rows = self.vectorizer.transform(self.df_preprocessed['corpus'].values[rows].tolist())
+        n_documents = self.dt_matrix.shape[0]
+        kept = np.ones(n_documents, dtype=self.dt_matrix.dtype)
+        kept[rows] = 0
+        placement = csr_matrix((np.ones(len(rows), dtype=self.dt_matrix.dtype),
+                                (rows, np.arange(len(rows)))), shape=(n_documents, len(rows)))
+        dt_matrix = csr_matrix(diags(kept, dtype=kept.dtype) @ self.dt_matrix + placement @ dt_rows)
+        dt_matrix.eliminate_zeros()
+        dt_matrix.sort_indices()
+        self.dt_matrix = dt_matrix
+        self.word_totals = get_word_totals(dt_matrix)
 
     def compute_distance(self, input_data):
         """Compute the distance between the input text and each document
@@ -111,6 +260,18 @@ class CorpusVect():
             logging.error(("The corpus column should be either 'description'"
                            "or 'comment'"))
 
+    def memory_usage(self):
+        """Estimate the memory used by the CorpusVect, in bytes."""
+        df_size = self.df_preprocessed.memory_usage(index=True, deep=True).sum()
+        dt_matrix_size = (self.dt_matrix.data.nbytes + self.dt_matrix.indices.nbytes
+                          + self.dt_matrix.indptr.nbytes + self.word_totals.nbytes)
+        vocabulary_size = sys.getsizeof(self.vectorizer.vocabulary_) \
+            + sum(sys.getsizeof(word) for word in self.vectorizer.vocabulary_)
+        if hasattr(self.vectorizer, 'idf_'):
+            vocabulary_size += self.vectorizer.idf_.nbytes
+
+        return int(df_size + dt_matrix_size + vocabulary_size)
+
     def save(self):
         """Save CorpusVect."""
         now = datetime.datetime.now().strftime("%Y%m%d_%H%M")
@@ -124,8 +285,9 @@ class CorpusVect():
         logging.info('Saving to: {}'.format(vect_path))
         with open(vect_path, 'wb') as f:
             pickle.dump([self.df_preprocessed, self.vectorizer,
-                         self.dt_matrix],
+                         self.dt_matrix, self.child_tables],
                         f, protocol=pickle.HIGHEST_PROTOCOL)
+        self.vect_filepath = vect_path
 
     def load(self, vect_filepath=None):
         """Load CorpusVect.
@@ -133,21 +295,40 @@ class CorpusVect():
         Parameters
         ----------
         vect_filepath : string
-            path to a specific file to load
+            path to a specific file to load, the last saved file if None
 
         """
         if vect_filepath is not None:
             logging.info('Loading from: {}'.format(vect_filepath))
-            with open(vect_filepath, 'rb') as f:
-                self.df_preprocessed, self.vectorizer, self.dt_matrix = pickle.load(f)
         else:
-            vect_path = os.path.join(self.histo_path,
-                                     'vect_{}'.format(self.corpus_col))
-            vect_file = sorted(os.listdir(vect_path))[-1]
-            vect_filepath = os.path.join(vect_path, vect_file)
+            vect_filepath = self.get_last_filepath()
             print('Loading from: {}'.format(vect_filepath))
-            with open(vect_filepath, 'rb') as f:
-                self.df_preprocessed, self.vectorizer, self.dt_matrix = pickle.load(f)
+        with open(vect_filepath, 'rb') as f:
+            contents = pickle.load(f)
+        # The CorpusVect saved before the child tables have 3 objects
+        self.df_preprocessed, self.vectorizer, self.dt_matrix = contents[:3]
+        self.child_tables = contents[3] if len(contents) > 3 else None
+        self.word_totals = get_word_totals(self.dt_matrix)
+        self.vect_filepath = vect_filepath
+
+    def make_shards(self, shard_bounds):
+        """Split the dt_matrix into row shards, which share its memory.
+
+        Parameters
+        ----------
+        shard_bounds : list of tuples
+            (start, stop) rows of each shard
+
+        """
+        dt_matrix = csr_matrix(self.dt_matrix)
+        self.dt_shards = [get_row_shard(dt_matrix, start, stop) for start, stop in shard_bounds]
+
+    def get_last_filepath(self):
+        """Get the path to the last saved CorpusVect."""
+        vect_path = os.path.join(self.histo_path,
+                                 'vect_{}'.format(self.corpus_col))
+        vect_file = sorted(os.listdir(vect_path))[-1]
+        return os.path.join(vect_path, vect_file)
 
 
 def distance_to_description(corpus_vect, input_data):
@@ -167,11 +348,8 @@ def distance_to_description(corpus_vect, input_data):
         dataframe with the 'similarity' column containing the calculated distances
 
     """
-    input_vect = corpus_vect.vectorizer.transform([input_data])
-
-    cosine_similarities = cosine_similarity(input_vect,
-                                            corpus_vect.dt_matrix).flatten()
-    corpus_vect.df_preprocessed['similarity'] = cosine_similarities
+    corpus_vect.df_preprocessed['similarity'] = description_similarities(corpus_vect,
+                                                                         [input_data])[0]
 
     return corpus_vect.df_preprocessed
 
@@ -193,23 +371,212 @@ def distance_to_comment(corpus_vect, input_data):
         dataframe with the 'similarity' column containing the calculated distances
 
     """
-    corpus_vect.df_preprocessed['similarity'] = 0.
-
-    for word in input_data.split():
-        try:
-            idx = corpus_vect.vectorizer.vocabulary_[word]
-            dt_matrix_idx = corpus_vect.dt_matrix[:, idx].toarray() \
-                                       .astype(float)[:, 0]
-            count_similarity = dt_matrix_idx / dt_matrix_idx.sum()
-            count_similarity[count_similarity == 0] = -1
-            corpus_vect.df_preprocessed['similarity'] += count_similarity
-        except KeyError:
-            pass
-
-    max_sim = corpus_vect.df_preprocessed['similarity'].max()
-    min_sim = corpus_vect.df_preprocessed['similarity'].min()
-    corpus_vect.df_preprocessed['similarity'] = ((corpus_vect.df_preprocessed['similarity']
-                                                 - min_sim)
-                                                 / (max_sim - min_sim))
+    corpus_vect.df_preprocessed['similarity'] = comment_similarities(corpus_vect,
+                                                                     [input_data])[0]
 
     return corpus_vect.df_preprocessed
+
+
+def description_similarities(corpus_vect, inputs, executor=None, rows=None):
+    """Compute the cosine similarity between each input text and each document
+    of the 'description' column, in a single pass over the dt_matrix.
+
+    Parameters
+    ----------
+    corpus_vect : CorpusVect
+        instance of the CorpusVect class
+    inputs : list of strings
+        preprocessed user searches
+    executor : concurrent.futures.Executor
+        executor scoring the shards of the dt_matrix concurrently, the
+        dt_matrix is scored at once if None or if it isn't sharded
+    rows : array of ints
+        positions of the documents to score, all the documents if None
+
+    Returns
+    -------
+    similarities : array of floats
+        similarities of shape (number of inputs, number of scored documents)
+
+    """
+    inputs_vect = corpus_vect.vectorizer.transform(inputs)
+
+    if rows is not None:
+        return cosine_similarity(inputs_vect, corpus_vect.dt_matrix[rows])
+    if executor is None or len(corpus_vect.dt_shards) < 2:
+        return cosine_similarity(inputs_vect, corpus_vect.dt_matrix)
+    # The similarity of a document only depends on its row
+    return np.hstack(list(executor.map(lambda dt_shard: cosine_similarity(inputs_vect, dt_shard),
+                                       corpus_vect.dt_shards)))
+
+
+def comment_similarities(corpus_vect, inputs, executor=None, rows=None):
+    """Compute the similarity between each input text and each document of the
+    'comment' column.
+
+    The similarity of a document is the sum, over the words of the input, of
+    the share of the word occurrences in the document among all the
+    documents, or -1 if the document doesn't contain the word. It is then
+    normalized between 0 and 1 over the scored documents. The columns of the
+    dt_matrix are extracted once for all the inputs, from the scored rows
+    only.
+
+    Parameters
+    ----------
+    corpus_vect : CorpusVect
+        instance of the CorpusVect class
+    inputs : list of strings
+        preprocessed user searches
+    executor : concurrent.futures.Executor
+        executor extracting the columns of the shards of the dt_matrix
+        concurrently, the dt_matrix is used at once if None or if it isn't
+        sharded
+    rows : array of ints
+        positions of the documents to score, all the documents if None
+
+    Returns
+    -------
+    similarities : array of floats
+        similarities of shape (number of inputs, number of scored documents)
+
+    """
+    n_documents = corpus_vect.dt_matrix.shape[0] if rows is None else len(rows)
+    similarities = np.zeros((len(inputs), n_documents))
+    words = [word for word in dict.fromkeys(' '.join(inputs).split())
+             if word in corpus_vect.vectorizer.vocabulary_]
+    count_similarities = word_count_similarities(corpus_vect, words, executor, rows)
+
+    for i, input_data in enumerate(inputs):
+        similarity = np.zeros(n_documents)
+        for word in input_data.split():
+            if word in count_similarities:
+                similarity += count_similarities[word]
+
+        max_sim = similarity.max()
+        min_sim = similarity.min()
+        with np.errstate(divide='ignore', invalid='ignore'):
+            similarities[i] = (similarity - min_sim) / (max_sim - min_sim)
+
+    return similarities
+
+
+def word_count_similarities(corpus_vect, words, executor=None, rows=None):
+    """Compute the share of the occurrences of each word in each document of
+    the 'comment' column, or -1 for the documents without the word.
+
+    Parameters
+    ----------
+    corpus_vect : CorpusVect
+        instance of the CorpusVect class
+    words : list of strings
+        preprocessed words of the user searches, in the vocabulary
+    executor : concurrent.futures.Executor
+        executor extracting the columns of the shards of the dt_matrix
+        concurrently, the dt_matrix is used at once if None or if it isn't
+        sharded
+    rows : array of ints
+        positions of the documents whose shares are computed, all the
+        documents if None
+
+    Returns
+    -------
+    count_similarities : dict
+        share of the word occurrences of each document, for each word
+
+    """
+    if len(words) == 0:
+        return {}
+
+    idxs = [corpus_vect.vectorizer.vocabulary_[word] for word in words]
+    if rows is not None:
+        # The rows are selected before the columns, the other rows aren't read
+        word_counts = corpus_vect.dt_matrix[rows][:, idxs].toarray()
+    elif executor is None or len(corpus_vect.dt_shards) < 2:
+        word_counts = corpus_vect.dt_matrix[:, idxs].toarray()
+    else:
+        word_counts = np.vstack(list(executor.map(lambda dt_shard: dt_shard[:, idxs].toarray(),
+                                                  corpus_vect.dt_shards)))
+    word_counts = word_counts.astype(float)
+    # The occurrences are integers: their sum doesn't depend on the sharding
+    word_totals = corpus_vect.word_totals[idxs]
+
+    count_similarities = {}
+    for j, word in enumerate(words):
+        count_similarity = word_counts[:, j] / word_totals[j]
+        count_similarity[count_similarity == 0] = -1
+        count_similarities[word] = count_similarity
+
+    return count_similarities
+
+
+def get_word_totals(dt_matrix):
+    """Get the sum of each column of a document-term matrix, in a single pass
+    over its values."""
+    return np.asarray(dt_matrix.sum(axis=0), dtype=float).ravel()
+
+
+def get_previous_positions(df, df_previous):
+    """Get the position of each report in the dataframe of a previous training.
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        dataframe with the reports
+    df_previous : pd.DataFrame
+        df_preprocessed of a previous training
+
+    Returns
+    -------
+    positions : array of ints
+        position of each report in df_previous, -1 for the reports which are
+        new or changed
+
+    """
+    if not set(df.columns).issubset(df_previous.columns):
+        return np.full(len(df), -1)
+    previous_positions = pd.Series(np.arange(len(df_previous)),
+                                   index=preprocessing.hash_reports(df_previous[df.columns]))
+    previous_positions = previous_positions[~previous_positions.index.duplicated()]
+    return previous_positions.reindex(preprocessing.hash_reports(df)).fillna(-1) \
+                             .astype(int).values
+
+
+def get_shard_bounds(n_rows, n_shards):
+    """Get the rows of 'n_shards' contiguous shards of similar sizes.
+
+    Parameters
+    ----------
+    n_rows : int
+        number of rows to split
+    n_shards : int
+        number of shards
+
+    Returns
+    -------
+    shard_bounds : list of tuples
+        (start, stop) rows of each non empty shard
+
+    """
+    edges = np.linspace(0, n_rows, max(n_shards, 1) + 1).astype(int)
+    return [(start, stop) for start, stop in zip(edges[:-1].tolist(), edges[1:].tolist())
+            if stop > start]
+
+
+def get_row_shard(dt_matrix, start, stop):
+    """Get a row shard of a csr matrix, sharing its data & indices arrays.
+
+    Parameters
+    ----------
+    dt_matrix : scipy.sparse.csr_matrix
+        matrix to split
+    start : int
+        first row of the shard
+    stop : int
+        row after the last row of the shard
+
+    """
+    indptr = dt_matrix.indptr[start:stop + 1]
+    return csr_matrix((dt_matrix.data[indptr[0]:indptr[-1]],
+                       dt_matrix.indices[indptr[0]:indptr[-1]],
+                       indptr - indptr[0]),
+                      shape=(stop - start, dt_matrix.shape[1]), copy=False)
@@ -1,8 +1,18 @@
+import os
 import json
+import time
+import logging
+import threading
+from contextlib import contextmanager, ExitStack
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
 
-from .kernel import DiamanKernel
+from . import serializer
+from .kernel import DiamanKernel, get_last_vect_filepaths, get_vect_stamps
 from ..configuration.data import DataConfig
+from ..domain.preprocessing import normalize_query
 from ..pipeline import search_pipeline
+from ..utils.cache import ResponseCache
 
 
 class DiamanHelp(DataConfig):
@@ -13,21 +23,356 @@ class DiamanHelp(DataConfig):
     ----------
     indus_languages : list of strings
         list of the languages integrated into the industrialisation
-    kernels : dict of diaman.interface.kernel.DiamanKernel
-        dict containing the kernels for each tuple (language, code_shop)
+    kernels : OrderedDict of diaman.interface.kernel.DiamanKernel
+        resident kernels for each tuple (language, code_shop), from the least
+        to the most recently used
+    reload_stats : dict
+        reloads of each tuple (language, code_shop): number of reloads, time
+        of the last reload & error of the last failed reload
+    response_cache : diaman.utils.cache.ResponseCache or None
+        cache of the encoded search results, None if disabled
 
     """
-    def __init__(self):
+    def __init__(self, serving_params=None):
+        """Instantiate a DiamanHelp instance.
+
+        Parameters
+        ----------
+        serving_params : configuration.data.ServingParameters
+            serving parameters overriding the ones recorded in
+            conf/data/serving_conf.yml
+
+        """
         DataConfig.__init__(self)
+        if serving_params is not None:
+            self.serving_params = serving_params
+        self.response_cache = None
+        if self.cache_params.enabled:
+            self.response_cache = ResponseCache(self.cache_params.max_memory * 2**20,
+                                                self.cache_params.ttl)
         self._instantiate_kernels()
+        if self.serving_params.reload_interval is not None:
+            self.start_reload_watcher()
 
     def _instantiate_kernels(self):
-        """Instantiate a kernel for each tuple (language, code_shop)."""
-        self.kernels = {}
-        for language in self.indus_languages:
-            for code_shop in self.get_shops(language):
-                self.kernels['{}_{}'.format(language, code_shop)] = DiamanKernel(language,
-                                                                                 code_shop)
+        """Instantiate a kernel for each tuple (language, code_shop), or only
+        for the preloaded ones in lazy loading mode.
+
+        The kernels are loaded concurrently by 'load_workers' threads or
+        processes when 'load_workers' is greater than 1.
+        """
+        self.kernels = OrderedDict()
+        self._kernels_lock = threading.Lock()
+        self._loading_locks = {}
+        self._data_configs = {}
+        self._retired_kernels = []
+        self._pending_versions = {}
+        self._failed_versions = {}
+        self._reload_thread = None
+        self._reload_stop = threading.Event()
+        self.reload_stats = {}
+        self._search_executor = None
+        self._search_executor_pid = None
+
+        if self.serving_params.lazy_loading:
+            kernel_keys = [tuple(key.split('_', 1)) for key in self.serving_params.preload]
+        else:
+            kernel_keys = [(language, code_shop) for language in self.indus_languages
+                           for code_shop in self.get_shops(language)]
+
+        start_time = time.monotonic()
+        if (self.serving_params.load_workers > 1) and (len(kernel_keys) > 1):
+            if self.serving_params.load_executor == 'process':
+                executor_class = ProcessPoolExecutor
+            else:
+                executor_class = ThreadPoolExecutor
+            with executor_class(max_workers=self.serving_params.load_workers) as executor:
+                futures = {executor.submit(DiamanKernel, language, code_shop,
+                                           data_config=self._get_data_config(language)):
+                           (language, code_shop)
+                           for language, code_shop in kernel_keys}
+                for future in as_completed(futures):
+                    self._add_kernel(*futures[future], future.result())
+        else:
+            for language, code_shop in kernel_keys:
+                self._get_kernel(language, code_shop)
+
+        logging.info('Loaded {} kernels in {:.1f}s'.format(len(kernel_keys),
+                                                           time.monotonic() - start_time))
+
+    def _get_data_config(self, language):
+        """Get the data configuration of a language, shared by its kernels.
+
+        Parameters
+        ----------
+        language : string
+            user language
+
+        """
+        if language not in self._data_configs:
+            self._data_configs[language] = DataConfig(language)
+        return self._data_configs[language]
+
+    def _get_kernel(self, language, code_shop):
+        """Get the kernel of a tuple (language, code_shop), loading it if it
+        isn't resident.
+
+        Parameters
+        ----------
+        language : string
+            user language
+        code_shop : string
+            user shop
+
+        """
+        key = '{}_{}'.format(language, code_shop)
+        with self._kernels_lock:
+            if key in self.kernels:
+                self.kernels.move_to_end(key)
+                return self.kernels[key]
+            loading_lock = self._loading_locks.setdefault(key, threading.Lock())
+
+        # Load the kernel once, even with concurrent requests of the same shop
+        with loading_lock:
+            with self._kernels_lock:
+                if key in self.kernels:
+                    self.kernels.move_to_end(key)
+                    return self.kernels[key]
+
+            kernel = DiamanKernel(language, code_shop,
+                                  data_config=self._get_data_config(language))
+            self._add_kernel(language, code_shop, kernel)
+
+        return kernel
+
+    @contextmanager
+    def _use_kernel(self, language, code_shop):
+        """Get the kernel of a tuple (language, code_shop) for the duration of a
+        request, so that a reloaded kernel is retired once its requests are
+        answered.
+
+        Parameters
+        ----------
+        language : string
+            user language
+        code_shop : string
+            user shop
+
+        """
+        kernel = self._get_kernel(language, code_shop)
+        with self._kernels_lock:
+            kernel.in_flight += 1
+        try:
+            yield kernel
+        finally:
+            with self._kernels_lock:
+                kernel.in_flight -= 1
+                self._drop_retired_kernels()
+
+    def _add_kernel(self, language, code_shop, kernel):
+        """Add a loaded kernel to the resident kernels.
+
+        Parameters
+        ----------
+        language : string
+            user language
+        code_shop : string
+            user shop
+        kernel : diaman.interface.kernel.DiamanKernel
+            loaded kernel of the tuple (language, code_shop)
+
+        """
+        key = '{}_{}'.format(language, code_shop)
+        if self.response_cache is not None:
+            # The kernel may be a new version of an evicted kernel
+            self.response_cache.invalidate(key)
+        with self._kernels_lock:
+            self.kernels[key] = kernel
+            self._evict_kernels(key)
+            logging.info(('Loaded the {} kernel in {:.1f}s ({:.1f} MB), '
+                          '{} resident kernels ({:.1f} MB)')
+                         .format(key, kernel.load_time, kernel.memory_size / 2**20,
+                                 len(self.kernels), self.get_kernels_memory_size() / 2**20))
+
+    def _evict_kernels(self, kept_key):
+        """Evict the least recently used kernels until the memory budget is met.
+
+        Parameters
+        ----------
+        kept_key : string
+            key of the kernel which must stay resident
+
+        """
+        if self.serving_params.memory_budget is None:
+            return
+
+        memory_budget = self.serving_params.memory_budget * 2**20
+        for key in list(self.kernels.keys()):
+            if self.get_kernels_memory_size() <= memory_budget:
+                break
+            if key != kept_key:
+                logging.info('Evicting the {} kernel'.format(key))
+                del self.kernels[key]
+
+    def start_reload_watcher(self, reload_interval=None):
+        """Start a background thread reloading the resident kernels when new
+        vectorizers are saved in the histo directory.
+
+        Parameters
+        ----------
+        reload_interval : float
+            time between two checks of the histo directory, in seconds,
+            'reload_interval' of the serving parameters if None
+
+        """
+        reload_interval = self.serving_params.reload_interval if reload_interval is None \
+            else reload_interval
+        self._reload_stop.clear()
+        self._reload_thread = threading.Thread(target=self._watch_reloads,
+                                               args=(reload_interval,),
+                                               name='diaman-reload', daemon=True)
+        self._reload_thread.start()
+        logging.info('Checking the new kernels every {}s'.format(reload_interval))
+
+    def stop_reload_watcher(self):
+        """Stop the background thread reloading the kernels."""
+        if self._reload_thread is not None:
+            self._reload_stop.set()
+            self._reload_thread.join()
+            self._reload_thread = None
+
+    def _watch_reloads(self, reload_interval):
+        """Check the new kernels every 'reload_interval' seconds until stopped."""
+        while not self._reload_stop.wait(reload_interval):
+            try:
+                self.check_reloads()
+            except Exception as e:
+                logging.exception(e)
+
+    def check_reloads(self):
+        """Reload the resident kernels whose vectorizers were saved again.
+
+        A new version is loaded once its files are unchanged between two
+        checks, so that the files of a running training are not loaded before
+        both vectorizers are saved. It is loaded off the request path &
+        swapped in only if it loaded successfully, the working kernel keeping
+        serving otherwise. A failed version is not retried until its files are
+        written again.
+
+        Returns
+        -------
+        reloaded_keys : list of strings
+            keys of the reloaded kernels
+
+        """
+        with self._kernels_lock:
+            resident_kernels = list(self.kernels.items())
+
+        reloaded_keys = []
+        for key, kernel in resident_kernels:
+            language, code_shop = key.split('_', 1)
+            try:
+                vect_filepaths = get_last_vect_filepaths(language, code_shop)
+                version = {corpus_col: os.path.basename(vect_filepath)
+                           for corpus_col, vect_filepath in vect_filepaths.items()}
+                if version == kernel.version:
+                    continue
+                stamps = get_vect_stamps(vect_filepaths)
+            except OSError as e:
+                logging.warning('Cannot check the {} kernel: {}'.format(key, e))
+                continue
+            if stamps == self._failed_versions.get(key):
+                continue
+            if stamps != self._pending_versions.get(key):
+                self._pending_versions[key] = stamps
+                continue
+
+            if self._reload_kernel(language, code_shop, vect_filepaths):
+                reloaded_keys.append(key)
+        return reloaded_keys
+
+    def _reload_kernel(self, language, code_shop, vect_filepaths):
+        """Load a new version of a kernel & swap it with the resident one.
+
+        Parameters
+        ----------
+        language : string
+            user language
+        code_shop : string
+            user shop
+        vect_filepaths : dict
+            paths to the vectorizers of the 'DESCR_ORDER' & 'COMMENT' columns
+
+        Returns
+        -------
+        reloaded : bool
+            True if the new version was swapped in
+
+        """
+        key = '{}_{}'.format(language, code_shop)
+        stats = self.reload_stats.setdefault(key, {'reloads': 0, 'failures': 0,
+                                                   'last_reload_time': None,
+                                                   'last_error': None})
+        self._pending_versions.pop(key, None)
+        try:
+            kernel = DiamanKernel(language, code_shop,
+                                  description_vect_path=vect_filepaths['DESCR_ORDER'],
+                                  comment_vect_path=vect_filepaths['COMMENT'],
+                                  data_config=self._get_data_config(language))
+        except Exception as e:
+            logging.exception('Failed to reload the {} kernel, keeping the resident one'
+                              .format(key))
+            try:
+                self._failed_versions[key] = get_vect_stamps(vect_filepaths)
+            except OSError:
+                # The files were removed meanwhile: the next version is checked
+                pass
+            stats['failures'] += 1
+            stats['last_error'] = repr(e)
+            return False
+
+        with self._kernels_lock:
+            if key not in self.kernels:
+                # Evicted meanwhile: the new version is loaded on its next request
+                return False
+            old_kernel = self.kernels[key]
+            self.kernels[key] = kernel
+            self._retired_kernels.append(old_kernel)
+            self._drop_retired_kernels()
+            self._evict_kernels(key)
+        if self.response_cache is not None:
+            self.response_cache.invalidate(key)
+
+        stats['reloads'] += 1
+        stats['last_reload_time'] = kernel.load_time
+        stats['last_error'] = None
+        logging.info('Reloaded the {} kernel in {:.1f}s: {} -> {}'
+                     .format(key, kernel.load_time, old_kernel.version, kernel.version))
+        return True
+
+    def _drop_retired_kernels(self):
+        """Drop the retired kernels which have no request in flight anymore."""
+        self._retired_kernels = [kernel for kernel in self._retired_kernels
+                                 if kernel.in_flight > 0]
+
+    def get_kernels_version(self):
+        """Get the version of each resident kernel: files of its vectorizers."""
+        with self._kernels_lock:
+            return {key: kernel.version for key, kernel in self.kernels.items()}
+
+    def get_kernels_memory_size(self):
+        """Get the memory used by the resident kernels, in bytes."""
+        return sum(kernel.memory_size for kernel in self.kernels.values())
+
+    def get_kernels_memory(self):
+        """Get the memory used by each resident kernel, in bytes."""
+        with self._kernels_lock:
+            return {key: kernel.memory_size for key, kernel in self.kernels.items()}
+
+    def get_kernels_load_time(self):
+        """Get the load time of each resident kernel, in seconds."""
+        with self._kernels_lock:
+            return {key: kernel.load_time for key, kernel in self.kernels.items()}
 
     def _get_language_if_valid_search(self, code_site, code_shop):
         """Check if the site & the shop of the user are supported in diaman &
@@ -63,7 +408,8 @@ class DiamanHelp(DataConfig):
         return language
 
     def get_search_results(self, code_site, code_shop, search, site_filters,
-                           constructor_filters, equipment_filters):
+                           constructor_filters, equipment_filters, n_reports=50,
+                           encoded=False, date_from=None, date_to=None, recency_boost=0.):
         """Transform the dataframe with the matching reports into a json file
         and add the lists with the options for each filter (site, constructor,
         equipment).
@@ -82,6 +428,17 @@ class DiamanHelp(DataConfig):
             constructors selected by the user
         equipment_filters : list
             equipments selected by the user
+        n_reports : int
+            number of reports to return
+        encoded : bool
+            True to return the json file as utf-8 encoded bytes
+        date_from : string
+            first creation date of the reports, e.g. '2019-01-01'
+        date_to : string
+            last creation date of the reports, included
+        recency_boost : float
+            weight given at the recency of the reports in the sort, between
+            0 & 1
 
         """
         # Transform params in capital letters
@@ -91,35 +448,276 @@ class DiamanHelp(DataConfig):
         # Get language if valid search
         language = self._get_language_if_valid_search(code_site, code_shop)
 
+        # Make search, unless its results are cached
+        request = {'code_site': code_site, 'code_shop': code_shop, 'search': search,
+                   'site_filters': site_filters, 'constructor_filters': constructor_filters,
+                   'equipment_filters': equipment_filters, 'n_reports': n_reports,
+                   'date_from': date_from, 'date_to': date_to, 'recency_boost': recency_boost}
+        with self._use_kernel(language, code_shop) as kernel:
+            cache_key = self._get_cache_key(kernel, language, request)
+            cached_results = self._get_cached_results(cache_key, encoded)
+            if cached_results is not None:
+                return cached_results
+            search_results = search_pipeline.make_search(kernel,
+                                                         search,
+                                                         site_filters,
+                                                         constructor_filters,
+                                                         equipment_filters,
+                                                         n_reports,
+                                                         executor=self._get_search_executor(),
+                                                         date_from=date_from,
+                                                         date_to=date_to,
+                                                         recency_boost=recency_boost)
+
+        # Create the json file
+        return self._cache_search_results(cache_key, search_results, encoded)
+
+    def get_search_results_batch(self, requests, encoded=False):
+        """Get the search results of several requests, the searches of the same
+        shop being scored in a single pass over its reports.
+
+        Parameters
+        ----------
+        requests : list of dicts
+            parameters of get_search_results of each request: 'code_site',
+            'code_shop', 'search', 'site_filters', 'constructor_filters',
+            'equipment_filters' & optionally 'n_reports', 'date_from',
+            'date_to' & 'recency_boost'
+        encoded : bool
+            True to return the json files as utf-8 encoded bytes
+
+        Returns
+        -------
+        results : list
+            json file of each request, or the exception raised by the request,
+            which doesn't fail the other requests of the batch
+
+        """
+        results = [None] * len(requests)
+
+        # Group the valid requests by kernel
+        kernel_requests = OrderedDict()
+        for idx, request in enumerate(requests):
+            try:
+                if not isinstance(request['search'], str):
+                    raise TypeError('The search parameter must be a string.')
+                code_shop = request['code_shop'].upper()
+                language = self._get_language_if_valid_search(request['code_site'].upper(),
+                                                              code_shop)
+            except Exception as e:
+                results[idx] = e
+                continue
+            kernel_requests.setdefault((language, code_shop), []).append(idx)
+
+        # Make the searches of each kernel whose results aren't cached
+        for (language, code_shop), idxs in kernel_requests.items():
+            try:
+                with self._use_kernel(language, code_shop) as kernel:
+                    cache_keys = {}
+                    for idx in idxs:
+                        try:
+                            cache_keys[idx] = self._get_cache_key(kernel, language,
+                                                                  requests[idx])
+                            results[idx] = self._get_cached_results(cache_keys[idx], encoded)
+                        except Exception as e:
+                            results[idx] = e
+                    idxs = [idx for idx in idxs if results[idx] is None]
+                    if len(idxs) == 0:
+                        continue
+                    search_results = search_pipeline.make_search_batch(
+                        kernel, [requests[idx] for idx in idxs],
+                        executor=self._get_search_executor())
+            except Exception as e:
+                # The kernel couldn't be loaded or the searches couldn't be scored
+                logging.exception(e)
+                for idx in idxs:
+                    results[idx] = e
+                continue
+            for idx, search_result in zip(idxs, search_results):
+                if isinstance(search_result, Exception):
+                    results[idx] = search_result
+                else:
+                    results[idx] = self._cache_search_results(cache_keys[idx], search_result,
+                                                              encoded)
+
+        return results
+
+    def _get_cache_key(self, kernel, language, request):
+        """Get the key of the results of a search in the response cache.
+
+        Parameters
+        ----------
+        kernel : diaman.interface.kernel.DiamanKernel
+            kernel of the search, whose version is part of the key so that the
+            results of a retired kernel cached after its invalidation are
+            never served
+        language : string
+            user language
+        request : dict
+            parameters of get_search_results
+
+        """
+        return ('{}_{}'.format(language, request['code_shop'].upper()),
+                request['code_site'].upper(),
+                normalize_query(request['search']),
+                tuple(sorted(set(request['site_filters']))),
+                tuple(sorted(set(request['constructor_filters']))),
+                tuple(sorted(set(request['equipment_filters']))),
+                request.get('n_reports', 50),
+                request.get('date_from'),
+                request.get('date_to'),
+                request.get('recency_boost', 0.),
+                kernel.slider_sim_weight,
+                kernel.slider_coeff_detail,
+                tuple(sorted(kernel.version.items())))
+
+    def _get_cached_results(self, cache_key, encoded=False):
+        """Get the cached results of a search.
+
+        Parameters
+        ----------
+        cache_key : tuple
+            key of the results in the response cache
+        encoded : bool
+            True to return the json file as utf-8 encoded bytes
+
+        Returns
+        -------
+        search_results : dict, bytes or None
+            json file of the search, None if it isn't cached
+
+        """
+        if self.response_cache is None:
+            return None
+        response = self.response_cache.get(cache_key)
+        if response is None or encoded:
+            return response
+        return json.loads(response.decode('utf-8'))
+
+    def _cache_search_results(self, cache_key, search_results, encoded=False):
+        """Create the json file of the search results & cache it.
+
+        Parameters
+        ----------
+        cache_key : tuple
+            key of the results in the response cache
+        search_results : tuple
+            results of search_pipeline.make_search
+        encoded : bool
+            True to return the json file as utf-8 encoded bytes
+
+        """
+        if self.response_cache is None:
+            return self._format_search_results(*search_results, encoded=encoded)
+        response = self._format_search_results(*search_results, encoded=True)
+        self.response_cache.put(cache_key, response)
+        return response if encoded else json.loads(response.decode('utf-8'))
+
+    def get_federated_search_results(self, code_site, search, site_filters,
+                                     constructor_filters, equipment_filters,
+                                     code_shops=None, n_reports=50, encoded=False,
+                                     date_from=None, date_to=None, recency_boost=0.):
+        """Search the reports of several shops of the language of the user site
+        & merge their top reports.
+
+        Each report of the 'ORDER_LIST' has an additional 'CODE_SHOP' entry &
+        the filter options are the union of the options of the shops.
+
+        Parameters
+        ----------
+        code_site : string
+            user site
+        search : string
+            user search
+        site_filters : list
+            sites selected by the user
+        constructor_filters : list
+            constructors selected by the user
+        equipment_filters : list
+            equipments selected by the user
+        code_shops : list of strings
+            shops to search, all the shops of the language if None
+        n_reports : int
+            number of reports to return
+        encoded : bool
+            True to return the json file as utf-8 encoded bytes
+        date_from : string
+            first creation date of the reports, e.g. '2019-01-01'
+        date_to : string
+            last creation date of the reports, included
+        recency_boost : float
+            weight given at the recency of the reports in the sort, between
+            0 & 1
+
+        """
+        # Get language & shops if valid search
+        code_site = code_site.upper()
+        if code_shops is None:
+            if code_site not in self.psa_sites:
+                raise ValueError((f'The code_site {code_site} is not related to a PSA site. '
+                                  'Please enter a valid code_site.'))
+            code_shops = self.get_shops(self.get_language(code_site))
+        code_shops = [code_shop.upper() for code_shop in code_shops]
+        languages = [self._get_language_if_valid_search(code_site, code_shop)
+                     for code_shop in code_shops]
+
         # Make search
-        (df_reports,
-         matching_sites,
-         matching_constructors,
-         matching_equipments) = search_pipeline.make_search(self.kernels['{}_{}'.format(language,
-                                                                                        code_shop)],
-                                                            search,
-                                                            site_filters,
-                                                            constructor_filters,
-                                                            equipment_filters)
-
-        # Format the entries of the final json file
-        df_reports['ERDAT'] = df_reports['ERDAT'].astype(str)
-        df_reports['COMMENT'] = df_reports['COMMENT'].apply(lambda x: [x])
-        df_reports['OPERATION'] = df_reports['DURA_EQUI'].apply(lambda x: [{"DURA_EQUI": x}])
-        df_reports['COMPONENTS'] = df_reports['COMPONENTS'] \
-            .apply(lambda components: [{"MATNR": component[0], "MATL_DESC": "string",
-                                        "QUANTITY": component[2]} for component in components])
-        df_reports['MEDIAS'] = df_reports['MEDIAS'] \
-            .apply(lambda medias: [{"DOC_URL": media[0], "DOC_TYPE": media[1]}
-                                   for media in medias])
+        with ExitStack() as stack:
+            kernels = {code_shop: stack.enter_context(self._use_kernel(language, code_shop))
+                       for language, code_shop in zip(languages, code_shops)}
+            search_results = search_pipeline.make_federated_search(kernels,
+                                                                   search,
+                                                                   site_filters,
+                                                                   constructor_filters,
+                                                                   equipment_filters,
+                                                                   n_reports,
+                                                                   self._get_search_executor(),
+                                                                   date_from,
+                                                                   date_to,
+                                                                   recency_boost)
 
         # Create the json file
-        df_reports = df_reports[self.diaman_search_cols].to_json(orient='index')
-        json_reports = json.loads(df_reports)
-        return {'ORDER_LIST': [json_reports[k] for k in json_reports.keys()],
-                'SITES': matching_sites,
-                'CONSTRUCTORS': matching_constructors,
-                'EQUIPMENTS': matching_equipments}
+        return self._format_search_results(*search_results, encoded=encoded,
+                                           search_cols=self.diaman_search_cols + ['CODE_SHOP'])
+
+    def _get_search_executor(self):
+        """Get the thread pool running the searches of the federated searches &
+        of the shards, created in each process as its threads don't survive a
+        fork."""
+        if self._search_executor_pid != os.getpid():
+            self._search_executor = ThreadPoolExecutor(
+                max_workers=self.serving_params.search_workers)
+            self._search_executor_pid = os.getpid()
+        return self._search_executor
+
+    def _format_search_results(self, df_reports, matching_sites, matching_constructors,
+                               matching_equipments, encoded=False, search_cols=None):
+        """Create the json file of the search results.
+
+        Parameters
+        ----------
+        df_reports : pd.DataFrame
+            dataframe with the matching reports, which are filtered and sorted
+        matching_sites : list
+            site options of the matching reports
+        matching_constructors : list
+            constructor options of the matching reports
+        matching_equipments : list
+            equipment options of the matching reports
+        encoded : bool
+            True to return the json file as utf-8 encoded bytes
+        search_cols : list of strings
+            entries of each report, 'diaman_search_cols' if None
+
+        """
+        search_cols = self.diaman_search_cols if search_cols is None else search_cols
+        search_results = {'ORDER_LIST': serializer.serialize_reports(df_reports, search_cols),
+                          'SITES': matching_sites,
+                          'CONSTRUCTORS': matching_constructors,
+                          'EQUIPMENTS': matching_equipments}
+        if encoded:
+            return serializer.encode_search_results(search_results)
+        return search_results
 
     def get_refine_results(self, code_site, code_shop, search):
         """Transform the list with the top words of the topics related to
@@ -143,7 +741,6 @@ class DiamanHelp(DataConfig):
         language = self._get_language_if_valid_search(code_site, code_shop)
 
         # Make refine
-        top_words_topics = search_pipeline.make_refine(self.kernels['{}_{}'.format(language,
-                                                                                   code_shop)],
-                                                       search)
+        with self._use_kernel(language, code_shop) as kernel:
+            top_words_topics = search_pipeline.make_refine(kernel, search)
         return {'top_words_topics': top_words_topics}
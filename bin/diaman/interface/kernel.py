@@ -1,16 +1,36 @@
+import os
+import time
+
+from . import serializer
 from ..configuration.data import DataConfig
-from ..domain.vectorizer import CorpusVect
+from ..domain.vectorizer import CorpusVect, get_shard_bounds
+from ..domain.report import build_date_index
+from ..utils import histo
 
 
 class DiamanKernel(object):
     """Instantiate a kernel for each tuple (language, code_shop)."""
     def __init__(self, language, code_shop,
-                 description_vect_path=None, comment_vect_path=None):
-        # DataConfig instance
-        data_config = DataConfig(language)
+                 description_vect_path=None, comment_vect_path=None,
+                 data_config=None):
+        start_time = time.monotonic()
+
+        # DataConfig instance, shared by the kernels of a same language if provided
+        if data_config is None:
+            data_config = DataConfig(language)
         self.stopwords = data_config.stopwords
         self.word_dict = data_config.word_dict
         self.processing_params = data_config.processing_params
+        self.refine_params = data_config.refine_params
+
+        # Number of topics selected for the shop at training time
+        lda_sweep = histo.load_artifact(language, code_shop, 'lda_sweep')
+        if lda_sweep is not None:
+            self.processing_params = self.processing_params._replace(
+                n_components=lda_sweep['n_components'])
+
+        # Topics of the frequent searches precomputed at training time
+        self.refine_topics = histo.load_artifact(language, code_shop, 'refine_topics') or {}
 
         # Vectorizers for the 'description' and 'comment' columns
         self.description_vect = CorpusVect(language, code_shop, 'DESCR_ORDER')
@@ -19,6 +39,78 @@ class DiamanKernel(object):
         self.comment_vect = CorpusVect(language, code_shop, 'COMMENT')
         self.comment_vect.load(comment_vect_path)
 
+        # Row shards of the reports, searched concurrently if there are several
+        self.shards = get_shard_bounds(self.comment_vect.dt_matrix.shape[0],
+                                       data_config.serving_params.n_shards)
+        if len(self.shards) > 1:
+            self.description_vect.make_shards(self.shards)
+            self.comment_vect.make_shards(self.shards)
+
+        # Spare parts & medias of the reports, formatted once for the search results
+        # from their child tables saved at training time, which aren't kept
+        serializer.format_nested_cols(self.comment_vect.df_preprocessed,
+                                      self.comment_vect.child_tables)
+        self.comment_vect.child_tables = None
+
+        # Reports sorted by creation date, to filter the dates before the scoring
+        self.date_index = build_date_index(self.comment_vect.df_preprocessed)
+
         # Weights used for the outputs
         self.slider_sim_weight = 0.8
         self.slider_coeff_detail = 0.2
+
+        # Version of the kernel: files of the loaded vectorizers
+        self.version = {corpus_vect.corpus_col: os.path.basename(corpus_vect.vect_filepath)
+                        for corpus_vect in (self.description_vect, self.comment_vect)}
+
+        # Number of requests using the kernel
+        self.in_flight = 0
+
+        # Memory used by the kernel, in bytes, & load time, in seconds
+        self.memory_size = self.memory_usage()
+        self.load_time = time.monotonic() - start_time
+
+    def memory_usage(self):
+        """Estimate the memory used by the vectorizers & the date index of the
+        kernel, in bytes."""
+        return self.description_vect.memory_usage() + self.comment_vect.memory_usage() \
+            + sum(array.nbytes for array in self.date_index)
+
+
+def get_last_vect_filepaths(language, code_shop):
+    """Get the paths to the last saved vectorizers of a tuple (language, code_shop).
+
+    Parameters
+    ----------
+    language : string
+        language of the reports
+    code_shop : string
+        shop of the plant
+
+    Returns
+    -------
+    vect_filepaths : dict
+        path to the last saved vectorizer of the 'DESCR_ORDER' & 'COMMENT'
+        columns
+
+    """
+    return {corpus_col: CorpusVect(language, code_shop, corpus_col).get_last_filepath()
+            for corpus_col in ('DESCR_ORDER', 'COMMENT')}
+
+
+def get_vect_stamps(vect_filepaths):
+    """Get the stamp of the vectorizer files of a kernel: filename,
+    modification time & size of each file, which change when it is written
+    again.
+
+    Parameters
+    ----------
+    vect_filepaths : dict
+        paths to the vectorizers of the 'DESCR_ORDER' & 'COMMENT' columns
+
+    """
+    stamps = {}
+    for corpus_col, vect_filepath in vect_filepaths.items():
+        stat = os.stat(vect_filepath)
+        stamps[corpus_col] = (os.path.basename(vect_filepath), stat.st_mtime_ns, stat.st_size)
+    return stamps
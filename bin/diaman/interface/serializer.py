@@ -0,0 +1,126 @@
+import json
+import numpy as np
+
+from ..domain import report
+
+
+def serialize_reports(df_reports, search_cols):
+    """Build the list of the reports of the search results.
+
+    Each column is converted once into a list of json serializable values,
+    then the reports are assembled in a single pass over the rows. The spare
+    parts & the medias are already formatted, see format_nested_cols.
+
+    Parameters
+    ----------
+    df_reports : pd.DataFrame
+        dataframe with the matching reports, which are filtered and sorted
+    search_cols : list of strings
+        entries of each report of the search results
+
+    Returns
+    -------
+    order_list : list of dicts
+        list of the reports with all the information needed
+
+    """
+    columns = [COLUMN_FORMATTERS.get(col, format_values)(df_reports, col)
+               for col in search_cols]
+    return [dict(zip(search_cols, row)) for row in zip(*columns)]
+
+
+def encode_search_results(search_results):
+    """Encode the search results into json bytes.
+
+    Parameters
+    ----------
+    search_results : dict
+        search results with the 'ORDER_LIST' & the filter options
+
+    """
+    return json.dumps(search_results, separators=(',', ':')).encode('utf-8')
+
+
+def format_values(df_reports, col):
+    """Get the values of a column as json serializable values: floats are
+    rounded to 10 decimals & missing values are replaced by None.
+
+    Parameters
+    ----------
+    df_reports : pd.DataFrame
+        dataframe with the matching reports
+    col : string
+        name of the column
+
+    """
+    values = df_reports[col].values
+    if values.dtype.kind == 'f':
+        return [None if np.isnan(value) else round(value, 10) for value in values.tolist()]
+    if values.dtype.kind == 'O':
+        return [None if isinstance(value, float) and np.isnan(value) else value
+                for value in values.tolist()]
+    return values.tolist()
+
+
+def format_dates(df_reports, col):
+    """Get the dates of a column as strings."""
+    if df_reports[col].dtype.kind == 'O':
+        return [str(value) for value in df_reports[col].values.tolist()]
+    return df_reports[col].astype(str).tolist()
+
+
+def format_comments(df_reports, col):
+    """Get the comments of a column as lists of comments."""
+    return [[value] for value in format_values(df_reports, col)]
+
+
+def format_operations(df_reports, col):
+    """Get the operations of the reports from the 'DURA_EQUI' column."""
+    return [[{"DURA_EQUI": value}] for value in format_values(df_reports, 'DURA_EQUI')]
+
+
+def format_components(offsets, fields):
+    """Get the spare parts of the reports as lists of dicts, built from their
+    child table."""
+    components = [{"MATNR": matnr, "MATL_DESC": "string", "QUANTITY": quantity}
+                  for matnr, quantity in zip(fields['MATNR'], fields['QUANTITY'])]
+    return report.split_child_values(offsets, components)
+
+
+def format_medias(offsets, fields):
+    """Get the medias of the reports as lists of dicts, built from their
+    child table."""
+    medias = [{"DOC_URL": doc_url, "DOC_TYPE": doc_type}
+              for doc_url, doc_type in zip(fields['DOC_URL'], fields['DOC_TYPE'])]
+    return report.split_child_values(offsets, medias)
+
+
+def format_nested_cols(df_preprocessed, child_tables=None):
+    """Format the spare parts & the medias of the reports of a kernel, once
+    when it is loaded: the search results then only select their values.
+
+    Parameters
+    ----------
+    df_preprocessed : pd.DataFrame
+        dataframe with the reports of the kernel, modified in place
+    child_tables : dict of tuples
+        child tables of the nested columns flattened at training time, see
+        report.build_child_tables, flattened from df_preprocessed if None
+        (e.g. for the vectorizers saved without them)
+
+    """
+    if child_tables is None:
+        child_tables = report.build_child_tables(df_preprocessed)
+    for col, formatter in NESTED_COLUMN_FORMATTERS.items():
+        if col in child_tables:
+            df_preprocessed[col] = formatter(*child_tables[col])
+
+
+# Formatters of the entries of the reports which need a specific format
+COLUMN_FORMATTERS = {'ERDAT': format_dates,
+                     'COMMENT': format_comments,
+                     'OPERATION': format_operations}
+
+# Formatters of the nested entries of the reports, applied once per kernel
+NESTED_COLUMN_FORMATTERS = {'COMPONENTS': format_components,
+                            'MEDIAS': format_medias}
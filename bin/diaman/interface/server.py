@@ -0,0 +1,581 @@
+import gc
+import os
+import json
+import signal
+import socket
+import asyncio
+import logging
+import argparse
+from http import HTTPStatus
+from concurrent.futures import ThreadPoolExecutor
+
+from .diaman_help import DiamanHelp
+from ..configuration.app import AppConfig
+from ..configuration.data import DataConfig
+from ..utils import memory
+
+
+class HttpError(Exception):
+    """Error answered with its status before the request is dispatched."""
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class DiamanServer:
+    """Serve the search methods of DiamanHelp over http with asyncio.
+
+    The requests are parsed on the event loop & the cpu work is run by a
+    bounded thread pool. The concurrent searches of the same shop are gathered
+    during 'batch_window' ms to be scored in a single pass over the reports.
+
+    Routes
+    ------
+    POST /search : json body with the parameters of get_search_results
+    POST /search/federated : json body with the parameters of
+        get_federated_search_results
+    POST /refine : json body with the parameters of get_refine_results
+    GET /health : memory of the worker, number of pending requests, version
+        of the resident kernels, their reloads & the response cache metrics
+
+    Attributes
+    ----------
+    diaman_help : diaman.interface.diaman_help.DiamanHelp
+        instance providing the search methods
+    server_params : configuration.data.ServerParameters
+        parameters of the server
+    n_pending : int
+        number of requests accepted & not answered yet
+
+    """
+    def __init__(self, diaman_help=None, server_params=None):
+        """Instantiate a DiamanServer instance.
+
+        Parameters
+        ----------
+        diaman_help : diaman.interface.diaman_help.DiamanHelp
+            instance providing the search methods, instantiated if None
+        server_params : configuration.data.ServerParameters
+            server parameters overriding the ones recorded in
+            conf/data/serving_conf.yml
+
+        """
+        self.diaman_help = DiamanHelp() if diaman_help is None else diaman_help
+        self.server_params = DataConfig().server_params if server_params is None \
+            else server_params
+        self.executor = ThreadPoolExecutor(max_workers=self.server_params.max_workers)
+        self.n_pending = 0
+        self._batches = {}
+        self._batch_timers = {}
+        self._server = None
+
+    async def start(self, sock=None):
+        """Start listening on the configured host & port.
+
+        Parameters
+        ----------
+        sock : socket.socket
+            listening socket shared by the pre-forked workers, a new socket is
+            bound to the configured host & port if None
+
+        """
+        if sock is None:
+            self._server = await asyncio.start_server(self._handle_connection,
+                                                      self.server_params.host,
+                                                      self.server_params.port)
+        else:
+            self._server = await asyncio.start_server(self._handle_connection, sock=sock)
+        logging.info('Serving diaman on {}:{} (pid {})'.format(self.server_params.host,
+                                                               self.server_params.port,
+                                                               os.getpid()))
+
+    async def stop(self):
+        """Stop listening & wait for the running requests."""
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+        self.executor.shutdown(wait=True)
+
+    async def _handle_connection(self, reader, writer):
+        """Answer the http requests of a connection until it is closed.
+
+        Parameters
+        ----------
+        reader : asyncio.StreamReader
+            reader of the connection
+        writer : asyncio.StreamWriter
+            writer of the connection
+
+        """
+        try:
+            while True:
+                request = await read_request_head(reader)
+                if request is None:
+                    break
+                method, path, headers = request
+                # Backpressure: reject the requests beyond the pending limit
+                # before reading their body
+                if method == 'POST' and self.n_pending >= self.server_params.max_pending:
+                    raise HttpError(HTTPStatus.SERVICE_UNAVAILABLE, 'Too many pending requests')
+                body = await read_request_body(reader, headers,
+                                               self.server_params.max_body_size * 1024)
+                status, content = await self._dispatch(method, path, body)
+                keep_alive = headers.get('connection', '').lower() != 'close'
+                writer.write(build_response(status, content, keep_alive))
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        except HttpError as e:
+            writer.write(build_response(e.status, error_content(e), False))
+        except ValueError as e:
+            writer.write(build_response(HTTPStatus.BAD_REQUEST, error_content(e), False))
+        finally:
+            writer.close()
+
+    async def _dispatch(self, method, path, body):
+        """Route a request & build its response content.
+
+        Parameters
+        ----------
+        method : string
+            http method of the request
+        path : string
+            path of the request
+        body : bytes
+            body of the request
+
+        Returns
+        -------
+        status : http.HTTPStatus
+            status of the response
+        content : bytes
+            json content of the response
+
+        """
+        try:
+            if (method, path) == ('GET', '/health'):
+                return HTTPStatus.OK, self._health()
+            if method != 'POST' or path not in ('/search', '/search/federated', '/refine'):
+                return HTTPStatus.NOT_FOUND, error_content(f'Unknown route {method} {path}')
+
+            # Backpressure: reject the requests beyond the pending limit
+            if self.n_pending >= self.server_params.max_pending:
+                return HTTPStatus.SERVICE_UNAVAILABLE, error_content('Too many pending requests')
+
+            self.n_pending += 1
+            try:
+                params = json.loads(body.decode('utf-8'))
+                if not isinstance(params, dict):
+                    raise ValueError('The body must be a json object.')
+                if path == '/search':
+                    content = await self._search(params)
+                elif path == '/search/federated':
+                    content = await self._federated_search(params)
+                else:
+                    content = await self._refine(params)
+                return HTTPStatus.OK, content
+            finally:
+                self.n_pending -= 1
+        except (ValueError, KeyError, TypeError) as e:
+            return HTTPStatus.BAD_REQUEST, error_content(e)
+        except Exception as e:
+            logging.exception(e)
+            return HTTPStatus.INTERNAL_SERVER_ERROR, error_content('Internal error')
+
+    def _health(self):
+        """Get the json content of the health route."""
+        return json.dumps({
+            'pid': os.getpid(),
+            'memory': memory.get_process_memory(),
+            'pending': self.n_pending,
+            'kernels': self.diaman_help.get_kernels_version(),
+            'reloads': self.diaman_help.reload_stats,
+            'cache': None if self.diaman_help.response_cache is None
+            else self.diaman_help.response_cache.get_stats()}).encode('utf-8')
+
+    async def _search(self, params):
+        """Add a search to the micro-batch of its shop & wait for its results.
+
+        Parameters
+        ----------
+        params : dict
+            parameters of get_search_results
+
+        """
+        _check_string_params(params, ('code_site', 'code_shop', 'search'))
+        for key in ('site_filters', 'constructor_filters', 'equipment_filters'):
+            filters = params.get(key, [])
+            if not isinstance(filters, list) \
+                    or not all(isinstance(value, str) for value in filters):
+                raise ValueError(f'The {key} parameter must be a list of strings.')
+        request = {'code_site': params['code_site'],
+                   'code_shop': params['code_shop'],
+                   'search': params['search'],
+                   'site_filters': params.get('site_filters', []),
+                   'constructor_filters': params.get('constructor_filters', []),
+                   'equipment_filters': params.get('equipment_filters', []),
+                   'n_reports': int(params.get('n_reports', 50)),
+                   'date_from': params.get('date_from'),
+                   'date_to': params.get('date_to'),
+                   'recency_boost': _get_recency_boost(params)}
+
+        loop = asyncio.get_event_loop()
+        future = loop.create_future()
+        key = request['code_shop'].upper()
+        if key not in self._batches:
+            self._batches[key] = []
+            self._batch_timers[key] = loop.call_later(self.server_params.batch_window / 1000.,
+                                                      self._flush_batch, key)
+        self._batches[key].append((request, future))
+        if len(self._batches[key]) >= self.server_params.max_batch_size:
+            self._flush_batch(key)
+
+        result = await future
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    def _flush_batch(self, key):
+        """Run the micro-batch of searches of a shop in the executor.
+
+        Parameters
+        ----------
+        key : string
+            shop of the micro-batch
+
+        """
+        # A batch flushed when full must not be flushed again by its timer,
+        # which would flush the next batch of the shop before its window ends
+        timer = self._batch_timers.pop(key, None)
+        if timer is not None:
+            timer.cancel()
+        batch = self._batches.pop(key, None)
+        if not batch:
+            return
+        requests, futures = zip(*batch)
+        logging.debug('Scoring a batch of {} searches for the {} shop'.format(len(batch), key))
+        task = asyncio.get_event_loop().run_in_executor(
+            self.executor, self.diaman_help.get_search_results_batch, list(requests), True)
+        task.add_done_callback(lambda task: _set_batch_results(futures, task))
+
+    async def _federated_search(self, params):
+        """Run a federated search in the executor.
+
+        Parameters
+        ----------
+        params : dict
+            parameters of get_federated_search_results
+
+        """
+        recency_boost = _get_recency_boost(params)
+        return await asyncio.get_event_loop().run_in_executor(
+            self.executor, lambda: self.diaman_help.get_federated_search_results(
+                params['code_site'], params['search'],
+                params.get('site_filters', []), params.get('constructor_filters', []),
+                params.get('equipment_filters', []), params.get('code_shops'),
+                int(params.get('n_reports', 50)), encoded=True,
+                date_from=params.get('date_from'), date_to=params.get('date_to'),
+                recency_boost=recency_boost))
+
+    async def _refine(self, params):
+        """Run a refine in the executor.
+
+        Parameters
+        ----------
+        params : dict
+            parameters of get_refine_results
+
+        """
+        _check_string_params(params, ('code_site', 'code_shop', 'search'))
+        refine_results = await asyncio.get_event_loop().run_in_executor(
+            self.executor, self.diaman_help.get_refine_results,
+            params['code_site'], params['code_shop'], params['search'])
+        return json.dumps(refine_results).encode('utf-8')
+
+
+def _check_string_params(params, keys):
+    """Check that the given parameters of a request are strings."""
+    for key in keys:
+        if not isinstance(params.get(key), str):
+            raise ValueError(f'The {key} parameter must be a string.')
+
+
+def _get_recency_boost(params):
+    """Get the recency_boost parameter of a search, between 0 & 1."""
+    recency_boost = float(params.get('recency_boost', 0.))
+    if not 0. <= recency_boost <= 1.:
+        raise ValueError('The recency_boost parameter must be between 0 and 1.')
+    return recency_boost
+
+
+def _set_batch_results(futures, task):
+    """Set the result of each search of a micro-batch.
+
+    Parameters
+    ----------
+    futures : list of asyncio.Future
+        futures of the searches of the micro-batch
+    task : asyncio.Future
+        future of the micro-batch, with the list of results
+
+    """
+    for idx, future in enumerate(futures):
+        if future.cancelled():
+            continue
+        if task.exception() is not None:
+            future.set_exception(task.exception())
+        else:
+            future.set_result(task.result()[idx])
+
+
+async def read_request_head(reader):
+    """Read the request line & the headers of a http request.
+
+    Parameters
+    ----------
+    reader : asyncio.StreamReader
+        reader of the connection
+
+    Returns
+    -------
+    request_head : tuple or None
+        (method, path, headers) of the request, None if the connection was
+        closed
+
+    """
+    request_line = await reader.readline()
+    if not request_line:
+        return None
+    try:
+        method, path, _ = request_line.decode('latin1').split(' ', 2)
+    except ValueError:
+        raise ValueError('Malformed request line')
+
+    headers = {}
+    n_headers = headers_size = 0
+    while True:
+        try:
+            line = await reader.readline()
+        except ValueError:
+            # Line longer than the buffer limit of the reader
+            raise HttpError(HTTPStatus.REQUEST_HEADER_FIELDS_TOO_LARGE, 'Header too large')
+        if line in (b'\r\n', b'\n', b''):
+            break
+        n_headers += 1
+        headers_size += len(line)
+        if n_headers > MAX_HEADERS or headers_size > MAX_HEADERS_SIZE:
+            raise HttpError(HTTPStatus.REQUEST_HEADER_FIELDS_TOO_LARGE, 'Headers too large')
+        name, _, value = line.decode('latin1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+
+    return method.upper(), path.split('?', 1)[0], headers
+
+
+async def read_request_body(reader, headers, max_body_size):
+    """Read the body of a http request, once its size is checked.
+
+    Parameters
+    ----------
+    reader : asyncio.StreamReader
+        reader of the connection
+    headers : dict
+        headers of the request, with lowercase names
+    max_body_size : int
+        maximum size (in bytes) of the body
+
+    """
+    try:
+        content_length = int(headers.get('content-length', 0))
+    except ValueError:
+        raise ValueError('Invalid Content-Length header')
+    if content_length < 0:
+        raise ValueError('Invalid Content-Length header')
+    if content_length > max_body_size:
+        raise HttpError(HTTPStatus.REQUEST_ENTITY_TOO_LARGE,
+                        f'The body exceeds {max_body_size} bytes')
+    return await reader.readexactly(content_length)
+
+
+def build_response(status, content, keep_alive=True):
+    """Build a http response with a json content.
+
+    Parameters
+    ----------
+    status : http.HTTPStatus
+        status of the response
+    content : bytes
+        json content of the response
+    keep_alive : bool
+        False to close the connection after the response
+
+    """
+    head = ('HTTP/1.1 {} {}\r\n'
+            'Content-Type: application/json\r\n'
+            'Content-Length: {}\r\n'
+            'Connection: {}\r\n\r\n').format(status.value, status.phrase, len(content),
+                                             'keep-alive' if keep_alive else 'close')
+    return head.encode('latin1') + content
+
+
+def error_content(error):
+    """Build the json content of an error response."""
+    return json.dumps({'error': str(error)}).encode('utf-8')
+
+
+def serve_prefork(server_params, diaman_help=None):
+    """Run the diaman http server with pre-forked worker processes.
+
+    The kernels are loaded once in the parent process, which then forks
+    'workers' processes sharing its listening socket. The workers share the
+    memory of the kernels copy-on-write, on a best-effort basis: the buffers
+    of the sparse matrices & of the dataframes are only read by the searches,
+    but any access to a python object updates its reference count, which
+    dirties its page & gets it copied in the worker. The objects loaded
+    before the fork are frozen out of the garbage collector (python >= 3.7),
+    which only spares the writes of the collections to their gc headers. A
+    worker which exits unexpectedly is replaced.
+    The kernels reloaded by a worker are private to the worker.
+
+    Parameters
+    ----------
+    server_params : configuration.data.ServerParameters
+        parameters of the server
+    diaman_help : diaman.interface.diaman_help.DiamanHelp
+        instance providing the search methods, instantiated if None
+
+    """
+    diaman_help = DiamanHelp() if diaman_help is None else diaman_help
+    # The reload thread doesn't survive the fork: each worker starts its own
+    diaman_help.stop_reload_watcher()
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((server_params.host, server_params.port))
+    sock.listen(server_params.max_pending)
+    sock.setblocking(False)
+
+    gc.collect()
+    if hasattr(gc, 'freeze'):
+        gc.freeze()
+    logging.info('Parent process {} ready ({:.1f} MB), forking {} workers'
+                 .format(os.getpid(), memory.get_process_memory()['rss'] / 2**20,
+                         server_params.workers))
+
+    workers = set()
+    stopping = []
+
+    def stop(signum, frame):
+        stopping.append(signum)
+        for pid in workers:
+            os.kill(pid, signal.SIGTERM)
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    for _ in range(server_params.workers):
+        workers.add(_fork_worker(diaman_help, server_params, sock))
+
+    while workers:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+        workers.discard(pid)
+        if not stopping:
+            logging.error('Worker {} exited with status {}, forking a new worker'
+                          .format(pid, status))
+            workers.add(_fork_worker(diaman_help, server_params, sock))
+
+    sock.close()
+
+
+def _fork_worker(diaman_help, server_params, sock):
+    """Fork a worker process serving the requests of the shared socket.
+
+    Parameters
+    ----------
+    diaman_help : diaman.interface.diaman_help.DiamanHelp
+        instance providing the search methods, loaded in the parent process
+    server_params : configuration.data.ServerParameters
+        parameters of the server
+    sock : socket.socket
+        listening socket shared by the workers
+
+    Returns
+    -------
+    pid : int
+        process id of the worker, in the parent process
+
+    """
+    pid = os.fork()
+    if pid != 0:
+        return pid
+
+    exit_code = 0
+    try:
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        signal.signal(signal.SIGINT, signal.SIG_DFL)
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        if diaman_help.serving_params.reload_interval is not None:
+            diaman_help.start_reload_watcher()
+        server = DiamanServer(diaman_help, server_params)
+        loop.run_until_complete(server.start(sock))
+        loop.run_forever()
+    except Exception as e:
+        logging.exception(e)
+        exit_code = 1
+    finally:
+        os._exit(exit_code)
+
+
+def cli():
+    """Run the diaman http server."""
+    # Configuration
+    AppConfig()
+    server_params = DataConfig().server_params
+
+    # Parse the cli arguments
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--host', help='address to listen on', default=server_params.host)
+    parser.add_argument('--port', help='port to listen on', type=int,
+                        default=server_params.port)
+    parser.add_argument('--max-workers', help='number of threads running the searches',
+                        type=int, default=server_params.max_workers)
+    parser.add_argument('--workers', help='number of pre-forked worker processes',
+                        type=int, default=server_params.workers)
+    args = parser.parse_args()
+    server_params = server_params._replace(host=args.host, port=args.port,
+                                           max_workers=args.max_workers,
+                                           workers=args.workers)
+
+    # Run the pre-forked workers
+    if server_params.workers > 1:
+        serve_prefork(server_params)
+        return
+
+    # Run the server
+    server = DiamanServer(server_params=server_params)
+    loop = asyncio.get_event_loop()
+    loop.run_until_complete(server.start())
+    try:
+        loop.run_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        loop.run_until_complete(server.stop())
+        loop.close()
+
+
+
+# Limits of the request headers, checked before the body is read
+MAX_HEADERS = 100
+MAX_HEADERS_SIZE = 16 * 1024
+
+
+if __name__ == '__main__':
+    cli()
@@ -0,0 +1,235 @@
+import os
+import time
+import logging
+import argparse
+import numpy as np
+import pandas as pd
+
+from diaman.configuration.app import AppConfig
+from diaman.interface.kernel import DiamanKernel
+from diaman.domain import lda
+from diaman.pipeline import search_pipeline
+
+
+def run_time_budgets(code_shop, searches, time_budgets, language='fr', n_top_words=4):
+    """Run the benchmark of the time-budgeted LDA against the batch LDA.
+
+    For each search, the batch LDA used by default in the refine is compared
+    to the LDA trained within each time budget, in terms of training time,
+    perplexity and overlap of the top words of the topics.
+
+    Parameters
+    ----------
+    code_shop : string
+        shop of the kernel to benchmark
+    searches : list of strings
+        user searches to refine
+    time_budgets : list of floats
+        time budgets to benchmark, in seconds
+    language : string
+        language of the kernel to benchmark
+    n_top_words : int
+        number of top words of each topic to compare
+
+    Returns
+    -------
+    df_bench : pd.DataFrame
+        dataframe with the benchmark results for each tuple (search, budget)
+
+    """
+    # Configurations
+    AppConfig()
+
+    logging.info('===========================================================')
+    logging.info(f'Starting the refine benchmark for the {code_shop} shop')
+    kernel = DiamanKernel(language, code_shop)
+    lda_params = kernel.processing_params
+
+    results = []
+    for search in searches:
+        df_reports = search_pipeline.get_refine_reports(kernel, search)
+        (vectorizer,
+         dt_matrix,
+         feature_names) = lda.vectorize_corpus(df_reports, lda_params)
+
+        # Reference: batch LDA without time limit
+        start_time = time.monotonic()
+        lda_batch = lda.train(vectorizer, dt_matrix, lda_params)
+        batch_time = time.monotonic() - start_time
+        batch_topics = lda.get_top_words_topics(lda_batch, feature_names, n_top_words)
+        results.append({'search': search, 'time_budget': None,
+                        'training_time': batch_time,
+                        'perplexity': lda_batch.perplexity(dt_matrix),
+                        'top_words_overlap': 1.})
+
+        for time_budget in time_budgets:
+            start_time = time.monotonic()
+            lda_budget = lda.train_with_budget(dt_matrix, lda_params, time_budget,
+                                               kernel.refine_params.batch_size)
+            budget_time = time.monotonic() - start_time
+            budget_topics = lda.get_top_words_topics(lda_budget, feature_names,
+                                                     n_top_words)
+            results.append({'search': search, 'time_budget': time_budget,
+                            'training_time': budget_time,
+                            'perplexity': lda_budget.perplexity(dt_matrix),
+                            'top_words_overlap': top_words_overlap(budget_topics,
+                                                                   batch_topics)})
+
+    df_bench = pd.DataFrame(results)
+    logging.info('Refine benchmark results:\n{}'.format(df_bench.to_string(index=False)))
+    logging.info('*** Benchmark finished ***')
+
+    return df_bench
+
+
+def run_engines(code_shops, searches, engines=None, language='fr', n_top_words=4):
+    """Run the benchmark of the topic extraction engines for each shop.
+
+    For each shop and each search, the topics are extracted with every engine
+    and compared in terms of latency and UMass coherence of the top words.
+
+    Parameters
+    ----------
+    code_shops : list of strings
+        shops of the kernels to benchmark
+    searches : list of strings
+        user searches to refine
+    engines : list of strings
+        topic extraction engines to benchmark, all the engines if None
+    language : string
+        language of the kernels to benchmark
+    n_top_words : int
+        number of top words of each topic to evaluate
+
+    Returns
+    -------
+    df_bench : pd.DataFrame
+        dataframe with the mean latency & coherence of each tuple (shop, engine)
+
+    """
+    # Configurations
+    AppConfig()
+    engines = list(lda.TOPIC_ENGINES) if engines is None else engines
+
+    logging.info('===========================================================')
+    logging.info('Starting the topic engines benchmark for the {} shops'
+                 .format(', '.join(code_shops)))
+
+    results = []
+    for code_shop in code_shops:
+        kernel = DiamanKernel(language, code_shop)
+        for search in searches:
+            df_reports = search_pipeline.get_refine_reports(kernel, search)
+            _, dt_matrix, feature_names = lda.vectorize_corpus(df_reports,
+                                                               kernel.processing_params)
+            for engine in engines:
+                refine_params = kernel.refine_params._replace(engine=engine)
+                start_time = time.monotonic()
+                top_words_topics = lda.extract_topics(df_reports, kernel.processing_params,
+                                                      n_top_words=n_top_words,
+                                                      refine_params=refine_params)
+                latency = time.monotonic() - start_time
+                results.append({'code_shop': code_shop, 'search': search,
+                                'engine': engine, 'latency': latency,
+                                'coherence': umass_coherence(dt_matrix, feature_names,
+                                                             top_words_topics)})
+
+    df_bench = pd.DataFrame(results) \
+        .groupby(['code_shop', 'engine'])[['latency', 'coherence']] \
+        .mean() \
+        .reset_index()
+    logging.info('Topic engines benchmark results:\n{}'.format(df_bench.to_string(index=False)))
+    logging.info('*** Benchmark finished ***')
+
+    return df_bench
+
+
+def top_words_overlap(topics, ref_topics):
+    """Compute the overlap between the top words of two sets of topics.
+
+    Each reference topic is matched with the topic sharing the most words with
+    it, the overlap is the mean Jaccard index of these matches.
+
+    Parameters
+    ----------
+    topics : list of lists of strings
+        top words of each topic to evaluate
+    ref_topics : list of lists of strings
+        top words of each reference topic
+
+    """
+    overlaps = []
+    for ref_topic in ref_topics:
+        overlaps.append(max(len(set(topic) & set(ref_topic))
+                            / len(set(topic) | set(ref_topic))
+                            for topic in topics))
+    return sum(overlaps) / len(overlaps)
+
+
+def umass_coherence(dt_matrix, feature_names, top_words_topics):
+    """Compute the mean UMass coherence of the topics.
+
+    The coherence of a topic is the sum over its pairs of top words (w_i, w_j),
+    w_j being ranked before w_i, of log((D(w_i, w_j) + 1) / D(w_j)), where D
+    is the number of documents containing the words.
+
+    Parameters
+    ----------
+    dt_matrix : array of floats
+        document-term matrix of the corpus text documents
+    feature_names : list
+        list of the words (columns) of the dt_matrix
+    top_words_topics : list of lists of strings
+        top words of each topic, ranked by decreasing weight
+
+    """
+    word_idx = {word: idx for idx, word in enumerate(feature_names)}
+    occurrences = (dt_matrix > 0).astype(float).tocsc()
+
+    coherences = []
+    for top_words in top_words_topics:
+        columns = occurrences[:, [word_idx[word] for word in top_words]]
+        co_doc_freq = (columns.T @ columns).toarray()
+        coherence = 0.
+        for i in range(1, len(top_words)):
+            for j in range(i):
+                coherence += np.log((co_doc_freq[i, j] + 1.) / co_doc_freq[j, j])
+        coherences.append(coherence)
+    return float(np.mean(coherences))
+
+
+if __name__ == '__main__':
+    # Parse the cli arguments
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--output', help='csv file where to save the results',
+                        default=None)
+    subparsers = parser.add_subparsers(dest='benchmark')
+
+    parser_budgets = subparsers.add_parser('time-budgets',
+                                           help='compare the budgeted LDA to the batch LDA')
+    parser_budgets.add_argument('code_shop', help='shop of the kernel to benchmark')
+    parser_budgets.add_argument('searches', nargs='+', help='user searches to refine')
+    parser_budgets.add_argument('--time-budgets', help='comma-separated time budgets, in seconds',
+                                default='0.1,0.25,0.5,1')
+
+    parser_engines = subparsers.add_parser('engines',
+                                           help='compare the topic extraction engines')
+    parser_engines.add_argument('code_shops', help='comma-separated shops of the kernels to benchmark')
+    parser_engines.add_argument('searches', nargs='+', help='user searches to refine')
+    parser_engines.add_argument('--engines', help='comma-separated topic engines to benchmark',
+                                default=None)
+    args = parser.parse_args()
+
+    # Run benchmark
+    try:
+        if args.benchmark == 'engines':
+            df_bench = run_engines(args.code_shops.split(','), args.searches,
+                                   args.engines.split(',') if args.engines else None)
+        else:
+            df_bench = run_time_budgets(args.code_shop, args.searches,
+                                        [float(budget)
+                                         for budget in args.time_budgets.split(',')])
+        if args.output is not None:
+            df_bench.to_csv(os.path.abspath(args.output), index=False)
+    except Exception as e:
+        logging.error(e)
@@ -0,0 +1,114 @@
+import os
+import json
+import time
+import logging
+import argparse
+import pandas as pd
+
+from diaman.configuration.app import AppConfig
+from diaman.configuration.data import DataConfig
+from diaman.interface.kernel import DiamanKernel
+from diaman.interface import serializer
+from diaman.pipeline import search_pipeline
+
+
+def run(code_shop, searches, n_reports_list=(50, 500, 5000), language='fr', n_runs=10):
+    """Run the benchmark of the serialization of the search results.
+
+    For each search & each number of reports, the columnar serializer is
+    compared to the serialization through a json round trip of the dataframe.
+
+    Parameters
+    ----------
+    code_shop : string
+        shop of the kernel to benchmark
+    searches : list of strings
+        user searches
+    n_reports_list : list of ints
+        numbers of reports to serialize
+    language : string
+        language of the kernel to benchmark
+    n_runs : int
+        number of runs of each serialization
+
+    Returns
+    -------
+    df_bench : pd.DataFrame
+        dataframe with the mean serialization time of each tuple
+        (search, n_reports, serializer)
+
+    """
+    # Configurations
+    AppConfig()
+    search_cols = DataConfig().diaman_search_cols
+
+    logging.info('===========================================================')
+    logging.info(f'Starting the search serialization benchmark for the {code_shop} shop')
+    kernel = DiamanKernel(language, code_shop)
+
+    serializers = {'dataframe_json': lambda df: json.dumps(
+                       legacy_serialize_reports(df, search_cols)).encode('utf-8'),
+                   'columnar': lambda df: serializer.encode_search_results(
+                       serializer.serialize_reports(df, search_cols))}
+
+    results = []
+    for search in searches:
+        for n_reports in n_reports_list:
+            df_reports, _, _, _ = search_pipeline.make_search(kernel, search, [], [], [],
+                                                              n_reports)
+            for name, serialize in serializers.items():
+                start_time = time.monotonic()
+                for _ in range(n_runs):
+                    serialize(df_reports)
+                results.append({'search': search, 'n_reports': len(df_reports),
+                                'serializer': name,
+                                'time_ms': 1000 * (time.monotonic() - start_time) / n_runs})
+
+    df_bench = pd.DataFrame(results)
+    logging.info('Search serialization benchmark results:\n{}'
+                 .format(df_bench.to_string(index=False)))
+    logging.info('*** Benchmark finished ***')
+
+    return df_bench
+
+
+def legacy_serialize_reports(df_reports, search_cols):
+    """Build the list of the reports through a json round trip of the dataframe.
+
+    Parameters
+    ----------
+    df_reports : pd.DataFrame
+        dataframe with the matching reports, which are filtered and sorted
+    search_cols : list of strings
+        entries of each report of the search results
+
+    """
+    df_reports = df_reports.copy()
+    df_reports['ERDAT'] = df_reports['ERDAT'].astype(str)
+    df_reports['COMMENT'] = df_reports['COMMENT'].apply(lambda x: [x])
+    df_reports['OPERATION'] = df_reports['DURA_EQUI'].apply(lambda x: [{"DURA_EQUI": x}])
+    # The spare parts & the medias are formatted when the kernel is loaded
+
+    json_reports = json.loads(df_reports[search_cols].to_json(orient='index'))
+    return [json_reports[k] for k in json_reports.keys()]
+
+
+if __name__ == '__main__':
+    # Parse the cli arguments
+    parser = argparse.ArgumentParser()
+    parser.add_argument('code_shop', help='shop of the kernel to benchmark')
+    parser.add_argument('searches', nargs='+', help='user searches')
+    parser.add_argument('--n-reports', help='comma-separated numbers of reports',
+                        default='50,500,5000')
+    parser.add_argument('--output', help='csv file where to save the results',
+                        default=None)
+    args = parser.parse_args()
+
+    # Run benchmark
+    try:
+        df_bench = run(args.code_shop, args.searches,
+                       [int(n_reports) for n_reports in args.n_reports.split(',')])
+        if args.output is not None:
+            df_bench.to_csv(os.path.abspath(args.output), index=False)
+    except Exception as e:
+        logging.error(e)
@@ -0,0 +1,305 @@
+import os
+import sys
+import json
+import time
+import asyncio
+import logging
+import argparse
+import subprocess
+import urllib.request
+import numpy as np
+import pandas as pd
+
+from diaman.configuration.app import AppConfig
+from diaman.utils import memory
+
+
+async def send_requests(host, port, route, payloads, latencies, statuses):
+    """Send requests one after another on a keep-alive connection.
+
+    Parameters
+    ----------
+    host : string
+        address of the server
+    port : int
+        port of the server
+    route : string
+        route of the requests ('/search' or '/refine')
+    payloads : list of dicts
+        json bodies of the requests
+    latencies : list
+        list where to append the latency of each request, in seconds
+    statuses : list
+        list where to append the http status of each request
+
+    """
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        for payload in payloads:
+            body = json.dumps(payload).encode('utf-8')
+            start_time = time.monotonic()
+            writer.write(('POST {} HTTP/1.1\r\nHost: {}\r\n'
+                          'Content-Type: application/json\r\n'
+                          'Content-Length: {}\r\n\r\n').format(route, host, len(body))
+                         .encode('latin1') + body)
+            await writer.drain()
+
+            status_line = await reader.readline()
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b'\r\n', b''):
+                    break
+                name, _, value = line.decode('latin1').partition(':')
+                headers[name.strip().lower()] = value.strip()
+            await reader.readexactly(int(headers.get('content-length', 0)))
+
+            latencies.append(time.monotonic() - start_time)
+            statuses.append(int(status_line.split()[1]))
+    finally:
+        writer.close()
+
+
+def load_test(host, port, route, payloads, concurrency):
+    """Send the requests over 'concurrency' keep-alive connections.
+
+    Parameters
+    ----------
+    host : string
+        address of the server
+    port : int
+        port of the server
+    route : string
+        route of the requests ('/search' or '/refine')
+    payloads : list of dicts
+        json bodies of the requests
+    concurrency : int
+        number of concurrent connections
+
+    Returns
+    -------
+    stats : dict
+        throughput & latency percentiles of the requests
+
+    """
+    latencies, statuses = [], []
+    start_time = time.monotonic()
+    asyncio.get_event_loop().run_until_complete(asyncio.gather(*[
+        send_requests(host, port, route, payloads[idx::concurrency], latencies, statuses)
+        for idx in range(concurrency)]))
+    duration = time.monotonic() - start_time
+
+    latencies_ms = 1000 * np.array(latencies)
+    return {'n_requests': len(latencies),
+            'n_errors': sum(status != 200 for status in statuses),
+            'throughput': len(latencies) / duration,
+            'p50_ms': np.percentile(latencies_ms, 50),
+            'p90_ms': np.percentile(latencies_ms, 90),
+            'p99_ms': np.percentile(latencies_ms, 99)}
+
+
+def get_payloads(code_site, code_shop, searches, n_requests):
+    """Build the json bodies of 'n_requests' requests looping over the searches."""
+    return [{'code_site': code_site, 'code_shop': code_shop,
+             'search': searches[idx % len(searches)]} for idx in range(n_requests)]
+
+
+def run(code_site, code_shop, searches, host='127.0.0.1', port=8080, route='/search',
+        concurrency_list=(1, 8, 32), n_requests=200):
+    """Run a load test against a running diaman server.
+
+    For each concurrency, 'concurrency' keep-alive connections send the
+    searches in a loop until 'n_requests' requests are answered.
+
+    Parameters
+    ----------
+    code_site : string
+        user site
+    code_shop : string
+        user shop
+    searches : list of strings
+        user searches sent in a loop
+    host : string
+        address of the server
+    port : int
+        port of the server
+    route : string
+        route of the requests ('/search' or '/refine')
+    concurrency_list : list of ints
+        numbers of concurrent connections to benchmark
+    n_requests : int
+        number of requests sent for each concurrency
+
+    Returns
+    -------
+    df_bench : pd.DataFrame
+        dataframe with the throughput & the latency percentiles of each
+        concurrency
+
+    """
+    # Configurations
+    AppConfig()
+
+    logging.info('===========================================================')
+    logging.info(f'Starting the load test of {host}:{port}{route} for the {code_shop} shop')
+
+    payloads = get_payloads(code_site, code_shop, searches, n_requests)
+    results = []
+    for concurrency in concurrency_list:
+        results.append({'concurrency': concurrency,
+                        **load_test(host, port, route, payloads, concurrency)})
+
+    df_bench = pd.DataFrame(results)
+    logging.info('Load test results:\n{}'.format(df_bench.to_string(index=False)))
+    logging.info('*** Benchmark finished ***')
+
+    return df_bench
+
+
+def run_workers(code_site, code_shop, searches, workers_list=(1, 2, 4), port=8080,
+                route='/search', concurrency=32, n_requests=1000, startup_timeout=600):
+    """Run the benchmark of the throughput scaling with the number of
+    pre-forked workers.
+
+    For each number of workers, a diaman server is started on the local
+    machine, load tested & stopped. The unique memory (USS) of each worker is
+    measured after the load test: it stays small compared to the memory of
+    the parent process as long as the kernels are shared copy-on-write.
+
+    Parameters
+    ----------
+    code_site : string
+        user site
+    code_shop : string
+        user shop
+    searches : list of strings
+        user searches sent in a loop
+    workers_list : list of ints
+        numbers of workers to benchmark
+    port : int
+        port of the servers
+    route : string
+        route of the requests ('/search' or '/refine')
+    concurrency : int
+        number of concurrent connections
+    n_requests : int
+        number of requests sent for each number of workers
+    startup_timeout : float
+        maximum time to wait for the loading of the kernels, in seconds
+
+    Returns
+    -------
+    df_bench : pd.DataFrame
+        dataframe with the throughput, the latency percentiles & the memory
+        of the workers for each number of workers
+
+    """
+    # Configurations
+    AppConfig()
+
+    logging.info('===========================================================')
+    logging.info(f'Starting the workers scaling benchmark for the {code_shop} shop')
+
+    payloads = get_payloads(code_site, code_shop, searches, n_requests)
+    results = []
+    for workers in workers_list:
+        server = subprocess.Popen([sys.executable, '-m', 'diaman.interface.server',
+                                   '--host', '127.0.0.1', '--port', str(port),
+                                   '--workers', str(workers)])
+        try:
+            wait_for_server('127.0.0.1', port, startup_timeout)
+            stats = load_test('127.0.0.1', port, route, payloads, concurrency)
+
+            parent_memory = memory.get_process_memory(server.pid)
+            workers_memory = [memory.get_process_memory(pid)
+                              for pid in memory.get_children_pids(server.pid)] \
+                if workers > 1 else [parent_memory]
+            results.append({'workers': workers, **stats,
+                            'parent_rss_mb': parent_memory['rss'] / 2**20,
+                            'worker_uss_mb': np.mean([worker_memory['uss']
+                                                      for worker_memory in workers_memory]) / 2**20,
+                            'worker_pss_mb': np.mean([worker_memory['pss']
+                                                      for worker_memory in workers_memory]) / 2**20})
+        finally:
+            server.terminate()
+            server.wait()
+
+    df_bench = pd.DataFrame(results)
+    logging.info('Workers scaling benchmark results:\n{}'.format(df_bench.to_string(index=False)))
+    logging.info('*** Benchmark finished ***')
+
+    return df_bench
+
+
+def wait_for_server(host, port, timeout):
+    """Wait until the health route of a diaman server answers.
+
+    Parameters
+    ----------
+    host : string
+        address of the server
+    port : int
+        port of the server
+    timeout : float
+        maximum time to wait, in seconds
+
+    """
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            urllib.request.urlopen(f'http://{host}:{port}/health', timeout=1).read()
+            return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise TimeoutError(f'The server {host}:{port} did not start in {timeout}s')
+            time.sleep(0.5)
+
+
+if __name__ == '__main__':
+    # Parse the cli arguments
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--output', help='csv file where to save the results',
+                        default=None)
+    subparsers = parser.add_subparsers(dest='benchmark')
+
+    parser_load = subparsers.add_parser('load', help='load test a running server')
+    parser_load.add_argument('code_site', help='user site')
+    parser_load.add_argument('code_shop', help='user shop')
+    parser_load.add_argument('searches', nargs='+', help='user searches')
+    parser_load.add_argument('--host', help='address of the server', default='127.0.0.1')
+    parser_load.add_argument('--port', help='port of the server', type=int, default=8080)
+    parser_load.add_argument('--route', help='route of the requests', default='/search')
+    parser_load.add_argument('--concurrency', help='comma-separated numbers of connections',
+                             default='1,8,32')
+    parser_load.add_argument('--n-requests', help='number of requests for each concurrency',
+                             type=int, default=200)
+
+    parser_workers = subparsers.add_parser('workers',
+                                           help='compare the numbers of pre-forked workers')
+    parser_workers.add_argument('code_site', help='user site')
+    parser_workers.add_argument('code_shop', help='user shop')
+    parser_workers.add_argument('searches', nargs='+', help='user searches')
+    parser_workers.add_argument('--workers', help='comma-separated numbers of workers',
+                                default='1,2,4')
+    parser_workers.add_argument('--port', help='port of the servers', type=int, default=8080)
+    parser_workers.add_argument('--route', help='route of the requests', default='/search')
+    parser_workers.add_argument('--concurrency', help='number of connections', type=int,
+                                default=32)
+    parser_workers.add_argument('--n-requests', help='number of requests for each number of workers',
+                                type=int, default=1000)
+    args = parser.parse_args()
+
+    # Run benchmark
+    try:
+        if args.benchmark == 'workers':
+            df_bench = run_workers(args.code_site, args.code_shop, args.searches,
+                                   [int(workers) for workers in args.workers.split(',')],
+                                   args.port, args.route, args.concurrency, args.n_requests)
+        else:
+            df_bench = run(args.code_site, args.code_shop, args.searches, args.host,
+                           args.port, args.route,
+                           [int(c) for c in args.concurrency.split(',')], args.n_requests)
+        if args.output is not None:
+            df_bench.to_csv(os.path.abspath(args.output), index=False)
+    except Exception as e:
+        logging.error(e)
@@ -47,5 +47,19 @@ def cli():
     train_pipeline.run(spark_session, args.standard_data_path)
 
 
+def cli_local():
+    """Run the training pipeline on the local machine, without Spark."""
+    # Configuration
+    AppConfig()
+
+    # Parse the cli arguments
+    parser = argparse.ArgumentParser()
+    parser.add_argument('standard_data_path', help='path to the local standard data directory')
+    args = parser.parse_args()
+
+    # Run the local train pipeline
+    train_pipeline.run_local(args.standard_data_path)
+
+
 if __name__ == '__main__':
     cli()
@@ -2,10 +2,11 @@ import logging
 import argparse
 
 from diaman.configuration.app import AppConfig
+from diaman.pipeline import recorrect_corpora
 from diaman.utils.word_dict import WordDict
 
 
-def run(doccano_output_filename, word_dict_filename='word_dict.json'):
+def run(doccano_output_filename, word_dict_filename='word_dict.json', recorrect=False):
     """Run the pipeline to enrich the word dictionary after doccano labelling.
 
     Parameters
@@ -14,6 +15,9 @@ def run(doccano_output_filename, word_dict_filename='word_dict.json'):
         filename of the word dictionary.
     doccano_output_filename : string
         filename of the doccano output after labelling.
+    recorrect : bool
+        True to correct the trained corpora of the shops with the enriched
+        word dictionary, without waiting for their next training.
 
     """
     # Configurations
@@ -24,6 +28,8 @@ def run(doccano_output_filename, word_dict_filename='word_dict.json'):
     # Load word dictionary
     logging.info(f'Loading word dictionary from {word_dict_filename}')
     word_dict = WordDict(word_dict_filename=word_dict_filename)
+    # Word dictionary as loaded by the trainings, whose hash is in their watermarks
+    old_word_dict = word_dict.word_dict
     len_bef = len(word_dict.word_dict)
 
     # Enrich word dictionary
@@ -33,6 +39,10 @@ def run(doccano_output_filename, word_dict_filename='word_dict.json'):
 
     logging.info(f'{len_aft - len_bef} new words added in the dictionary')
 
+    # Correct the trained corpora
+    if recorrect:
+        recorrect_corpora.run(old_word_dict, new_word_dict=word_dict.word_dict)
+
 
 if __name__ == '__main__':
     # Parse the cli arguments
@@ -41,10 +51,12 @@ if __name__ == '__main__':
                         help='filename of the doccano output after labelling')
     parser.add_argument('--word-dict-filename', help='filename of the word dictionary',
                         default='word_dict.json')
+    parser.add_argument('--recorrect', action='store_true',
+                        help='correct the trained corpora with the enriched dictionary')
     args = parser.parse_args()
 
     # Run pipeline
     try:
-        run(args.doccano_output_filename, args.word_dict_filename)
+        run(args.doccano_output_filename, args.word_dict_filename, args.recorrect)
     except Exception as e:
         logging.error(e)
@@ -0,0 +1,123 @@
+import json
+import logging
+import argparse
+
+from diaman.configuration.app import AppConfig
+from diaman.configuration.data import DataConfig
+from diaman.domain import preprocessing
+from diaman.domain.vectorizer import CorpusVect
+from diaman.pipeline.train_pipeline import get_preprocessing_hash
+from diaman.utils import histo
+
+
+def run(old_word_dict, language='fr', new_word_dict=None, code_shops=None):
+    """Run the pipeline to correct the trained corpora of the shops of a
+    language with an enriched word dictionary, without training them again.
+
+    Only the documents containing a token whose correction changed are
+    preprocessed again, & their rows of the document-term matrices updated.
+    The corrected CorpusVect objects are saved, so that the servers reload
+    their kernels. The vocabularies are refitted by the next training.
+
+    Parameters
+    ----------
+    old_word_dict : dict
+        word dictionary used to train the shops
+    language : string
+        language of the word dictionary
+    new_word_dict : dict
+        enriched word dictionary, the one of the data configuration if None
+    code_shops : list of strings
+        shops to correct, all the shops of the language if None
+
+    """
+    # Configurations
+    AppConfig()
+    data_config_language = DataConfig(language)
+    new_word_dict = data_config_language.word_dict if new_word_dict is None else new_word_dict
+
+    logging.info('===========================================================')
+    logging.info(f'Starting the correction of the {language} corpora')
+
+    changed_tokens = preprocessing.get_changed_tokens(old_word_dict, new_word_dict)
+    if len(changed_tokens) == 0:
+        logging.info('No correction changed: nothing to correct')
+        return
+    logging.info(f'{len(changed_tokens)} tokens whose correction changed')
+
+    old_preprocessing_hash = get_preprocessing_hash(data_config_language, old_word_dict)
+    new_preprocessing_hash = get_preprocessing_hash(data_config_language, new_word_dict)
+    code_shops = data_config_language.get_shops(language) if code_shops is None else code_shops
+    for code_shop in code_shops:
+        try:
+            recorrect_language_shop(language, code_shop, data_config_language.stopwords,
+                                    new_word_dict, changed_tokens, old_preprocessing_hash,
+                                    new_preprocessing_hash)
+        except Exception as e:
+            logging.error('Correction failed for the {} language and the {} shop: {!r}'
+                          .format(language, code_shop, e))
+
+    logging.info('*** Correction pipeline finished ***')
+
+
+def recorrect_language_shop(language, code_shop, stopwords, word_dict, changed_tokens,
+                            old_preprocessing_hash, new_preprocessing_hash):
+    """Correct the trained corpora of a tuple (language, shop) with a new
+    word dictionary & save the corrected CorpusVect objects.
+
+    Parameters
+    ----------
+    language : string
+        language of the reports
+    code_shop : string
+        code_shop of the plant ('emb', 'fer' ...)
+    stopwords : list of strings
+        list containing the stopwords
+    word_dict : dict
+        new personalized correction dictionnary
+    changed_tokens : set of strings
+        tokens of the documents to correct again
+    old_preprocessing_hash : string
+        hash of the stopwords & of the word_dict used to train the shop
+    new_preprocessing_hash : string
+        hash of the stopwords & of the new word_dict
+
+    """
+    # The shop must have been trained with the old word_dict
+    watermark = histo.load_artifact(language, code_shop, 'train_watermark')
+    if watermark is None or watermark['preprocessing_hash'] != old_preprocessing_hash:
+        logging.warning('The {} shop was not trained with the old word_dict: it is corrected '
+                        'by its next training'.format(code_shop))
+        return
+
+    n_recorrected = {}
+    for corpus_col in ['DESCR_ORDER', 'COMMENT']:
+        corpus_vect = CorpusVect(language, code_shop, corpus_col)
+        corpus_vect.load()
+        n_recorrected[corpus_col] = corpus_vect.recorrect_corpus(stopwords, word_dict,
+                                                                 changed_tokens)
+        if n_recorrected[corpus_col] > 0:
+            corpus_vect.save()
+    logging.info('Corrected documents of the {} shop: {}'.format(code_shop, n_recorrected))
+
+    # The corpora are now preprocessed with the new word_dict, so that the
+    # next training reuses them incrementally
+    histo.save_artifact(language, code_shop, 'train_watermark',
+                        dict(watermark, preprocessing_hash=new_preprocessing_hash))
+
+
+if __name__ == '__main__':
+    # Parse the cli arguments
+    parser = argparse.ArgumentParser()
+    parser.add_argument('old_word_dict_filepath',
+                        help='path to the word dictionary used to train the shops')
+    parser.add_argument('--language', help='language of the word dictionary', default='fr')
+    args = parser.parse_args()
+
+    # Run pipeline
+    try:
+        with open(args.old_word_dict_filepath) as reader:
+            old_word_dict = json.load(reader)
+        run(old_word_dict, args.language)
+    except Exception as e:
+        logging.error(e)
@@ -1,10 +1,14 @@
+import logging
 import unicodedata
+import numpy as np
+import pandas as pd
 
-from diaman.domain import report, lda
+from diaman.domain import report, lda, preprocessing
 
 
 def make_search(kernel, search, site_filters, constructor_filters,
-                equipment_filters, n_reports=50):
+                equipment_filters, n_reports=50, similarity=None, executor=None,
+                date_from=None, date_to=None, recency_boost=0.):
     """Output the results of the comparison between the user search and the
     database reports.
 
@@ -22,6 +26,16 @@ def make_search(kernel, search, site_filters, constructor_filters,
         equipments selected by the user
     n_reports : int
         number of reports to return
+    similarity : array of floats
+        similarity of each report with the user search, computed if None
+    executor : concurrent.futures.Executor
+        executor searching the shards of a sharded kernel concurrently
+    date_from : string
+        first creation date of the reports, e.g. '2019-01-01'
+    date_to : string
+        last creation date of the reports, included
+    recency_boost : float
+        weight given at the recency of the reports in the sort, between 0 & 1
 
     Returns
     -------
@@ -36,8 +50,16 @@ def make_search(kernel, search, site_filters, constructor_filters,
         filtered dataframe
 
     """
+    if executor is not None and similarity is None and len(kernel.shards) > 1:
+        return make_sharded_search(kernel, search, site_filters, constructor_filters,
+                                   equipment_filters, n_reports, executor,
+                                   date_from, date_to, recency_boost)
+
+    # Get the reports created between the dates from the date index
+    rows = get_date_rows(kernel, date_from, date_to)
+
     # Get the reports which correspond to the user search
-    df_reports = report.get_matching_reports(kernel, search)
+    df_reports = report.get_matching_reports(kernel, search, similarity, rows)
 
     # Filter the reports given the selected filters
     (df_reports,
@@ -51,14 +73,287 @@ def make_search(kernel, search, site_filters, constructor_filters,
     # Sort the reports according to the similarity score and the level of
     # detail of the comment
     df_reports = report.sort_reports(df_reports, kernel.slider_coeff_detail)
+    if recency_boost > 0:
+        df_reports = report.boost_recent_reports(df_reports, recency_boost,
+                                                 report.get_date_range(df_reports)) \
+            .sort_values(by='sorting_score', ascending=False) \
+            .reset_index(drop=True)
 
     return (df_reports.head(n_reports), matching_sites,
             matching_constructors, matching_equipments)
 
 
+def get_date_rows(kernel, date_from=None, date_to=None):
+    """Get the sorted positions of the reports of a kernel created between two
+    dates, None if there is no date bound.
+
+    Parameters
+    ----------
+    kernel : interface.kernel.AppKernel
+        instance containing the main objects of the application
+    date_from : string
+        first creation date of the reports
+    date_to : string
+        last creation date of the reports, included
+
+    """
+    if date_from is None and date_to is None:
+        return None
+    return report.get_date_rows(kernel.date_index, date_from, date_to)
+
+
+def make_sharded_search(kernel, search, site_filters, constructor_filters,
+                        equipment_filters, n_reports, executor, date_from=None,
+                        date_to=None, recency_boost=0.):
+    """Output the results of make_search, the shards of the kernel being
+    searched concurrently.
+
+    The similarities are scored shard by shard. The reports of each shard are
+    then filtered & ranked, the ranges used to normalize the level of detail
+    & the sorting score being reduced over all the shards, so that the scores
+    are the ones of make_search. The top reports of the shards are merged.
+
+    Parameters
+    ----------
+    kernel : interface.kernel.AppKernel
+        instance containing the main objects of the application, with shards
+    search : string
+        user search
+    site_filters : list
+        sites selected by the user
+    constructor_filters : list
+        constructors selected by the user
+    equipment_filters : list
+        equipments selected by the user
+    n_reports : int
+        number of reports to return
+    executor : concurrent.futures.Executor
+        executor searching the shards concurrently
+    date_from : string
+        first creation date of the reports
+    date_to : string
+        last creation date of the reports, included
+    recency_boost : float
+        weight given at the recency of the reports in the sort, between 0 & 1
+
+    Returns
+    -------
+    results : tuple
+        results of make_search
+
+    """
+    # Get the reports which correspond to the user search
+    similarity = report.score_reports(kernel, [search], executor)[0]
+    rows = get_date_rows(kernel, date_from, date_to)
+    candidate_similarity = similarity if rows is None else similarity[rows]
+    if not (candidate_similarity > 0).any():
+        raise ValueError(('No reports found matching the search, '
+                          'please modify your search.'))
+
+    # Filter the reports of each shard given the selected filters
+    df_preprocessed = kernel.comment_vect.df_preprocessed
+
+    def filter_shard(shard_bounds):
+        start, stop = shard_bounds
+        if rows is None:
+            shard_rows = slice(start, stop)
+        else:
+            shard_rows = rows[np.searchsorted(rows, start):np.searchsorted(rows, stop)]
+        df_shard = report.select_reports(df_preprocessed.iloc[shard_rows],
+                                         similarity[shard_rows])
+        return report.filter_reports(df_shard, site_filters, constructor_filters,
+                                     equipment_filters)
+
+    shard_results = list(executor.map(filter_shard, kernel.shards))
+
+    # Rank the reports of each shard given the ranges of all the shards
+    df_shards = rank_report_groups([df_shard for df_shard, _, _, _ in shard_results],
+                                   kernel.slider_coeff_detail, n_reports, recency_boost,
+                                   executor.map)
+
+    return report.merge_reports([(df_shard, *shard_result[1:])
+                                 for df_shard, shard_result in zip(df_shards, shard_results)],
+                                n_reports)
+
+
+def make_federated_search(kernels, search, site_filters, constructor_filters,
+                          equipment_filters, n_reports=50, executor=None,
+                          date_from=None, date_to=None, recency_boost=0.):
+    """Output the results of a search over the reports of several shops.
+
+    The reports of each kernel are scored & filtered, concurrently if an
+    executor is given. They are then ranked like the shards of a kernel, the
+    ranges of the sorting score being reduced over all the shops, & the top
+    reports of the shops are merged.
+
+    Parameters
+    ----------
+    kernels : dict of interface.kernel.AppKernel
+        kernel of each shop to search
+    search : string
+        user search
+    site_filters : list
+        sites selected by the user
+    constructor_filters : list
+        constructors selected by the user
+    equipment_filters : list
+        equipments selected by the user
+    n_reports : int
+        number of reports to return
+    executor : concurrent.futures.Executor
+        executor running the searches of the shops, one after another if None
+    date_from : string
+        first creation date of the reports
+    date_to : string
+        last creation date of the reports, included
+    recency_boost : float
+        weight given at the recency of the reports in the sort, between 0 & 1
+
+    Returns
+    -------
+    results : tuple
+        results of make_search, the reports of all the shops being merged
+        & the filter options of the shops being united
+
+    """
+    def filter_shop(kernel):
+        try:
+            rows = get_date_rows(kernel, date_from, date_to)
+            df_reports = report.get_matching_reports(kernel, search, rows=rows)
+        except ValueError:
+            return None
+        return report.filter_reports(df_reports, site_filters, constructor_filters,
+                                     equipment_filters)
+
+    if executor is None:
+        shop_results = [filter_shop(kernel) for kernel in kernels.values()]
+    else:
+        shop_results = list(executor.map(filter_shop, kernels.values()))
+
+    shop_results = [shop_result for shop_result in shop_results if shop_result is not None]
+    if len(shop_results) == 0:
+        raise ValueError(('No reports found matching the search, '
+                          'please modify your search.'))
+
+    # Rank the reports of each shop given the ranges of all the shops, so that
+    # their sorting scores are comparable
+    slider_coeff_detail = next(iter(kernels.values())).slider_coeff_detail
+    df_shops = rank_report_groups([df_shop for df_shop, _, _, _ in shop_results],
+                                  slider_coeff_detail, n_reports, recency_boost,
+                                  map if executor is None else executor.map)
+
+    return report.merge_reports([(df_shop, *shop_result[1:])
+                                 for df_shop, shop_result in zip(df_shops, shop_results)],
+                                n_reports)
+
+
+def rank_report_groups(df_groups, slider_coeff_detail, n_reports, recency_boost=0.,
+                       map_function=map):
+    """Rank the filtered reports of several groups, e.g. the shards of a
+    kernel or the shops of a federated search, on comparable sorting scores.
+
+    The max level of detail, the ranges used to normalize the similarity &
+    the level of detail, and the date range of the recency boost are reduced
+    over all the groups, so that the scores are the ones of make_search on
+    the union of the groups.
+
+    Parameters
+    ----------
+    df_groups : list of pd.DataFrame
+        filtered reports of each group, with the 'similarity' column
+    slider_coeff_detail : float
+        weight given at the level of detail
+    n_reports : int
+        number of reports to return for each group
+    recency_boost : float
+        weight given at the recency of the reports in the sort, between 0 & 1
+    map_function : callable
+        map applying a function to each group, e.g. the map of an executor
+
+    Returns
+    -------
+    df_groups : list of pd.DataFrame
+        top reports of each group, sorted by decreasing sorting score
+
+    """
+    # Evaluate the level of detail given the max level of detail of all the groups
+    max_detail_level = max(report.calculate_max_detail_level(df_group['corpus'].values.tolist())
+                           for df_group in df_groups)
+    df_groups = list(map_function(lambda df_group: report.compute_detail_level(
+        df_group, max_detail_level), df_groups))
+
+    # Sort the reports of each group given the ranges of all the groups
+    group_ranges = [report.get_sorting_ranges(df_group)
+                    for df_group in df_groups if len(df_group) > 0]
+    sorting_ranges = (min(ranges[0] for ranges in group_ranges) if group_ranges else np.nan,
+                      max(ranges[1] for ranges in group_ranges) if group_ranges else np.nan,
+                      min(ranges[2] for ranges in group_ranges) if group_ranges else np.nan,
+                      max(ranges[3] for ranges in group_ranges) if group_ranges else np.nan)
+    date_range = None
+    if recency_boost > 0:
+        dates = pd.Series([date for df_group in df_groups
+                           for date in report.get_date_range(df_group)])
+        date_range = (dates.min(), dates.max())
+
+    def rank_group(df_group):
+        df_group = report.compute_sorting_score(df_group, slider_coeff_detail, sorting_ranges)
+        if date_range is not None:
+            df_group = report.boost_recent_reports(df_group, recency_boost, date_range)
+        return df_group.sort_values(by='sorting_score', ascending=False).head(n_reports)
+
+    return list(map_function(rank_group, df_groups))
+
+
+def make_search_batch(kernel, searches, executor=None):
+    """Output the results of several searches on the same kernel, which are
+    scored in a single pass over the reports.
+
+    Parameters
+    ----------
+    kernel : interface.kernel.AppKernel
+        instance containing the main objects of the application
+    searches : list of dicts
+        parameters of make_search of each search: 'search', 'site_filters',
+        'constructor_filters', 'equipment_filters' & optionally 'n_reports',
+        'date_from', 'date_to' & 'recency_boost'
+    executor : concurrent.futures.Executor
+        executor scoring the shards of a sharded kernel concurrently
+
+    Returns
+    -------
+    results : list
+        results of make_search of each search, or the exception raised by
+        the search, which doesn't fail the other searches
+
+    """
+    similarities = report.score_reports(kernel, [search['search'] for search in searches],
+                                        executor)
+
+    results = []
+    for search, similarity in zip(searches, similarities):
+        try:
+            results.append(make_search(kernel, search['search'], search['site_filters'],
+                                       search['constructor_filters'],
+                                       search['equipment_filters'],
+                                       search.get('n_reports', 50), similarity,
+                                       date_from=search.get('date_from'),
+                                       date_to=search.get('date_to'),
+                                       recency_boost=search.get('recency_boost', 0.)))
+        except ValueError as e:
+            results.append(e)
+        except Exception as e:
+            logging.exception(e)
+            results.append(e)
+
+    return results
+
+
 def make_refine(kernel, search):
     """Output the results of the topics extraction from the matching reports.
 
+    The topics precomputed at training time are used when the search matches
+    one of them, the topics are extracted from the matching reports otherwise.
+
     Parameters
     ----------
     kernel : interface.kernel.AppKernel
@@ -70,19 +365,10 @@ def make_refine(kernel, search):
         list containing the top words of the topics
 
     """
-    # Get the reports which correspond to the user search
-    df_reports = report.get_matching_reports(kernel, search)
-
-    # Select only the 500 most similar reports with a similarity score > 0.05
-    df_reports = df_reports[df_reports['similarity'] > 0.05] \
-        .head(500) \
-        .reset_index(drop=True)
-
-    # Extract the top words
-    try:
-        top_words_topics = lda.extract_topics(df_reports, kernel.processing_params)
-    except ValueError:
-        top_words_topics = lda.get_top_words_corpus(df_reports)
+    # Answer from the precomputed topics or extract the top words
+    top_words_topics = kernel.refine_topics.get(preprocessing.normalize_query(search))
+    if top_words_topics is None:
+        top_words_topics = extract_refine_topics(kernel, search)
 
     # User search preprocessing
     search = unicodedata.normalize('NFKD', search) \
@@ -94,3 +380,88 @@ def make_refine(kernel, search):
                         for topic in top_words_topics]
 
     return top_words_topics
+
+
+def extract_refine_topics(kernel, search):
+    """Extract the top words of the topics of the reports matching the search.
+
+    Parameters
+    ----------
+    kernel : interface.kernel.AppKernel
+        instance containing the main objects of the application
+    search : string
+        user search
+
+    Returns
+    -------
+    top_words_topics : list
+        list of the top words of each topic
+
+    """
+    # Get the most similar reports which correspond to the user search
+    df_reports = get_refine_reports(kernel, search)
+
+    # Extract the top words
+    try:
+        top_words_topics = lda.extract_topics(df_reports, kernel.processing_params,
+                                              refine_params=kernel.refine_params)
+    except ValueError:
+        top_words_topics = lda.get_top_words_corpus(df_reports)
+
+    return top_words_topics
+
+
+def precompute_refine_topics(kernel, searches):
+    """Extract the top words of the topics of each search ahead of the refine.
+
+    Parameters
+    ----------
+    kernel : interface.kernel.AppKernel
+        instance containing the main objects of the application
+    searches : list of strings
+        user searches to precompute
+
+    Returns
+    -------
+    refine_topics : dict
+        top words of the topics of each normalized search, the searches
+        without matching reports are skipped
+
+    """
+    refine_topics = {}
+    for search in searches:
+        query = preprocessing.normalize_query(search)
+        if query in refine_topics:
+            continue
+        try:
+            refine_topics[query] = extract_refine_topics(kernel, search)
+        except ValueError:
+            logging.info("No reports found matching '{}'".format(search))
+
+    return refine_topics
+
+
+def get_refine_reports(kernel, search):
+    """Get the reports used to extract the topics of the user search.
+
+    Parameters
+    ----------
+    kernel : interface.kernel.AppKernel
+        instance containing the main objects of the application
+    search : string
+        user search
+
+    Returns
+    -------
+    df_reports : pd.DataFrame
+        dataframe with the 500 most similar reports with a similarity
+        score > 0.05
+
+    """
+    # Get the reports which correspond to the user search
+    df_reports = report.get_matching_reports(kernel, search)
+
+    # Select only the 500 most similar reports with a similarity score > 0.05
+    return df_reports[df_reports['similarity'] > 0.05] \
+        .head(500) \
+        .reset_index(drop=True)
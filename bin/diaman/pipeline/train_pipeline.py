@@ -1,8 +1,28 @@
+import os
+import glob
+import json
+import shutil
+import hashlib
 import logging
+import datetime
+import numpy as np
+import yaml
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
 from pyspark.sql import functions as F
+from pyspark.sql.functions import PandasUDFType
 
+import diaman
 from diaman.configuration.data import DataConfig
 from diaman.domain.vectorizer import CorpusVect
+from diaman.domain import lda, preprocessing, report
+from diaman.interface.kernel import DiamanKernel, get_last_vect_filepaths
+from diaman.pipeline import search_pipeline
+from diaman.utils import histo, memory
+from diaman.utils.cache import CorpusCache
 
 
 def run(spark_session, standard_data_path):
@@ -33,28 +53,637 @@ def run(spark_session, standard_data_path):
                        F.when(F.col("CONSTRUCTOR") != "", F.upper(F.col("CONSTRUCTOR")))
                        .otherwise("UNKNOWN")) \
            .withColumn("RATING", F.lit(-1)) \
-           .distinct()
+           .distinct() \
+           .withColumn("LANGUAGE", get_language_col(data_config)) \
+           .filter(F.col("LANGUAGE").isNotNull())
+
+    # Preprocess the corpora on the executors
+    if data_config.train_params.distributed_preprocessing:
+        df = preprocess_reports(spark_session, df, data_config)
 
     df.persist()
     logging.info(f"Total number of reports used for the train: {df.count()}")
 
+    # Stage the reports partitioned by (language, shop) in a single pass
+    staging_path = get_staging_path(data_config)
+    stage_language_shops(df, data_config, staging_path)
+    df.unpersist()
+
+    train_staged_language_shops(staging_path, data_config)
+
+    logging.info('*** Training pipeline finished ***')
+
+
+def run_local(standard_data_path):
+    """Create, train & save the main objects of the application on the local
+    machine, without Spark.
+
+    The standard data is read with pyarrow, row group by row group, with the
+    same filters & transformations as the Spark pipeline.
+
+    Parameters
+    ----------
+    standard_data_path : string
+        path to the local standard data directory
+
+    """
+    logging.info('===========================================================')
+    logging.info('Starting local training pipeline')
+
+    # Configurations
+    data_config = DataConfig()
+
+    # Stage the reports partitioned by (language, shop)
+    staging_path = get_staging_path(data_config)
+    stage_language_shops_local(standard_data_path, data_config, staging_path)
+
+    train_staged_language_shops(staging_path, data_config)
+
+    logging.info('*** Local training pipeline finished ***')
+
+
+def train_staged_language_shops(staging_path, data_config):
+    """Train the tuples (language, shop) from the staged reports, then select
+    their number of topics & precompute their refine topics.
+
+    Parameters
+    ----------
+    staging_path : string
+        directory of the parquet files partitioned by language & shop
+    data_config : configuration.data.DataConfig
+        data configuration
+
+    """
     # Train models for each tuple (language, shop)
+    columns = get_staging_columns(data_config)
+
+    def load_language_shop(language, code_shop):
+        return load_staged_language_shop(staging_path, language, code_shop, columns)
+
+    language_shops = [(language, code_shop) for language in data_config.indus_languages
+                      for code_shop in data_config.get_shops(language)]
+    shop_outputs = train_language_shops(language_shops, load_language_shop, data_config)
+    lda_matrices = {key: outputs['lda_matrix'] for key, outputs in shop_outputs.items()
+                    if outputs['lda_matrix'] is not None}
+    frequent_equipments = {key: outputs['frequent_equipments']
+                           for key, outputs in shop_outputs.items()}
+
+    # Select the number of topics of each tuple (language, shop)
+    if data_config.lda_sweep_params.enabled:
+        make_lda_sweep(lda_matrices, data_config)
+
+    # Precompute the refine topics of the frequent equipments & searches
+    if data_config.refine_precompute_params.enabled:
+        df_user_actions = histo.load_user_actions()
+        for (language, code_shop), equipments in frequent_equipments.items():
+            frequent_searches = get_frequent_searches(df_user_actions, code_shop,
+                                                      data_config.refine_precompute_params)
+            make_refine_topics(language, code_shop, equipments + frequent_searches)
+
+
+def get_staging_path(data_config):
+    """Get the directory where the reports are staged."""
+    return data_config.train_params.staging_path or \
+        os.path.join(os.environ['REPO'], 'staging')
+
+
+def get_staging_columns(data_config):
+    """Get the columns of the staged reports, in order."""
+    return list(data_config.gmt_columns.values()) + ['RATING']
+
+
+def stage_language_shops(df, data_config, staging_path):
+    """Write the reports as parquet files partitioned by language & shop.
+
+    The reports are shuffled once by (language, shop), so that each shop
+    is written in a single file, instead of scanning all the reports for
+    each shop.
+
+    Parameters
+    ----------
+    df : pyspark.sql.DataFrame
+        dataframe with the reports of all the sites & their 'LANGUAGE'
+    data_config : configuration.data.DataConfig
+        data configuration
+    staging_path : string
+        directory where to write the parquet files, on a filesystem shared by
+        the executors & the driver
+
+    """
+    logging.info('Staging the reports to: {}'.format(staging_path))
+    start_time = datetime.datetime.now()
+
+    df.repartition("LANGUAGE", "CODE_SHOP") \
+      .write.partitionBy("LANGUAGE", "CODE_SHOP") \
+      .mode("overwrite") \
+      .parquet('file://' + os.path.abspath(staging_path))
+
+    staging_time = round((datetime.datetime.now() - start_time).total_seconds())
+    logging.info('Staging time: {}'.format(staging_time))
+
+
+def get_language_col(data_config):
+    """Get the spark column with the language of the site of each report,
+    null for the sites out of the perimeter."""
+    site_languages = F.create_map(*[F.lit(value) for language in data_config.indus_languages
+                                    for site in data_config.get_sites(language)
+                                    for value in (site, language)])
+    return site_languages[F.col("CODE_SITE")]
+
+
+def preprocess_reports(spark_session, df, data_config):
+    """Preprocess the corpora of the reports on the Spark executors.
+
+    The spare parts are added to the 'COMMENT' column, then each corpus of
+    preprocessing.PREPROCESSED_CORPORA is preprocessed by a pandas udf into
+    its own column, the stopwords & word dicts of the languages being
+    broadcast to the executors.
+
+    Parameters
+    ----------
+    spark_session : pyspark.sql.session.SparkSession
+        session of the Spark application
+    df : pyspark.sql.DataFrame
+        dataframe with the reports of all the sites & their 'LANGUAGE'
+    data_config : configuration.data.DataConfig
+        data configuration with the industrialisation perimeter
+
+    Returns
+    -------
+    df : pyspark.sql.DataFrame
+        dataframe with the preprocessed corpora, named by
+        preprocessing.get_preprocessed_col
+
+    """
+    logging.info('Preprocessing the corpora on the executors')
+    stopwords, word_dicts = {}, {}
     for language in data_config.indus_languages:
-        for code_shop in data_config.get_shops(language):
-            df_language_shop = df.filter(df["CODE_SITE"].isin(data_config.get_sites(language))) \
-                                 .filter(df["CODE_SHOP"] == code_shop.upper()) \
-                                 .toPandas()
-            # Add spare part to the COMMENT
-            df_language_shop['COMMENT'] += df_language_shop['COMPONENTS'] \
-                .apply(lambda components: ' ' + ' '.join([component[0]
-                                                          for component in components]))
-            make_train_language_shop(df_language_shop, language, code_shop)
+        data_config_language = DataConfig(language)
+        stopwords[language] = data_config_language.stopwords
+        word_dicts[language] = data_config_language.word_dict
+    stopwords_bc = spark_session.sparkContext.broadcast(stopwords)
+    word_dicts_bc = spark_session.sparkContext.broadcast(word_dicts)
 
-    logging.info('*** Training pipeline finished ***')
+    # Add spare part to the COMMENT
+    component_field = df.schema["COMPONENTS"].dataType.elementType.fieldNames()[0]
+    df = df.withColumn("COMMENT", F.concat(F.col("COMMENT"), F.lit(" "),
+                                           F.concat_ws(" ", F.col("COMPONENTS." + component_field))))
+
+    for corpus_col, is_lda in preprocessing.PREPROCESSED_CORPORA:
+        preprocess_udf = make_preprocess_udf(corpus_col, is_lda, stopwords_bc, word_dicts_bc)
+        df = df.withColumn(preprocessing.get_preprocessed_col(corpus_col, is_lda),
+                           preprocess_udf(F.col(corpus_col), F.col("LANGUAGE")))
+    return df
+
+
+def make_preprocess_udf(corpus_col, is_lda, stopwords_bc, word_dicts_bc):
+    """Make the pandas udf preprocessing a corpus by batches on the executors.
+
+    Parameters
+    ----------
+    corpus_col : string
+        name of the column containing the text information
+    is_lda : bool
+        True to preprocess the corpus for the lda training, without numbers &
+        small words
+    stopwords_bc : pyspark.Broadcast
+        broadcast stopwords of each language
+    word_dicts_bc : pyspark.Broadcast
+        broadcast correction dictionnary of each language
+
+    """
+    def preprocess(corpus, languages):
+        return preprocessing.preprocess_corpus_by_language(corpus, languages, corpus_col,
+                                                           stopwords_bc.value, word_dicts_bc.value,
+                                                           remove_numbers=is_lda,
+                                                           remove_small_words=is_lda)
+    return F.pandas_udf(preprocess, 'string', PandasUDFType.SCALAR)
+
+
+def stage_language_shops_local(standard_data_path, data_config, staging_path):
+    """Write the reports of the local standard data as parquet files
+    partitioned by language & shop, without Spark.
+
+    The parquet files are read row group by row group & the reports kept by
+    the filters of the Spark pipeline are appended to their partition as they
+    arrive: the memory peak is the one of a row group, plus a digest of each
+    kept report to drop the duplicates. The staged files have the same layout
+    & schema as the ones written by Spark.
+
+    Parameters
+    ----------
+    standard_data_path : string
+        path to the local standard data directory
+    data_config : configuration.data.DataConfig
+        data configuration with the industrialisation perimeter
+    staging_path : string
+        directory where to write the parquet files
+
+    """
+    logging.info('Staging the reports to: {}'.format(staging_path))
+    start_time = datetime.datetime.now()
+
+    site_languages = {site: language for language in data_config.indus_languages
+                      for site in data_config.get_sites(language)}
+    filepaths = sorted(glob.glob(os.path.join(standard_data_path, '**', '*.parquet'),
+                                 recursive=True))
+    if len(filepaths) == 0:
+        raise FileNotFoundError(f"No parquet files in {standard_data_path}")
+
+    if os.path.exists(staging_path):
+        shutil.rmtree(staging_path)
+    writers, schema, digests, n_reports = {}, None, set(), 0
+    try:
+        for filepath in filepaths:
+            parquet_file = pq.ParquetFile(filepath)
+            for row_group in range(parquet_file.num_row_groups):
+                table = parquet_file.read_row_group(row_group,
+                                                    columns=list(data_config.gmt_columns))
+                schema = schema or get_staging_schema(table.schema, data_config)
+                df = transform_reports(table.to_pandas(date_as_object=True),
+                                       data_config, site_languages)
+                df = df[get_unique_mask(df, digests)]
+                n_reports += len(df)
+                for (language, code_shop), df_language_shop in df.groupby(['LANGUAGE',
+                                                                           'CODE_SHOP']):
+                    if (language, code_shop) not in writers:
+                        partition_path = os.path.join(staging_path,
+                                                      'LANGUAGE={}'.format(language),
+                                                      'CODE_SHOP={}'.format(code_shop))
+                        os.makedirs(partition_path)
+                        writers[(language, code_shop)] = pq.ParquetWriter(
+                            os.path.join(partition_path, 'part-00000.parquet'), schema)
+                    writers[(language, code_shop)].write_table(pa.Table.from_pandas(
+                        df_language_shop.drop(columns=['LANGUAGE', 'CODE_SHOP']),
+                        schema=schema, preserve_index=False))
+    finally:
+        for writer in writers.values():
+            writer.close()
+    logging.info(f"Total number of reports used for the train: {n_reports}")
+
+    staging_time = round((datetime.datetime.now() - start_time).total_seconds())
+    logging.info('Staging time: {}'.format(staging_time))
+
+
+def get_unique_mask(df, digests):
+    """Get the mask of the reports of a chunk which are neither duplicated in
+    the chunk nor in the previous chunks.
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        dataframe with a chunk of the reports
+    digests : set of bytes
+        digests of the reports of the previous chunks, updated with the
+        digests of the unique reports of the chunk
+
+    """
+    mask = np.zeros(len(df), dtype=bool)
+    rows = zip(*[df[col].map(get_hashable) for col in df.columns])
+    for idx, row in enumerate(rows):
+        digest = hashlib.md5(repr(row).encode('utf-8')).digest()
+        if digest not in digests:
+            digests.add(digest)
+            mask[idx] = True
+    return mask
+
+
+def transform_reports(df, data_config, site_languages):
+    """Apply the filters & transformations of the Spark pipeline to a chunk
+    of the raw reports with pandas.
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        dataframe with the raw reports
+    data_config : configuration.data.DataConfig
+        data configuration with the columns to rename
+    site_languages : dict
+        language of each site of the perimeter
+
+    Returns
+    -------
+    df : pd.DataFrame
+        dataframe with the renamed columns & the 'LANGUAGE' of the reports
+
+    """
+    df = df[(df["AUART"] == "ZURG") & df["KTEXT"].notnull() & df["COMMENTAIRE"].notnull()] \
+        .rename(columns=data_config.gmt_columns)
+    df = df.assign(
+        DURA_EQUI=pd.to_numeric(df["DURA_EQUI"], errors='coerce').astype('float32') * np.float32(60),
+        CONSTRUCTOR=np.where(df["CONSTRUCTOR"].notnull() & (df["CONSTRUCTOR"] != ""),
+                             df["CONSTRUCTOR"].str.upper(), "UNKNOWN"),
+        RATING=np.int32(-1),
+        LANGUAGE=df["CODE_SITE"].map(site_languages))
+    return df[df["LANGUAGE"].notnull()]
+
+
+def get_staging_schema(raw_schema, data_config):
+    """Get the schema of the staged reports from the schema of the raw reports,
+    without the partition columns."""
+    fields = []
+    for raw_col, col in data_config.gmt_columns.items():
+        if col == 'CODE_SHOP':
+            continue
+        field_type = raw_schema.field_by_name(raw_col).type
+        if col == 'DURA_EQUI':
+            field_type = pa.float32()
+        elif col == 'CONSTRUCTOR':
+            field_type = pa.string()
+        fields.append(pa.field(col, field_type))
+    return pa.schema(fields + [pa.field('RATING', pa.int32())])
+
+
+def get_hashable(value):
+    """Get a hashable representation of a value of the reports, the spare
+    parts & medias being arrays of dicts."""
+    if isinstance(value, np.ndarray):
+        return tuple(get_hashable(item) for item in value)
+    if isinstance(value, dict):
+        return tuple((key, get_hashable(item)) for key, item in value.items())
+    return value
+
+
+def load_staged_language_shop(staging_path, language, code_shop, columns):
+    """Load the staged reports of a tuple (language, shop) with pyarrow.
+
+    Parameters
+    ----------
+    staging_path : string
+        directory of the parquet files partitioned by language & shop
+    language : string
+        language of the reports
+    code_shop : string
+        code_shop of the plant ('emb', 'fer' ...)
+    columns : list of strings
+        columns of the staged dataframe, in order, followed by the
+        preprocessed corpora if any
+
+    Returns
+    -------
+    df_language_shop : pd.DataFrame
+        dataframe with the reports of the tuple (language, shop) sorted by
+        'AUFNR', so that the trained objects don't depend on the order of the
+        staged files, the structs (e.g. the spare parts of 'COMPONENTS') being
+        tuples as in the rows collected from Spark
+
+    """
+    table = pq.read_table(os.path.join(staging_path, 'LANGUAGE={}'.format(language),
+                                       'CODE_SHOP={}'.format(code_shop.upper())))
+    df_language_shop = table.to_pandas(date_as_object=True)
+    for field in table.schema:
+        if pa.types.is_list(field.type) and pa.types.is_struct(field.type.value_type):
+            df_language_shop[field.name] = [
+                None if structs is None else [tuple(struct.values()) for struct in structs]
+                for structs in df_language_shop[field.name].values]
+    df_language_shop['CODE_SHOP'] = code_shop.upper()
+    columns = columns + [col for col in df_language_shop.columns if col not in columns]
+    return df_language_shop[columns].sort_values('AUFNR', kind='mergesort') \
+                                    .reset_index(drop=True)
+
+
+def train_language_shops(language_shops, load_language_shop, data_config):
+    """Train the tuples (language, shop), concurrently in a process pool.
+
+    The reports of each shop are loaded by the calling process, which holds
+    the Spark session, and trained in a child process forked from it, which
+    must not use Spark. The next shop is only loaded when a worker is free &
+    the driver has enough available memory. A shop whose loading or training
+    fails is logged & skipped without stopping the others. When a worker dies
+    (e.g. killed for lack of memory), the pool is replaced & the shops of the
+    broken pool are retried one at a time.
+
+    Parameters
+    ----------
+    language_shops : list of tuples
+        tuples (language, code_shop) to train
+    load_language_shop : function
+        function returning the dataframe of the reports of a tuple
+        (language, code_shop)
+    data_config : configuration.data.DataConfig
+        data configuration with the train, lda sweep & refine precompute
+        parameters
+
+    Returns
+    -------
+    shop_outputs : dict of dicts
+        'lda_matrix' & 'frequent_equipments' of each successfully trained
+        tuple (language, shop)
+
+    """
+    train_params = data_config.train_params
+    max_workers = train_params.max_workers or os.cpu_count()
+    logging.info('Training {} shops with {} workers'.format(len(language_shops), max_workers))
+    start_time = datetime.datetime.now()
+
+    shop_outputs, timings = {}, []
+
+    def load(language, code_shop):
+        load_start = datetime.datetime.now()
+        try:
+            df_language_shop = load_language_shop(language, code_shop)
+        except Exception as e:
+            logging.error('Loading failed for the {} language and the {} shop: {!r}'
+                          .format(language, code_shop, e))
+            timings.append({'language': language, 'code_shop': code_shop,
+                            'status': 'failed', 'load_time': None, 'train_time': None})
+            return None, None
+        return df_language_shop, round((datetime.datetime.now() - load_start).total_seconds())
+
+    def collect(language, code_shop, load_time, get_outputs, broken=None):
+        try:
+            outputs = get_outputs()
+        except BrokenProcessPool as e:
+            # A worker died (e.g. killed for lack of memory) & broke the pool:
+            # the shops of the pool are retried one at a time, if not retried yet
+            logging.error('Worker died while training the {} language and the {} shop: {!r}'
+                          .format(language, code_shop, e))
+            timings.append({'language': language, 'code_shop': code_shop,
+                            'status': 'broken' if broken is not None else 'failed',
+                            'load_time': load_time, 'train_time': None})
+            if broken is not None:
+                broken.append((language, code_shop))
+            return
+        except Exception as e:
+            logging.error('Training failed for the {} language and the {} shop: {!r}'
+                          .format(language, code_shop, e))
+            timings.append({'language': language, 'code_shop': code_shop,
+                            'status': 'failed', 'load_time': load_time, 'train_time': None})
+            return
+        shop_outputs[(language, code_shop)] = outputs
+        timings.append({'language': language, 'code_shop': code_shop,
+                        'status': 'skipped' if outputs['skipped'] else 'trained',
+                        'load_time': load_time, 'train_time': outputs['train_time']})
+
+    if max_workers == 1:
+        for language, code_shop in language_shops:
+            df_language_shop, load_time = load(language, code_shop)
+            if df_language_shop is not None:
+                collect(language, code_shop, load_time,
+                        lambda: make_train_outputs(df_language_shop, language, code_shop,
+                                                   data_config))
+            del df_language_shop
+    else:
+        broken = []
+        executor = ProcessPoolExecutor(max_workers=max_workers)
+        try:
+            futures = {}
+            for language, code_shop in language_shops:
+                # Wait for a free worker & for enough available memory
+                while futures and (len(futures) >= max_workers or
+                                   memory.get_available_memory()
+                                   < train_params.min_available_memory * 2**20):
+                    done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        collect(*futures.pop(future), future.result, broken)
+
+                df_language_shop, load_time = load(language, code_shop)
+                if df_language_shop is not None:
+                    try:
+                        future = executor.submit(make_train_outputs, df_language_shop,
+                                                 language, code_shop, data_config)
+                    except BrokenProcessPool:
+                        # The pool was broken by a dead worker: train in a new one
+                        executor.shutdown(wait=False)
+                        executor = ProcessPoolExecutor(max_workers=max_workers)
+                        future = executor.submit(make_train_outputs, df_language_shop,
+                                                 language, code_shop, data_config)
+                    futures[future] = (language, code_shop, load_time)
+                del df_language_shop
+
+            for future in list(futures):
+                collect(*futures.pop(future), future.result, broken)
+        finally:
+            executor.shutdown()
+
+        # Retry the shops of the broken pools alone, so that a shop killing its
+        # worker again doesn't take the other shops down with it
+        for language, code_shop in broken:
+            df_language_shop, load_time = load(language, code_shop)
+            if df_language_shop is not None:
+                with ProcessPoolExecutor(max_workers=1) as executor:
+                    future = executor.submit(make_train_outputs, df_language_shop, language,
+                                             code_shop, data_config)
+                    del df_language_shop
+                    collect(language, code_shop, load_time, future.result)
+
+    df_timings = pd.DataFrame(timings, columns=['language', 'code_shop', 'status',
+                                                'load_time', 'train_time'])
+    logging.info('Training times of the shops:\n{}'.format(df_timings.to_string(index=False)))
+    train_time = round((datetime.datetime.now() - start_time).total_seconds())
+    logging.info('Shops training time: {}'.format(train_time))
+
+    return shop_outputs
+
+
+def make_train_outputs(df_language_shop, language, code_shop, data_config):
+    """Train a tuple (language, shop) & compute the outputs needed by the
+    following steps of the training pipeline.
+
+    Parameters
+    ----------
+    df_language_shop : pd.DataFrame
+        dataframe with the reports corresponding to the tuple (language, code_shop)
+    language : string
+        language of the reports
+    code_shop : string
+        code_shop of the plant ('emb', 'fer' ...)
+    data_config : configuration.data.DataConfig
+        data configuration with the lda sweep & refine precompute parameters
+
+    Returns
+    -------
+    outputs : dict
+        'lda_matrix' for the sweep of the number of topics (None if the sweep
+        is disabled or the unchanged shop already swept), 'frequent_equipments'
+        for the precomputed refine topics, 'train_time' in seconds & 'skipped'
+        True if the shop was unchanged
+
+    """
+    start_time = datetime.datetime.now()
+
+    # Skip the training when its inputs didn't change since the last one
+    preprocessing_hash = get_preprocessing_hash(DataConfig(language))
+    fingerprint = get_train_fingerprint(df_language_shop, preprocessing_hash, data_config)
+    manifest = get_unchanged_manifest(language, code_shop, fingerprint) \
+        if data_config.train_params.skip_unchanged else None
+
+    if manifest is None:
+        # Flatten the spare parts & medias once into child tables, saved with
+        # the COMMENT vectorizer for the search results
+        child_tables = report.build_child_tables(df_language_shop)
+
+        # Add spare part to the COMMENT, unless preprocessed on the executors
+        preprocessed = preprocessing.get_preprocessed_col('COMMENT') in df_language_shop.columns
+        if not preprocessed:
+            df_language_shop['COMMENT'] += get_components_text(child_tables['COMPONENTS'])
+
+        # Reuse the preprocessed corpora of the last training for the unchanged reports
+        previous_vects, watermark = (None, None) if preprocessed else \
+            get_previous_vects(language, code_shop, preprocessing_hash, data_config.train_params)
+        corpus_vects, n_reused = make_train_language_shop(df_language_shop, language, code_shop,
+                                                          previous_vects=previous_vects,
+                                                          child_tables=child_tables)
+        del previous_vects
+        save_watermark(df_language_shop, language, code_shop, preprocessing_hash, n_reused,
+                       watermark)
+        histo.save_artifact(language, code_shop, 'train_manifest', {
+            'fingerprint': fingerprint,
+            'vect_filepaths': {corpus_col: corpus_vect.vect_filepath
+                               for corpus_col, corpus_vect in corpus_vects.items()}})
+        comment_vect = corpus_vects['COMMENT']
+    elif data_config.lda_sweep_params.enabled \
+            and histo.load_artifact(language, code_shop, 'lda_sweep') is None:
+        comment_vect = CorpusVect(language, code_shop, 'COMMENT')
+        comment_vect.load(manifest['vect_filepaths']['COMMENT'])
+    else:
+        comment_vect = None
+
+    # Keep the lda document-term matrix for the sweep of the number of topics,
+    # unless the shop is unchanged & already swept
+    lda_matrix = None
+    if data_config.lda_sweep_params.enabled and comment_vect is not None:
+        _, lda_matrix, _ = lda.vectorize_corpus(comment_vect.df_preprocessed,
+                                                data_config.processing_params)
+
+    # Keep the most frequent equipments for the precomputed refine topics
+    frequent_equipments = get_frequent_values(
+        df_language_shop['DESCR_EQUI'], data_config.refine_precompute_params.n_equipments,
+        data_config.refine_precompute_params.min_count)
+
+    train_time = round((datetime.datetime.now() - start_time).total_seconds())
+    logging.info('Training time for the {} language and the {} shop: {}'
+                 .format(language, code_shop, train_time))
+
+    return {'lda_matrix': lda_matrix,
+            'frequent_equipments': frequent_equipments,
+            'train_time': train_time,
+            'skipped': manifest is not None}
+
+
+def get_components_text(components_table):
+    """Get the text of the spare parts appended to the 'COMMENT' of the reports:
+    their numbers, joined from the child table of the spare parts.
+
+    Parameters
+    ----------
+    components_table : tuple
+        (offsets, values of each field) child table of the spare parts, see
+        report.build_child_tables
+
+    Returns
+    -------
+    components_text : array of strings
+        numbers of the spare parts of each report, each preceded by a space,
+        a space for a report without spare parts
+
+    """
+    offsets, fields = components_table
+    return report.join_child_values(offsets, fields['MATNR'], sep=' ', empty=' ')
 
 
 def make_train_language_shop(df, language, code_shop, remove_numbers=False,
-                             remove_small_words=False):
+                             remove_small_words=False, previous_vects=None, child_tables=None):
     """Train CorpusVect objects for a specific tuple (language, shop).
 
     Parameters
@@ -69,6 +698,20 @@ def make_train_language_shop(df, language, code_shop, remove_numbers=False,
         True if numbers are removed
     remove_small_words : bool
         True if small words are removed
+    previous_vects : dict of CorpusVect
+        CorpusVect objects of the previous training, whose preprocessed
+        corpora are reused for the unchanged reports, None to preprocess all
+        the reports
+    child_tables : dict of tuples
+        child tables of the spare parts & medias of the reports, saved with
+        the COMMENT CorpusVect, flattened from df if None
+
+    Returns
+    -------
+    corpus_vects : dict of CorpusVect
+        trained CorpusVect objects for the 'DESCR_ORDER' & 'COMMENT' columns
+    n_reused : int
+        number of reports whose preprocessed corpora are reused
 
     """
     logging.info('Training for the {} language and the {} shop'.format(language, code_shop))
@@ -77,11 +720,339 @@ def make_train_language_shop(df, language, code_shop, remove_numbers=False,
     data_config_language = DataConfig(language)
 
     # Create corpus_vect objects
+    # Load the cache of the documents preprocessed by the previous trainings
+    corpus_cache = None
+    if data_config_language.train_params.preprocessing_cache_size is not None:
+        corpus_cache = CorpusCache(os.path.join(histo.get_histo_path(language, code_shop),
+                                                'preprocessing_cache', 'corpus_cache.parquet'),
+                                   get_preprocessing_hash(data_config_language),
+                                   data_config_language.train_params.preprocessing_cache_size
+                                   * 2**20)
+
+    corpus_vects = {}
+    n_reused = 0
     for corpus_col in ['DESCR_ORDER', 'COMMENT']:
         logging.info('Creating {}_vect'.format(corpus_col))
         corpus_vect = CorpusVect(language, code_shop, corpus_col)
-        corpus_vect.preprocess_corpus(df, data_config_language.stopwords,
-                                      data_config_language.word_dict,
-                                      remove_numbers, remove_small_words)
+        if preprocessing.get_preprocessed_col(corpus_col) in df.columns:
+            corpus_vect.set_preprocessed_corpus(df)
+        else:
+            n_reused = corpus_vect.preprocess_corpus(
+                df, data_config_language.stopwords, data_config_language.word_dict,
+                remove_numbers, remove_small_words,
+                previous_vects[corpus_col] if previous_vects is not None else None,
+                corpus_cache)
+        if corpus_col == 'COMMENT':
+            corpus_vect.child_tables = report.build_child_tables(df) \
+                if child_tables is None else child_tables
+        # The vocabulary & the idf depend on all the reports: always refitted
         corpus_vect.create_vectorizer()
         corpus_vect.save()
+        corpus_vects[corpus_col] = corpus_vect
+
+    if corpus_cache is not None and corpus_cache.hits + corpus_cache.misses > 0:
+        logging.info('Preprocessing cache of the {} shop: {} hits, {} misses ({:.1%} hit rate)'
+                     .format(code_shop, corpus_cache.hits, corpus_cache.misses,
+                             corpus_cache.get_hit_rate()))
+        corpus_cache.save()
+
+    return corpus_vects, n_reused
+
+
+def get_previous_vects(language, code_shop, preprocessing_hash, train_params):
+    """Get the CorpusVect objects of the last training of a tuple (language,
+    shop) to train it incrementally, unless it must be fully rebuilt.
+
+    The shop is fully rebuilt when the incremental training is disabled, when
+    it was never trained, when its stopwords or word_dict changed, or when its
+    last full rebuild is older than 'full_rebuild_days'.
+
+    Parameters
+    ----------
+    language : string
+        language of the reports
+    code_shop : string
+        code_shop of the plant ('emb', 'fer' ...)
+    preprocessing_hash : string
+        hash of the stopwords & word_dict of the language
+    train_params : configuration.data.TrainParameters
+        train parameters recorded in conf/data/processing_conf.yml
+
+    Returns
+    -------
+    previous_vects : dict of CorpusVect
+        CorpusVect objects of the last training, None for a full rebuild
+    watermark : dict
+        watermark of the last training, None if it was never trained
+
+    """
+    watermark = histo.load_artifact(language, code_shop, 'train_watermark')
+    if not train_params.incremental or watermark is None:
+        return None, watermark
+
+    last_full_rebuild = datetime.datetime.strptime(watermark['last_full_rebuild'], '%Y%m%d_%H%M')
+    if watermark['preprocessing_hash'] != preprocessing_hash:
+        logging.info('Full rebuild of the {} shop: diaman version, stopwords or word_dict '
+                     'changed'.format(code_shop))
+        return None, watermark
+    if (datetime.datetime.now() - last_full_rebuild).days >= train_params.full_rebuild_days:
+        logging.info('Full rebuild of the {} shop: last one on {}'.format(code_shop,
+                                                                           last_full_rebuild))
+        return None, watermark
+
+    previous_vects = {}
+    try:
+        for corpus_col in ['DESCR_ORDER', 'COMMENT']:
+            previous_vects[corpus_col] = CorpusVect(language, code_shop, corpus_col)
+            previous_vects[corpus_col].load()
+    except Exception as e:
+        logging.warning('Full rebuild of the {} shop: last training not loaded ({!r})'
+                        .format(code_shop, e))
+        return None, watermark
+    return previous_vects, watermark
+
+
+def get_train_fingerprint(df, preprocessing_hash, data_config):
+    """Get the fingerprint of the inputs of the training of a tuple (language,
+    shop): its reports, the stopwords & word_dict of its language, the
+    processing parameters (except the train parameters) & the diaman version.
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        dataframe with the reports of the tuple (language, shop), before
+        their components are appended to the COMMENT
+    preprocessing_hash : string
+        hash of the stopwords & word_dict of the language
+    data_config : configuration.data.DataConfig
+        data configuration loaded from conf/data/processing_conf.yml
+
+    Returns
+    -------
+    fingerprint : string
+        md5 hash of the inputs of the training, independent of the order of
+        the reports & columns
+
+    """
+    with open(data_config._processing_filepath) as f:
+        config = yaml.load(f.read(), Loader=yaml.FullLoader)
+    config.pop('train_parameters')
+
+    fingerprint = hashlib.md5(json.dumps([diaman.__version__, preprocessing_hash, config],
+                                         sort_keys=True).encode('utf-8'))
+    fingerprint.update(np.asarray(sorted(df.columns)).astype(str).tobytes())
+    fingerprint.update(np.sort(preprocessing.hash_reports(df[sorted(df.columns)])).tobytes())
+    return fingerprint.hexdigest()
+
+
+def get_unchanged_manifest(language, code_shop, fingerprint):
+    """Get the manifest of the last training of a tuple (language, shop) if
+    its inputs didn't change since then.
+
+    Parameters
+    ----------
+    language : string
+        language of the reports
+    code_shop : string
+        code_shop of the plant ('emb', 'fer' ...)
+    fingerprint : string
+        fingerprint of the inputs of the training
+
+    Returns
+    -------
+    manifest : dict
+        fingerprint & 'vect_filepaths' of the last training, None if the
+        shop must be trained
+
+    """
+    manifest = histo.load_artifact(language, code_shop, 'train_manifest')
+    if manifest is None or manifest['fingerprint'] != fingerprint:
+        return None
+
+    vect_filepaths = manifest['vect_filepaths']
+    if any(not os.path.exists(vect_filepath) for vect_filepath in vect_filepaths.values()):
+        logging.warning('Training the {} shop: artifacts of the last training not found'
+                        .format(code_shop))
+        return None
+    if vect_filepaths != get_last_vect_filepaths(language, code_shop):
+        logging.warning('Training the {} shop: artifacts saved after the last training'
+                        .format(code_shop))
+        return None
+
+    logging.info('Training of the {} language and the {} shop skipped: inputs unchanged since {}'
+                 .format(language, code_shop,
+                         ', '.join(os.path.basename(vect_filepath)
+                                   for vect_filepath in vect_filepaths.values())))
+    return manifest
+
+
+def get_preprocessing_hash(data_config_language, word_dict=None):
+    """Get the hash of the version of diaman & of the stopwords & word_dict of
+    a language, which the preprocessed corpora depend on, e.g. of another
+    word_dict if given."""
+    word_dict = data_config_language.word_dict if word_dict is None else word_dict
+    return hashlib.md5(json.dumps([diaman.__version__, data_config_language.stopwords,
+                                   word_dict], sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def save_watermark(df, language, code_shop, preprocessing_hash, n_reused, watermark):
+    """Save the watermark of the training of a tuple (language, shop) & log the
+    number of reused & preprocessed reports.
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        dataframe with the trained reports
+    language : string
+        language of the reports
+    code_shop : string
+        code_shop of the plant ('emb', 'fer' ...)
+    preprocessing_hash : string
+        hash of the stopwords & word_dict of the language
+    n_reused : int
+        number of reports whose preprocessed corpora are reused, 0 for a full
+        rebuild
+    watermark : dict
+        watermark of the previous training, None if it was never trained
+
+    """
+    now = datetime.datetime.now().strftime("%Y%m%d_%H%M")
+    dates = pd.to_datetime(df['ERDAT'], errors='coerce')
+    if n_reused > 0:
+        n_new = int((dates > pd.Timestamp(watermark['erdat'])).sum())
+        logging.info('Incremental training of the {} shop: {} reports reused, {} preprocessed '
+                     '({} created after {})'.format(code_shop, n_reused, len(df) - n_reused,
+                                                    n_new, watermark['erdat']))
+    else:
+        logging.info('Full rebuild of the {} shop: {} reports preprocessed'.format(code_shop,
+                                                                                   len(df)))
+
+    histo.save_artifact(language, code_shop, 'train_watermark', {
+        'erdat': str(dates.max().date()),
+        'aufnr': str(df['AUFNR'].max()),
+        'n_reports': len(df),
+        'n_reused': n_reused,
+        'n_preprocessed': len(df) - n_reused,
+        'preprocessing_hash': preprocessing_hash,
+        'last_full_rebuild': now if n_reused == 0 else watermark['last_full_rebuild']})
+
+
+def make_lda_sweep(lda_matrices, data_config):
+    """Select & save the number of topics of the LDA of each tuple (language, shop).
+
+    Parameters
+    ----------
+    lda_matrices : dict of arrays of floats
+        lda document-term matrices of the 'COMMENT' corpus of each tuple
+        (language, shop)
+    data_config : configuration.data.DataConfig
+        data configuration with the lda & sweep parameters
+
+    """
+    sweeps = lda.sweep_n_components(lda_matrices, data_config.processing_params,
+                                    data_config.lda_sweep_params)
+
+    for (language, code_shop), sweep in sweeps.items():
+        histo.save_artifact(language, code_shop, 'lda_sweep',
+                            {'n_components': int(sweep['n_components']),
+                             'perplexities': {str(n_components): float(perplexity)
+                                              for n_components, perplexity
+                                              in sweep['perplexities'].items()}})
+
+
+def make_refine_topics(language, code_shop, searches):
+    """Precompute & save the refine topics of a tuple (language, shop), unless
+    its searches, vectorizers & number of topics didn't change since the last
+    precompute, e.g. for a shop whose training was skipped.
+
+    Parameters
+    ----------
+    language : string
+        language of the reports
+    code_shop : string
+        code_shop of the plant ('emb', 'fer' ...)
+    searches : list of strings
+        searches for which to precompute the topics
+
+    """
+    fingerprint = get_refine_fingerprint(language, code_shop, searches)
+    refine_manifest = histo.load_artifact(language, code_shop, 'refine_manifest')
+    if refine_manifest is not None and refine_manifest['fingerprint'] == fingerprint:
+        logging.info('Refine topics of the {} language and the {} shop skipped: searches & '
+                     'kernel unchanged'.format(language, code_shop))
+        return
+
+    logging.info('Precomputing the refine topics of {} searches for the {} language '
+                 'and the {} shop'.format(len(searches), language, code_shop))
+    kernel = DiamanKernel(language, code_shop)
+    refine_topics = search_pipeline.precompute_refine_topics(kernel, searches)
+    histo.save_artifact(language, code_shop, 'refine_topics', refine_topics)
+    histo.save_artifact(language, code_shop, 'refine_manifest', {'fingerprint': fingerprint})
+
+
+def get_refine_fingerprint(language, code_shop, searches):
+    """Get the fingerprint of the inputs of the refine topics of a tuple
+    (language, shop): its searches, the files of its last vectorizers & its
+    selected number of topics.
+
+    Parameters
+    ----------
+    language : string
+        language of the reports
+    code_shop : string
+        code_shop of the plant ('emb', 'fer' ...)
+    searches : list of strings
+        searches for which to precompute the topics
+
+    Returns
+    -------
+    fingerprint : string
+        md5 hash of the inputs of the refine topics
+
+    """
+    vect_filepaths = get_last_vect_filepaths(language, code_shop)
+    lda_sweep = histo.load_artifact(language, code_shop, 'lda_sweep')
+    return hashlib.md5(json.dumps([searches, vect_filepaths, lda_sweep],
+                                  sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def get_frequent_searches(df_user_actions, code_shop, precompute_params):
+    """Get the most frequent normalized searches of a shop.
+
+    Parameters
+    ----------
+    df_user_actions : pd.DataFrame
+        dataframe with the archived user actions
+    code_shop : string
+        code_shop of the plant ('emb', 'fer' ...)
+    precompute_params : configuration.data.RefinePrecomputeParameters
+        refine precompute parameters recorded in conf/data/processing_conf.yml
+
+    """
+    shop_col = precompute_params.shop_col
+    search_col = precompute_params.search_col
+    if not {shop_col, search_col}.issubset(df_user_actions.columns):
+        logging.warning('No {} & {} columns in the user actions'.format(shop_col, search_col))
+        return []
+
+    searches = df_user_actions.loc[df_user_actions[shop_col].astype(str).str.upper()
+                                   == code_shop.upper(), search_col]
+    return get_frequent_values(searches.dropna().astype(str).apply(preprocessing.normalize_query),
+                               precompute_params.n_queries, precompute_params.min_count)
+
+
+def get_frequent_values(series, n_values, min_count):
+    """Get the most frequent values of a series.
+
+    Parameters
+    ----------
+    series : pd.Series
+        series of values
+    n_values : int
+        maximum number of values to return
+    min_count : int
+        minimum number of occurrences of the returned values
+
+    """
+    counts = series.value_counts()
+    return counts[counts >= min_count].head(n_values).index.tolist()
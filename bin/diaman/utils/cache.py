@@ -0,0 +1,274 @@
+import os
+import time
+import hashlib
+import logging
+import threading
+import numpy as np
+import pandas as pd
+from collections import OrderedDict
+
+
+class ResponseCache():
+    """Cache of encoded responses bounded by memory, with LRU & TTL eviction.
+
+    The first element of each key is the key of the kernel which computed the
+    response, so that the responses of a kernel are invalidated together.
+
+    Attributes
+    ----------
+    max_memory : int
+        maximum size of the cached responses, in bytes
+    ttl : float
+        time to live of a response, in seconds, None to never expire
+    hits : int
+        number of responses found in the cache
+    misses : int
+        number of responses not found in the cache or expired
+    evictions : int
+        number of responses evicted to meet the memory bound
+    invalidations : int
+        number of responses invalidated with their kernel
+
+    """
+    def __init__(self, max_memory, ttl=None):
+        """Instantiate a ResponseCache instance.
+
+        Parameters
+        ----------
+        max_memory : int
+            maximum size of the cached responses, in bytes
+        ttl : float
+            time to live of a response, in seconds, None to never expire
+
+        """
+        self.max_memory = max_memory
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self._responses = OrderedDict()
+        self._memory = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Get a cached response.
+
+        Parameters
+        ----------
+        key : tuple
+            key of the response, starting with the key of its kernel
+
+        Returns
+        -------
+        response : bytes or None
+            cached response, None if it isn't cached or it expired
+
+        """
+        with self._lock:
+            entry = self._responses.get(key)
+            if entry is not None and self.ttl is not None \
+                    and time.monotonic() - entry[1] > self.ttl:
+                self._remove(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._responses.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, response):
+        """Cache a response, evicting the least recently used ones if needed.
+
+        Parameters
+        ----------
+        key : tuple
+            key of the response, starting with the key of its kernel
+        response : bytes
+            encoded response
+
+        """
+        if len(response) > self.max_memory:
+            return
+        with self._lock:
+            if key in self._responses:
+                self._remove(key)
+            self._responses[key] = (response, time.monotonic())
+            self._memory += len(response)
+            while self._memory > self.max_memory:
+                self._remove(next(iter(self._responses)))
+                self.evictions += 1
+
+    def invalidate(self, kernel_key):
+        """Remove the cached responses of a kernel.
+
+        Parameters
+        ----------
+        kernel_key : string
+            key of the kernel, e.g. 'fr_STA'
+
+        """
+        with self._lock:
+            keys = [key for key in self._responses if key[0] == kernel_key]
+            for key in keys:
+                self._remove(key)
+            self.invalidations += len(keys)
+
+    def _remove(self, key):
+        """Remove a cached response."""
+        response, _ = self._responses.pop(key)
+        self._memory -= len(response)
+
+    def get_stats(self):
+        """Get the metrics of the cache.
+
+        Returns
+        -------
+        stats : dict
+            number of hits, misses, evictions & invalidations, hit rate,
+            number of cached responses & their size in bytes
+
+        """
+        with self._lock:
+            n_requests = self.hits + self.misses
+            return {'hits': self.hits,
+                    'misses': self.misses,
+                    'hit_rate': self.hits / n_requests if n_requests > 0 else 0.,
+                    'evictions': self.evictions,
+                    'invalidations': self.invalidations,
+                    'size': len(self._responses),
+                    'memory': self._memory}
+
+
+class CorpusCache():
+    """Persistent cache of preprocessed documents, addressed by the hash of
+    their text & of the inputs of the preprocessing.
+
+    The cache is stored as a parquet file with a 'key', a 'corpus' & a
+    'last_used' column. It is bounded by the size of the cached documents,
+    the least recently used ones being evicted when it is saved.
+
+    Attributes
+    ----------
+    filepath : string
+        path to the parquet file of the cache
+    preprocessing_hash : string
+        hash of the stopwords & word_dict used to preprocess the documents
+    max_size : int
+        maximum size of the cached documents, in bytes
+    hits : int
+        number of documents found in the cache
+    misses : int
+        number of documents not found in the cache
+
+    """
+    def __init__(self, filepath, preprocessing_hash, max_size):
+        """Instantiate a CorpusCache instance, loading the cache file if any.
+
+        Parameters
+        ----------
+        filepath : string
+            path to the parquet file of the cache
+        preprocessing_hash : string
+            hash of the stopwords & word_dict used to preprocess the documents
+        max_size : int
+            maximum size of the cached documents, in bytes
+
+        """
+        self.filepath = filepath
+        self.preprocessing_hash = preprocessing_hash
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._now = int(time.time())
+        if os.path.exists(filepath):
+            self._df = pd.read_parquet(filepath).set_index('key')
+        else:
+            self._df = pd.DataFrame({'corpus': pd.Series(dtype=object),
+                                     'last_used': pd.Series(dtype='int64')},
+                                    index=pd.Index([], dtype='uint64', name='key'))
+
+    def get_keys(self, texts, variant):
+        """Get the keys of documents.
+
+        Parameters
+        ----------
+        texts : array of strings
+            documents before their preprocessing
+        variant : string
+            variant of the preprocessing, e.g. the corpus_col & its options
+
+        """
+        hash_key = hashlib.md5('{}_{}'.format(self.preprocessing_hash, variant)
+                               .encode('utf-8')).hexdigest()[:16]
+        return pd.util.hash_array(np.asarray(texts, dtype=object), hash_key=hash_key)
+
+    def get(self, texts, variant):
+        """Get the cached preprocessed documents.
+
+        Parameters
+        ----------
+        texts : array of strings
+            documents before their preprocessing
+        variant : string
+            variant of the preprocessing, e.g. the corpus_col & its options
+
+        Returns
+        -------
+        corpus : array of strings
+            preprocessed documents, None for the documents not cached
+        found : array of bools
+            True for the documents found in the cache
+
+        """
+        positions = self._df.index.get_indexer(self.get_keys(texts, variant))
+        found = positions >= 0
+        corpus = np.full(len(positions), None, dtype=object)
+        corpus[found] = self._df['corpus'].values[positions[found]]
+        self._df.iloc[positions[found], self._df.columns.get_loc('last_used')] = self._now
+        self.hits += int(found.sum())
+        self.misses += int((~found).sum())
+        return corpus, found
+
+    def put(self, texts, corpus, variant):
+        """Cache preprocessed documents.
+
+        Parameters
+        ----------
+        texts : array of strings
+            documents before their preprocessing
+        corpus : array of strings
+            preprocessed documents
+        variant : string
+            variant of the preprocessing, e.g. the corpus_col & its options
+
+        """
+        df_new = pd.DataFrame({'corpus': np.asarray(corpus, dtype=object),
+                               'last_used': self._now},
+                              index=pd.Index(self.get_keys(texts, variant), name='key'))
+        df_new = df_new[~df_new.index.duplicated() & ~df_new.index.isin(self._df.index)]
+        self._df = pd.concat([self._df, df_new])
+
+    def save(self):
+        """Save the cache, evicting the least recently used documents above
+        the maximum size."""
+        sizes = self._df['corpus'].str.len().values
+        order = np.argsort(-self._df['last_used'].values, kind='mergesort')
+        kept = order[np.cumsum(sizes[order]) <= self.max_size]
+        evictions = len(self._df) - len(kept)
+        self._df = self._df.iloc[np.sort(kept)]
+
+        dir_path = os.path.dirname(self.filepath)
+        if not os.path.exists(dir_path):
+            os.makedirs(dir_path)
+        tmp_filepath = '{}.{}.tmp'.format(self.filepath, os.getpid())
+        self._df.reset_index().to_parquet(tmp_filepath, index=False)
+        os.replace(tmp_filepath, self.filepath)
+        logging.info('Saved {} preprocessed documents to {} ({} evicted)'
+                     .format(len(self._df), self.filepath, evictions))
+
+    def get_hit_rate(self):
+        """Get the proportion of the documents found in the cache."""
+        n_documents = self.hits + self.misses
+        return self.hits / n_documents if n_documents > 0 else 0.
@@ -0,0 +1,101 @@
+import os
+import glob
+import json
+import logging
+import datetime
+import pandas as pd
+
+
+def get_histo_path(language, shop):
+    """Get the path to the saving location of a tuple (language, shop).
+
+    Parameters
+    ----------
+    language : string
+        language of the reports
+    shop : string
+        shop of the plant ('emb', 'fer' ...)
+
+    """
+    return os.path.join(os.environ['REPO'], 'histo', language, shop)
+
+
+def save_artifact(language, shop, name, content):
+    """Save a json artifact of a tuple (language, shop) in the histo directory.
+
+    Parameters
+    ----------
+    language : string
+        language of the reports
+    shop : string
+        shop of the plant ('emb', 'fer' ...)
+    name : string
+        name of the artifact
+    content : dict
+        json serializable content of the artifact
+
+    Returns
+    -------
+    artifact_path : string
+        path to the saved artifact
+
+    """
+    now = datetime.datetime.now().strftime("%Y%m%d_%H%M")
+    artifact_path = os.path.join(get_histo_path(language, shop), name,
+                                 '{}_{}.json'.format(name, now))
+    dir_path = os.path.dirname(artifact_path)
+    if not os.path.exists(dir_path):
+        os.makedirs(dir_path)
+
+    logging.info('Saving to: {}'.format(artifact_path))
+    with open(artifact_path, 'w') as writer:
+        json.dump(content, writer)
+
+    return artifact_path
+
+
+def load_artifact(language, shop, name):
+    """Load the last json artifact of a tuple (language, shop).
+
+    Parameters
+    ----------
+    language : string
+        language of the reports
+    shop : string
+        shop of the plant ('emb', 'fer' ...)
+    name : string
+        name of the artifact
+
+    Returns
+    -------
+    content : dict or None
+        content of the artifact, None if the artifact was never saved
+
+    """
+    dir_path = os.path.join(get_histo_path(language, shop), name)
+    if not os.path.exists(dir_path) or len(os.listdir(dir_path)) == 0:
+        return None
+
+    artifact_path = os.path.join(dir_path, sorted(os.listdir(dir_path))[-1])
+    logging.info('Loading from: {}'.format(artifact_path))
+    with open(artifact_path) as reader:
+        return json.load(reader)
+
+
+def load_user_actions():
+    """Load the user actions archived in the histo directory.
+
+    Returns
+    -------
+    df_user_actions : pd.DataFrame
+        dataframe with the content of all the archived user_actions.csv files,
+        empty if no file was archived
+
+    """
+    filepaths = sorted(glob.glob(os.path.join(os.environ['REPO'], 'histo', 'user_actions',
+                                              '*', '*', '*', 'user_actions.csv')))
+    logging.info('Loading {} user actions files'.format(len(filepaths)))
+    if len(filepaths) == 0:
+        return pd.DataFrame()
+    return pd.concat([pd.read_csv(filepath) for filepath in filepaths],
+                     ignore_index=True, sort=False)
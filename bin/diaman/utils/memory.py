@@ -0,0 +1,72 @@
+import os
+
+
+def get_process_memory(pid=None):
+    """Get the memory used by a process from the linux /proc filesystem.
+
+    The unique memory (USS) is the memory which is private to the process,
+    i.e. not shared copy-on-write with its parent or its siblings. It is the
+    memory released if the process is killed.
+
+    Parameters
+    ----------
+    pid : int
+        process id, the current process if None
+
+    Returns
+    -------
+    process_memory : dict
+        'rss' (resident), 'pss' (proportional) & 'uss' (unique) memory of the
+        process, in bytes
+
+    """
+    pid = os.getpid() if pid is None else pid
+    smaps_path = f'/proc/{pid}/smaps_rollup'
+    if not os.path.exists(smaps_path):
+        smaps_path = f'/proc/{pid}/smaps'
+
+    sizes = {'Rss': 0, 'Pss': 0, 'Private_Clean': 0, 'Private_Dirty': 0}
+    with open(smaps_path) as f:
+        for line in f:
+            fields = line.split()
+            if fields[0][:-1] in sizes:
+                sizes[fields[0][:-1]] += int(fields[1]) * 1024
+
+    return {'rss': sizes['Rss'],
+            'pss': sizes['Pss'],
+            'uss': sizes['Private_Clean'] + sizes['Private_Dirty']}
+
+
+def get_children_pids(pid):
+    """Get the ids of the child processes of a process.
+
+    Parameters
+    ----------
+    pid : int
+        process id
+
+    """
+    children_pids = []
+    task_path = f'/proc/{pid}/task'
+    for tid in os.listdir(task_path):
+        with open(os.path.join(task_path, tid, 'children')) as f:
+            children_pids += [int(child_pid) for child_pid in f.read().split()]
+    return children_pids
+
+
+def get_available_memory():
+    """Get the memory available for new processes from /proc/meminfo.
+
+    Returns
+    -------
+    available_memory : int
+        memory which can be allocated without swapping (MemAvailable), in
+        bytes
+
+    """
+    with open('/proc/meminfo') as f:
+        for line in f:
+            fields = line.split()
+            if fields[0] == 'MemAvailable:':
+                return int(fields[1]) * 1024
+    raise KeyError('MemAvailable not found in /proc/meminfo')
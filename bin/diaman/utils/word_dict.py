@@ -1,9 +1,22 @@
 import os
 import json
+import pickle
+import hashlib
+import logging
+import threading
 
+from diaman.domain.preprocessing import get_corrections
 from diaman.utils import doccano_interaction
 
 
+# Version of the format of the compiled word dictionaries
+COMPILED_VERSION = 1
+
+# Compiled word dictionaries loaded by the process, by filepath
+_compiled_word_dicts = {}
+_compiled_word_dicts_lock = threading.Lock()
+
+
 class WordDict():
     """Personalized word dictionary to correct misspelled words and manage
     abbreviations.
@@ -11,7 +24,10 @@ class WordDict():
     Attributes
     ----------
     word_dict : dict
-        dictionary {correct word: list of incorrect words}.
+        dictionary {correct word: list of incorrect words}, as loaded &
+        replaced by the enriched dictionary after the enrichment.
+    indexed_dict : IndexedWordDict
+        indexed word dictionary, updated by the enrichment.
 
     """
     def __init__(self, language='fr', word_dict_filename='word_dict.json'):
@@ -39,8 +55,10 @@ class WordDict():
         """Load word dictionary.
 
         """
-        with open(self._word_dict_filepath) as reader:
-            self.word_dict = json.load(reader)
+        # Copy of the compiled word dictionary, which is shared by the process
+        self.word_dict = {correct_word: list(incorrect_words) for correct_word, incorrect_words
+                          in load_word_dict(self._word_dict_filepath).items()}
+        self.indexed_dict = IndexedWordDict(self.word_dict)
 
     def enrich(self, doccano_output_filename):
         """Update the word dictionary by adding new words.
@@ -59,12 +77,17 @@ class WordDict():
         doccano_dict = doccano_interaction.doccano_file_to_word_dict(doccano_output_filepath)
 
         # Update word_dict by adding the words of doccano_dict not already present
-        merge_word_dicts(self.word_dict, doccano_dict)
+        self.indexed_dict.merge(doccano_dict)
 
         # Remove incorrect words if they also are correct words
-        for correct_word in self.word_dict.keys():
-            self.word_dict[correct_word] = [word for word in self.word_dict[correct_word]
-                                            if word not in self.word_dict.keys()]
+        self.indexed_dict.remove_correct_words()
+        self.word_dict = self.indexed_dict.to_dict()
+
+        # Log the words which are still incorrect words of several correct words
+        conflicts = self.indexed_dict.get_conflicts()
+        if len(conflicts) > 0:
+            logging.warning(f'{len(conflicts)} words corrected by several correct words, '
+                            f'the first one being used: {conflicts}')
 
         # Save word_dict
         self._save()
@@ -75,6 +98,118 @@ class WordDict():
         """
         with open(self._word_dict_filepath, 'w') as writer:
             json.dump(self.word_dict, writer, indent=4)
+        compile_word_dict(self._word_dict_filepath)
+
+
+class IndexedWordDict():
+    """Word dictionary indexed by word, whose merge & enrichment run in time
+    linear in their input.
+
+    The incorrect words of each correct word are kept in an insertion ordered
+    set, i.e. a dict with None values. The reverse index gives the correct
+    words whose entry contains each word, as correct or incorrect word, the
+    first entry being the one used to correct the word.
+
+    Attributes
+    ----------
+    entries : dict
+        dictionary {correct word: {incorrect word: None}}.
+
+    """
+    def __init__(self, word_dict=None):
+        """Instantiate an IndexedWordDict instance.
+
+        Parameters
+        ----------
+        word_dict : dict
+            dictionary {correct word: list of incorrect words}.
+
+        """
+        self.entries = {}
+        self._positions = {}
+        self._reverse_index = {}
+        for correct_word, incorrect_words in (word_dict or {}).items():
+            self.add(correct_word, incorrect_words)
+
+    def add(self, correct_word, incorrect_words):
+        """Add incorrect words to a correct word, whose entry is created at
+        the end of the dictionary if needed.
+
+        Parameters
+        ----------
+        correct_word : string
+            correct word.
+        incorrect_words : list of strings
+            incorrect words of the correct word.
+
+        """
+        if correct_word not in self.entries:
+            self.entries[correct_word] = {}
+            self._positions[correct_word] = len(self._positions)
+            self._reverse_index.setdefault(correct_word, {})[correct_word] = None
+        entry = self.entries[correct_word]
+        for word in incorrect_words:
+            entry[word] = None
+            self._reverse_index.setdefault(word, {})[correct_word] = None
+
+    def get_correct_word(self, word):
+        """Get the correct word of the first entry containing a word, as
+        correct or incorrect word, None if no entry contains it."""
+        correct_words = self._reverse_index.get(word)
+        if not correct_words:
+            return None
+        return min(correct_words, key=self._positions.get)
+
+    def merge(self, new_dict):
+        """Add the words of new_dict not already present, as merge_word_dicts.
+
+        The incorrect words of a word of new_dict already present are added to
+        the first entry containing it, the other words being added at the
+        end of the dictionary.
+
+        Parameters
+        ----------
+        new_dict : dict
+            dictionary containing the words to add.
+
+        """
+        new_entries = []
+        for word, incorrect_words in new_dict.items():
+            correct_word = self.get_correct_word(word)
+            if correct_word is None:
+                new_entries.append((word, incorrect_words))
+            else:
+                self.add(correct_word, incorrect_words)
+
+        for correct_word, incorrect_words in new_entries:
+            self.add(correct_word, incorrect_words)
+
+    def remove_correct_words(self):
+        """Remove the incorrect words which also are correct words."""
+        for correct_word, entry in self.entries.items():
+            entry.pop(correct_word, None)
+            for other_word in list(self._reverse_index[correct_word]):
+                if other_word != correct_word:
+                    del self.entries[other_word][correct_word]
+                    del self._reverse_index[correct_word][other_word]
+
+    def get_conflicts(self):
+        """Get the words contained by several entries, with their correct words.
+
+        Returns
+        -------
+        conflicts : dict
+            dictionary {word: list of correct words}, in the order of the
+            entries.
+
+        """
+        return {word: sorted(correct_words, key=self._positions.get)
+                for word, correct_words in self._reverse_index.items()
+                if len(correct_words) > 1}
+
+    def to_dict(self):
+        """Get the dictionary {correct word: list of incorrect words}."""
+        return {correct_word: list(entry) for correct_word, entry in self.entries.items()}
 
 
 def merge_word_dicts(ref_dict, new_dict):
@@ -88,19 +223,120 @@ def merge_word_dicts(ref_dict, new_dict):
         dictionary containing the words to add.
 
     """
-    # Enrich the incorrect words of the ref_dict
-    already_existing_words = []
-    for word in new_dict:
-        for correct_word, incorrect_words in ref_dict.items():
-            if (word == correct_word) | (word in incorrect_words):
-                already_existing_words.append(word)
-                ref_dict[correct_word] = list(set(ref_dict[correct_word]
-                                                  + new_dict[word]))
-                break
-
-    # Restrict the new_dict to words that don't already exist in the ref_dict
-    new_dict = {correct_word: incorrect_words
-                for correct_word, incorrect_words in new_dict.items()
-                if correct_word not in already_existing_words}
-
-    ref_dict.update(new_dict)
+    indexed_dict = IndexedWordDict(ref_dict)
+    indexed_dict.merge(new_dict)
+    ref_dict.update(indexed_dict.to_dict())
+
+
+class CompiledWordDict(dict):
+    """Word dictionary {correct word: list of incorrect words} with its
+    precomputed corrections, loaded from a compiled word dictionary.
+
+    It is shared by all the users of the word dictionary in the process, e.g.
+    the kernels & the trainings of the shops of a language, and must not be
+    modified.
+
+    Attributes
+    ----------
+    corrections : dict
+        dictionary {incorrect word: correct word}, see
+        preprocessing.get_corrections.
+
+    """
+    def __init__(self, word_dict, corrections):
+        super().__init__(word_dict)
+        self.corrections = corrections
+
+
+def get_compiled_filepath(word_dict_filepath):
+    """Get the path to the compiled word dictionary of a json word dictionary,
+    e.g. 'word_dict.compiled.pkl' for 'word_dict.json'."""
+    return '{}.compiled.pkl'.format(os.path.splitext(word_dict_filepath)[0])
+
+
+def compile_word_dict(word_dict_filepath):
+    """Compile a json word dictionary into a pickle file with the version of
+    the format, the hash of the json file & the precomputed corrections.
+
+    Parameters
+    ----------
+    word_dict_filepath : string
+        path to the json word dictionary.
+
+    Returns
+    -------
+    word_dict : CompiledWordDict
+        compiled word dictionary.
+
+    """
+    with open(word_dict_filepath, 'rb') as reader:
+        content = reader.read()
+    word_dict = json.loads(content.decode('utf-8'))
+    compiled = {'version': COMPILED_VERSION,
+                'hash': hashlib.md5(content).hexdigest(),
+                'word_dict': word_dict,
+                'corrections': get_corrections(word_dict)}
+
+    compiled_filepath = get_compiled_filepath(word_dict_filepath)
+    try:
+        tmp_filepath = '{}.{}.tmp'.format(compiled_filepath, os.getpid())
+        with open(tmp_filepath, 'wb') as writer:
+            pickle.dump(compiled, writer, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_filepath, compiled_filepath)
+        logging.info(f'Compiled word dictionary saved to {compiled_filepath}')
+    except OSError as e:
+        logging.warning(f'Compiled word dictionary not saved to {compiled_filepath}: {e!r}')
+
+    return CompiledWordDict(compiled['word_dict'], compiled['corrections'])
+
+
+def load_word_dict(word_dict_filepath):
+    """Load a word dictionary from its compiled word dictionary, once per
+    process as long as the json file isn't modified.
+
+    The compiled word dictionary is compiled again when it is missing, when
+    its format version changed or when its hash doesn't match the json file.
+
+    Parameters
+    ----------
+    word_dict_filepath : string
+        path to the json word dictionary.
+
+    Returns
+    -------
+    word_dict : CompiledWordDict
+        compiled word dictionary, shared by all the callers of the process.
+
+    """
+    stat = os.stat(word_dict_filepath)
+    stamp = (stat.st_mtime_ns, stat.st_size)
+    with _compiled_word_dicts_lock:
+        cached = _compiled_word_dicts.get(word_dict_filepath)
+        if cached is not None and cached[0] == stamp:
+            return cached[1]
+
+        word_dict = _load_compiled_word_dict(word_dict_filepath)
+        if word_dict is None:
+            word_dict = compile_word_dict(word_dict_filepath)
+        _compiled_word_dicts[word_dict_filepath] = (stamp, word_dict)
+        return word_dict
+
+
+def _load_compiled_word_dict(word_dict_filepath):
+    """Load the compiled word dictionary of a json word dictionary, None if
+    it is missing or out of date."""
+    compiled_filepath = get_compiled_filepath(word_dict_filepath)
+    if not os.path.exists(compiled_filepath):
+        return None
+    with open(word_dict_filepath, 'rb') as reader:
+        word_dict_hash = hashlib.md5(reader.read()).hexdigest()
+    try:
+        with open(compiled_filepath, 'rb') as reader:
+            compiled = pickle.load(reader)
+    except (OSError, EOFError, pickle.UnpicklingError) as e:
+        logging.warning(f'Compiled word dictionary not loaded from {compiled_filepath}: {e!r}')
+        return None
+    if compiled.get('version') != COMPILED_VERSION or compiled.get('hash') != word_dict_hash:
+        logging.info(f'Compiled word dictionary {compiled_filepath} out of date')
+        return None
+    return CompiledWordDict(compiled['word_dict'], compiled['corrections'])
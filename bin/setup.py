@@ -29,6 +29,7 @@ install_requires = [
     'numpy==1.16.3',
     'pandas==0.24.2',
     'pyspark==2.4.1',
+    'pyarrow==0.13.0',
     'scikit-learn==0.20.3',
     'pyaml==18.11.0',
     'spacy==2.1.3',
@@ -86,7 +87,9 @@ setup(
     packages=find_packages(),
     entry_points={
         'console_scripts': [
-            'train-diaman=diaman.pipeline.cli:cli'
+            'train-diaman=diaman.pipeline.cli:cli',
+            'train-diaman-local=diaman.pipeline.cli:cli_local',
+            'serve-diaman=diaman.interface.server:cli'
         ]
     }
 )
@@ -28,3 +28,32 @@ def test_word_dict():
     expected = ['abaisser', 'accelerer', 'accident', 'accordeon', 'accoster',
                 'accoupler', 'accumulateur', 'acquittement', 'actemium']
     assert all(word in data_config.word_dict.keys() for word in expected)
+
+
+def test_refine_conf():
+    """[conf] Check refine conf parameters."""
+    refine_params = data_config.refine_params
+    assert len(refine_params) == 3
+    assert refine_params.batch_size > 0
+
+
+def test_serving_conf():
+    """[conf] Check serving conf parameters."""
+    serving_params = data_config.serving_params
+    assert isinstance(serving_params.lazy_loading, bool)
+    assert isinstance(serving_params.preload, list)
+
+
+def test_server_conf():
+    """[conf] Check server conf parameters."""
+    server_params = data_config.server_params
+    assert server_params.max_pending > 0
+    assert server_params.max_batch_size > 0
+
+
+def test_train_conf():
+    """[conf] Check train conf parameters."""
+    train_params = data_config.train_params
+    assert train_params.max_workers is None or train_params.max_workers > 0
+    assert train_params.min_available_memory >= 0
+    assert isinstance(train_params.skip_unchanged, bool)
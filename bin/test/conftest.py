@@ -0,0 +1,72 @@
+import os
+import pytest
+import pandas as pd
+
+from diaman.configuration.data import DataConfig
+from diaman.domain.vectorizer import CorpusVect
+from diaman.interface.kernel import DiamanKernel
+
+
+data_config = DataConfig('fr')
+filepath = os.path.join(os.environ['BIN'], 'test', 'resources', 'reports_sample.csv')
+
+
+def read_reports_sample():
+    """Read the sample reports, with their spare parts & medias as lists of
+    structs like the reports of the standard data."""
+    df = pd.read_csv(filepath, dtype={'AUFNR': str})
+    for col in ('COMPONENTS', 'MEDIAS'):
+        df[col] = [eval(values, {'Row': lambda **fields: tuple(fields.values())})
+                   for values in df[col]]
+    return df
+
+
+def save_kernel_files(code_shop, df):
+    """Train & save the vectorizers of a french shop in the histo directory of
+    $REPO.
+
+    Returns
+    -------
+    vect_filepaths : dict
+        path to the saved vectorizer of the 'DESCR_ORDER' & 'COMMENT' columns
+
+    """
+    vect_filepaths = {}
+    for corpus_col in ('DESCR_ORDER', 'COMMENT'):
+        corpus_vect = CorpusVect('fr', code_shop, corpus_col)
+        corpus_vect.preprocess_corpus(df.copy(), data_config.stopwords, data_config.word_dict,
+                                      remove_numbers=False, remove_small_words=False)
+        corpus_vect.create_vectorizer()
+        corpus_vect.save()
+        vect_filepaths[corpus_col] = corpus_vect.vect_filepath
+    return vect_filepaths
+
+
+@pytest.fixture
+def reports_sample():
+    """Sample reports of the STA shop."""
+    return read_reports_sample()
+
+
+@pytest.fixture
+def histo_repo(tmp_path, monkeypatch, reports_sample):
+    """Temporary $REPO with the vectorizers of the fr_STA kernel trained on the
+    sample reports."""
+    monkeypatch.setenv('REPO', str(tmp_path))
+    save_kernel_files('STA', reports_sample)
+    return tmp_path
+
+
+@pytest.fixture
+def kernel(histo_repo):
+    """fr_STA kernel trained on the sample reports."""
+    return DiamanKernel('fr', 'STA', data_config=data_config)
+
+
+@pytest.fixture
+def train_kernel(histo_repo):
+    """Train the kernel of another french shop on given reports & load it."""
+    def train(code_shop, df):
+        save_kernel_files(code_shop, df)
+        return DiamanKernel('fr', code_shop, data_config=data_config)
+    return train
@@ -1,4 +1,5 @@
 import os
+import pytest
 import pandas as pd
 from sklearn.decomposition import LatentDirichletAllocation
 
@@ -71,3 +72,97 @@ def test_get_top_words_topics():
                        ['convoyeur', 'relance', 'piece', 'haut']]
 
     assert top_words_topics == expected_output
+
+
+def test_train_with_budget():
+    """[domain][lda] Check the LDA training stops at the deadline with a fitted model."""
+    corpus_vect = CorpusVect('fr', 'STA', corpus_col='COMMENT')
+    df_test = pd.read_csv(filepath)
+    corpus_vect.preprocess_corpus(df=df_test,
+                                  stopwords=data_config.stopwords,
+                                  word_dict=data_config.word_dict,
+                                  remove_numbers=True,
+                                  remove_small_words=True)
+    corpus_vect.create_vectorizer()
+    dt_matrix = corpus_vect.dt_matrix
+    n_components = data_config.processing_params.n_components
+
+    lda_model = lda.train_with_budget(dt_matrix, data_config.processing_params,
+                                      time_budget=0., batch_size=128)
+
+    assert lda_model.components_.shape == (n_components, dt_matrix.shape[1])
+    assert lda_model.n_batch_iter_ == 2
+
+
+def test_extract_topics_nmf():
+    """[domain][lda] Check the topics extraction with the nmf engine."""
+    corpus_vect = CorpusVect('fr', 'STA', corpus_col='COMMENT')
+    df_test = pd.read_csv(filepath)
+    corpus_vect.preprocess_corpus(df=df_test,
+                                  stopwords=data_config.stopwords,
+                                  word_dict=data_config.word_dict,
+                                  remove_numbers=True,
+                                  remove_small_words=True)
+    refine_params = data_config.refine_params._replace(engine='nmf')
+
+    top_words_topics = lda.extract_topics(corpus_vect.df_preprocessed,
+                                          data_config.processing_params,
+                                          refine_params=refine_params)
+
+    assert len(top_words_topics) == data_config.processing_params.n_components
+    assert all(len(top_words) == 4 for top_words in top_words_topics)
+
+
+def test_extract_topics_unknown_engine():
+    """[domain][lda] Check an unknown topic engine is rejected."""
+    df_test = pd.read_csv(filepath)
+    refine_params = data_config.refine_params._replace(engine='unknown')
+
+    with pytest.raises(KeyError):
+        lda.extract_topics(df_test, data_config.processing_params,
+                           refine_params=refine_params)
+
+
+def test_sweep_n_components():
+    """[domain][lda] Check the selection of the number of topics by held-out perplexity."""
+    corpus_vect = CorpusVect('fr', 'STA', corpus_col='COMMENT')
+    df_test = pd.read_csv(filepath)
+    df_test = df_test[:200]
+    corpus_vect.preprocess_corpus(df=df_test,
+                                  stopwords=data_config.stopwords,
+                                  word_dict=data_config.word_dict,
+                                  remove_numbers=True,
+                                  remove_small_words=True)
+    corpus_vect.create_vectorizer()
+    lda_params = data_config.processing_params._replace(max_iter=5)
+    sweep_params = data_config.lda_sweep_params._replace(min_n_components=2,
+                                                         max_n_components=3,
+                                                         max_workers=2)
+
+    sweeps = lda.sweep_n_components({('fr', 'STA'): corpus_vect.dt_matrix,
+                                     ('fr', 'MEC'): corpus_vect.dt_matrix[:100]},
+                                    lda_params, sweep_params)
+
+    assert sorted(sweeps) == [('fr', 'MEC'), ('fr', 'STA')]
+    for sweep in sweeps.values():
+        assert sorted(sweep['perplexities']) == [2, 3]
+        assert sweep['n_components'] == min(sweep['perplexities'],
+                                             key=sweep['perplexities'].get)
+
+
+def test_split_held_out():
+    """[domain][lda] Check the split of the documents into a train & a held-out set."""
+    corpus_vect = CorpusVect('fr', 'STA', corpus_col='DESCR_ORDER')
+    df_test = pd.read_csv(filepath)
+    corpus_vect.preprocess_corpus(df=df_test,
+                                  stopwords=data_config.stopwords,
+                                  word_dict=data_config.word_dict,
+                                  remove_numbers=False,
+                                  remove_small_words=False)
+    corpus_vect.create_vectorizer()
+
+    dt_train, dt_test = lda.split_held_out(corpus_vect.dt_matrix, 0.2,
+                                           max_documents=500, random_state=12)
+
+    assert dt_train.shape == (400, corpus_vect.dt_matrix.shape[1])
+    assert dt_test.shape == (100, corpus_vect.dt_matrix.shape[1])
@@ -59,3 +59,30 @@ def test_correct_words():
     expected_output = ['perte connexion barre shunt relance suppression shunt relance',
                        'deux postes soudes portatif remetre etat vetilateur changer cable alimentation deuxieme recherche remise etat']
     assert corpus.tolist() == expected_output
+
+
+def test_normalize_query():
+    """[domain][preprocessing] Check the normalization of the user search."""
+    assert preprocessing.normalize_query('  Fuite   HUILE vérin ') == 'fuite huile verin'
+
+
+def test_preprocess_corpus_by_language():
+    """[domain][preprocessing] Check the preprocessing of a corpus in several languages."""
+    df_test = pd.read_csv(filepath)
+    df_test = df_test.iloc[290:300].reset_index(drop=True)
+    languages = pd.Series(['fr', 'xx'] * 5)
+
+    corpus = preprocessing.preprocess_corpus_by_language(df_test['COMMENT'], languages, 'COMMENT',
+                                                         {'fr': data_config.stopwords, 'xx': []},
+                                                         {'fr': data_config.word_dict, 'xx': {}},
+                                                         remove_numbers=True,
+                                                         remove_small_words=True)
+
+    for language, stopwords, word_dict in [('fr', data_config.stopwords, data_config.word_dict),
+                                           ('xx', [], {})]:
+        mask = (languages == language).values
+        expected_output = preprocessing.preprocess_corpus(df_test[mask].reset_index(drop=True),
+                                                          'COMMENT', stopwords, word_dict,
+                                                          remove_numbers=True,
+                                                          remove_small_words=True)
+        assert corpus[mask].tolist() == expected_output.tolist()
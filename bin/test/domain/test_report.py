@@ -1,4 +1,6 @@
 import os
+import numpy as np
+import pandas as pd
 
 from diaman.interface.kernel import DiamanKernel
 from diaman.domain import report
@@ -118,3 +120,88 @@ def test_calculate_max_detail_level():
 
     max_detail_level = report.calculate_max_detail_level(corpus)
     assert max_detail_level == 64
+
+
+""" ----------------------------------------------------------------------------
+-------------------------------- MERGE REPORTS ---------------------------------
+---------------------------------------------------------------------------- """
+
+
+def test_merge_reports():
+    """[domain][report] Check the merge of the search results of several shops."""
+    df_sta = pd.DataFrame({'AUFNR': ['1', '2', '3'], 'CODE_SHOP': 'STA',
+                           'sorting_score': [1., 0.5, 0.]})
+    df_mec = pd.DataFrame({'AUFNR': ['4', '5'], 'CODE_SHOP': 'MEC',
+                           'sorting_score': [0.8, 0.5]})
+
+    (df_reports,
+     matching_sites,
+     matching_constructors,
+     matching_equipments) = report.merge_reports([(df_sta, ['PY'], ['SCHULER'], ['PRESSE']),
+                                                  (df_mec, ['MU', 'PY'], [], ['ROBOT'])],
+                                                 n_reports=4)
+
+    assert df_reports['AUFNR'].tolist() == ['1', '4', '2', '5']
+    assert matching_sites == ['MU', 'PY']
+    assert matching_constructors == ['SCHULER']
+    assert matching_equipments == ['PRESSE', 'ROBOT']
+
+
+def test_get_date_rows():
+    """[domain][report] Check the selection of the reports by creation date."""
+    df_reports = pd.DataFrame({'ERDAT': ['2019-03-01', '2018-01-15', None,
+                                         '2019-01-01', 'invalid', '2018-06-30']})
+    date_index = report.build_date_index(df_reports)
+    assert date_index[1].tolist() == [1, 5, 3, 0]
+
+    assert report.get_date_rows(date_index).tolist() == [0, 1, 3, 5]
+    assert report.get_date_rows(date_index, '2018-06-30', '2019-01-01').tolist() == [3, 5]
+    assert report.get_date_rows(date_index, date_from='2019-01-02').tolist() == [0]
+    assert report.get_date_rows(date_index, date_to='2017-12-31').tolist() == []
+
+
+def test_boost_recent_reports():
+    """[domain][report] Check the blend of the sorting score with the recency."""
+    df_reports = pd.DataFrame({'ERDAT': ['2018-01-03', '2018-01-01', None, '2018-01-02'],
+                               'sorting_score': [0., 1., 1., 0.5]})
+    date_range = report.get_date_range(df_reports)
+    assert date_range == (pd.Timestamp('2018-01-01'), pd.Timestamp('2018-01-03'))
+
+    df_boosted = report.boost_recent_reports(df_reports.copy(), 0., date_range)
+    assert df_boosted['sorting_score'].tolist() == [0., 1., 1., 0.5]
+    df_boosted = report.boost_recent_reports(df_reports.copy(), 1., date_range)
+    assert df_boosted['sorting_score'].tolist() == [1., 0., 0., 0.5]
+    df_boosted = report.boost_recent_reports(df_reports.copy(), 0.5, date_range)
+    assert df_boosted['sorting_score'].tolist() == [0.5, 0.5, 0.5, 0.5]
+
+
+def test_flatten_nested_col():
+    """[domain][report] Check the flattening of the spare parts of the reports."""
+    components = [[('M1', 'a', 1.), ('M2', 'b', 2.)], [], None, [('M3', 'c', 3.)]]
+    offsets, (matnrs, quantities) = report.flatten_nested_col(components, [0, 2])
+    assert offsets.tolist() == [0, 2, 2, 2, 3]
+    assert (matnrs, quantities) == (['M1', 'M2', 'M3'], [1., 2., 3.])
+    assert report.split_child_values(offsets, matnrs) == [['M1', 'M2'], [], [], ['M3']]
+
+
+def test_build_child_tables():
+    """[domain][report] Check the child tables of the spare parts & the medias."""
+    df_reports = pd.DataFrame({'COMPONENTS': [[('M1', 'a', 1.), ('M2', 'b', 2.)], None],
+                               'MEDIAS': [[], [('http://doc/1', 'PDF')]]})
+    child_tables = report.build_child_tables(df_reports)
+
+    offsets, fields = child_tables['COMPONENTS']
+    assert offsets.tolist() == [0, 2, 2]
+    assert fields == {'MATNR': ['M1', 'M2'], 'QUANTITY': [1., 2.]}
+    offsets, fields = child_tables['MEDIAS']
+    assert offsets.tolist() == [0, 0, 1]
+    assert fields == {'DOC_URL': ['http://doc/1'], 'DOC_TYPE': ['PDF']}
+    assert report.build_child_tables(df_reports[['MEDIAS']]).keys() == {'MEDIAS'}
+
+
+def test_join_child_values():
+    """[domain][report] Check the concatenation of the values of each report."""
+    offsets = np.array([0, 2, 2, 2, 3, 4])
+    texts = report.join_child_values(offsets, ['M1', 'M2', 'M3', 'M4'], empty='-')
+    assert texts.tolist() == [' M1 M2', '-', '-', ' M3', ' M4']
+    assert report.join_child_values(np.array([0, 0]), []).tolist() == ['']
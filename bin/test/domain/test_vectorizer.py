@@ -1,9 +1,11 @@
 import os
+import numpy as np
 import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
 
 from diaman.configuration.data import DataConfig
 from diaman.domain.vectorizer import CorpusVect
-from diaman.domain import vectorizer
+from diaman.domain import vectorizer, preprocessing
 
 
 data_config = DataConfig('fr')
@@ -55,3 +57,105 @@ def test_distance_to_comment():
     expected_output = [1.0, 1.0, 0.9821428571428572, 0.9821428571428572,
                        0.9821428571428572]
     assert output == expected_output
+
+
+def test_get_shard_bounds():
+    """[domain][vectorizer] Check the row bounds of the shards."""
+    assert vectorizer.get_shard_bounds(10, 3) == [(0, 3), (3, 6), (6, 10)]
+    assert vectorizer.get_shard_bounds(2, 4) == [(0, 1), (1, 2)]
+
+
+def test_sharded_similarities():
+    """[domain][vectorizer] Check the similarities computed shard by shard."""
+    inputs = ['coussin', 'fuite huile verin']
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        for corpus_col in ('DESCR_ORDER', 'COMMENT'):
+            corpus_vect = CorpusVect('fr', 'STA', corpus_col=corpus_col)
+            corpus_vect.preprocess_corpus(df=pd.read_csv(filepath),
+                                          stopwords=data_config.stopwords,
+                                          word_dict=data_config.word_dict,
+                                          remove_numbers=False,
+                                          remove_small_words=False)
+            corpus_vect.create_vectorizer()
+            if corpus_col == 'DESCR_ORDER':
+                similarities = vectorizer.description_similarities
+            else:
+                similarities = vectorizer.comment_similarities
+            expected = similarities(corpus_vect, inputs)
+
+            corpus_vect.make_shards(vectorizer.get_shard_bounds(len(corpus_vect.df_preprocessed), 3))
+            output = similarities(corpus_vect, inputs, executor)
+            assert np.array_equal(output, expected)
+
+
+def test_similarities_rows():
+    """[domain][vectorizer] Check the similarities computed on some rows only."""
+    inputs = ['coussin', 'fuite huile verin']
+    rows = np.arange(10, 400, 3)
+    for corpus_col in ('DESCR_ORDER', 'COMMENT'):
+        corpus_vect = CorpusVect('fr', 'STA', corpus_col=corpus_col)
+        corpus_vect.preprocess_corpus(df=pd.read_csv(filepath),
+                                      stopwords=data_config.stopwords,
+                                      word_dict=data_config.word_dict,
+                                      remove_numbers=False,
+                                      remove_small_words=False)
+        corpus_vect.create_vectorizer()
+        if corpus_col == 'DESCR_ORDER':
+            output = vectorizer.description_similarities(corpus_vect, inputs, rows=rows)
+            expected = vectorizer.description_similarities(corpus_vect, inputs)[:, rows]
+        else:
+            # The comment similarities are normalized over the rows
+            output = vectorizer.comment_similarities(corpus_vect, inputs, rows=rows)
+            expected = vectorizer.comment_similarities(corpus_vect, inputs)[:, rows]
+            expected = (expected - expected.min(axis=1, keepdims=True)) \
+                / np.ptp(expected, axis=1, keepdims=True)
+        assert output.shape == (len(inputs), len(rows))
+        assert np.allclose(output, expected)
+
+
+def test_preprocess_corpus_incremental():
+    """[domain][vectorizer] Check the reuse of the corpus preprocessed by a previous training."""
+    df_test = pd.read_csv(filepath)[:200]
+    previous_vect = CorpusVect('fr', 'STA', corpus_col='COMMENT')
+    previous_vect.preprocess_corpus(df_test[:150], data_config.stopwords, data_config.word_dict,
+                                    remove_numbers=False, remove_small_words=False)
+
+    df_test.loc[10, 'COMMENT'] = 'remplacement du verin'
+    corpus_vect = CorpusVect('fr', 'STA', corpus_col='COMMENT')
+    n_reused = corpus_vect.preprocess_corpus(df_test, data_config.stopwords,
+                                             data_config.word_dict, remove_numbers=False,
+                                             remove_small_words=False,
+                                             previous_vect=previous_vect)
+    assert n_reused == 149
+
+    expected_vect = CorpusVect('fr', 'STA', corpus_col='COMMENT')
+    expected_vect.preprocess_corpus(df_test, data_config.stopwords, data_config.word_dict,
+                                    remove_numbers=False, remove_small_words=False)
+    for col in ['corpus', 'corpus_lda']:
+        assert corpus_vect.df_preprocessed[col].tolist() == \
+            expected_vect.df_preprocessed[col].tolist()
+
+
+def test_recorrect_corpus():
+    """[domain][vectorizer] Check the correction of a trained corpus with an enriched word_dict."""
+    df_test = pd.read_csv(filepath)[:200]
+    corpus_vect = CorpusVect('fr', 'STA', corpus_col='COMMENT')
+    corpus_vect.preprocess_corpus(df_test, data_config.stopwords, data_config.word_dict,
+                                  remove_numbers=False, remove_small_words=False)
+    corpus_vect.create_vectorizer()
+
+    new_word_dict = {'abaissement': ['abaisse'], **data_config.word_dict, 'palpeur': ['sonde']}
+    changed_tokens = preprocessing.get_changed_tokens(data_config.word_dict, new_word_dict)
+    assert changed_tokens == {'abaisser', 'sonde'}
+    n_recorrected = corpus_vect.recorrect_corpus(data_config.stopwords, new_word_dict,
+                                                 changed_tokens)
+    assert n_recorrected > 0
+
+    expected_vect = CorpusVect('fr', 'STA', corpus_col='COMMENT')
+    expected_vect.preprocess_corpus(df_test, data_config.stopwords, new_word_dict,
+                                    remove_numbers=False, remove_small_words=False)
+    for col in ['corpus', 'corpus_lda']:
+        assert corpus_vect.df_preprocessed[col].tolist() == \
+            expected_vect.df_preprocessed[col].tolist()
+    expected_matrix = corpus_vect.vectorizer.transform(expected_vect.df_preprocessed['corpus'])
+    assert (corpus_vect.dt_matrix != expected_matrix).nnz == 0
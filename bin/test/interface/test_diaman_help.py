@@ -0,0 +1,180 @@
+import os
+import time
+import shutil
+import pytest
+import pandas as pd
+
+from diaman.configuration.data import DataConfig
+from diaman.interface.diaman_help import DiamanHelp
+from diaman.interface.kernel import get_last_vect_filepaths
+from diaman.pipeline import search_pipeline
+
+
+def make_diaman_help(**serving_params):
+    """Instantiate a DiamanHelp instance serving the fr_STA kernel."""
+    params = dict(lazy_loading=True, preload=['fr_STA'], load_workers=1,
+                  reload_interval=None, n_shards=1)
+    params.update(serving_params)
+    return DiamanHelp(serving_params=DataConfig().serving_params._replace(**params))
+
+
+def save_kernel_version(code_shop, stamp):
+    """Save the last vectorizers of a shop again as a new version, e.g.
+    '20991231_2359'."""
+    vect_filepaths = {}
+    for corpus_col, vect_filepath in get_last_vect_filepaths('fr', code_shop).items():
+        vect_filepaths[corpus_col] = os.path.join(os.path.dirname(vect_filepath),
+                                                  'vect_{}_{}.pkl'.format(corpus_col, stamp))
+        shutil.copy(vect_filepath, vect_filepaths[corpus_col])
+    return vect_filepaths
+
+
+def test_evict_kernels(train_kernel, reports_sample):
+    """[interface][diaman_help] Check the eviction of the least recently used kernels."""
+    for code_shop in ('MEC', 'PAI'):
+        train_kernel(code_shop, reports_sample.assign(CODE_SHOP=code_shop))
+    diaman_help = make_diaman_help(preload=['fr_STA', 'fr_MEC', 'fr_PAI'])
+    max_memory_size = max(diaman_help.get_kernels_memory().values())
+
+    # Budget of 2 kernels
+    diaman_help = make_diaman_help(preload=['fr_STA', 'fr_MEC'],
+                                   memory_budget=2.5 * max_memory_size / 2**20)
+    assert list(diaman_help.kernels) == ['fr_STA', 'fr_MEC']
+    diaman_help._get_kernel('fr', 'STA')
+    diaman_help._get_kernel('fr', 'PAI')
+    assert list(diaman_help.kernels) == ['fr_STA', 'fr_PAI']
+    diaman_help._get_kernel('fr', 'MEC')
+    assert list(diaman_help.kernels) == ['fr_PAI', 'fr_MEC']
+
+    # Budget below the size of a kernel, which stays resident until the next one
+    diaman_help.serving_params = diaman_help.serving_params._replace(memory_budget=0.)
+    diaman_help._get_kernel('fr', 'STA')
+    assert list(diaman_help.kernels) == ['fr_STA']
+
+
+@pytest.mark.parametrize('load_executor', ['thread', 'process'])
+def test_instantiate_kernels_concurrently(train_kernel, reports_sample, load_executor):
+    """[interface][diaman_help] Check that concurrently loaded kernels are the sequential ones."""
+    for code_shop in ('MEC', 'PAI'):
+        train_kernel(code_shop, reports_sample.assign(CODE_SHOP=code_shop))
+    preload = ['fr_STA', 'fr_MEC', 'fr_PAI']
+    diaman_help = make_diaman_help(preload=preload, load_workers=3,
+                                   load_executor=load_executor)
+    expected_diaman_help = make_diaman_help(preload=preload)
+
+    assert sorted(diaman_help.kernels) == sorted(preload)
+    assert diaman_help.get_kernels_version() == expected_diaman_help.get_kernels_version()
+    assert diaman_help.get_kernels_memory() == expected_diaman_help.get_kernels_memory()
+    for key in preload:
+        kernel, expected_kernel = diaman_help.kernels[key], expected_diaman_help.kernels[key]
+        pd.testing.assert_frame_equal(kernel.comment_vect.df_preprocessed,
+                                      expected_kernel.comment_vect.df_preprocessed)
+        results = search_pipeline.make_search(kernel, 'fuite huile', [], [], [], 10)
+        expected_results = search_pipeline.make_search(expected_kernel, 'fuite huile',
+                                                       [], [], [], 10)
+        pd.testing.assert_frame_equal(results[0], expected_results[0])
+        assert results[1:] == expected_results[1:]
+
+
+def test_get_search_results_batch(histo_repo):
+    """[interface][diaman_help] Check that a failed request doesn't fail its batch."""
+    diaman_help = make_diaman_help()
+    request = {'code_site': 'SX', 'code_shop': 'STA', 'search': 'fuite huile',
+               'site_filters': [], 'constructor_filters': [], 'equipment_filters': []}
+    requests = [request,
+                dict(request, code_site='XX'),
+                dict(request, site_filters=None),
+                dict(request, search=None),
+                dict(request, search='coussin', site_filters=['SX'])]
+
+    results = diaman_help.get_search_results_batch(requests)
+
+    assert results[0] == diaman_help.get_search_results('SX', 'STA', 'fuite huile', [], [], [])
+    assert isinstance(results[1], ValueError)
+    assert isinstance(results[2], TypeError)
+    assert isinstance(results[3], TypeError)
+    assert results[4] == diaman_help.get_search_results('SX', 'STA', 'coussin', ['SX'], [], [])
+
+
+def test_response_cache_reload(histo_repo):
+    """[interface][diaman_help] Check that the results of a retired kernel are never served."""
+    diaman_help = make_diaman_help()
+    request = {'code_site': 'SX', 'code_shop': 'STA', 'search': 'fuite huile',
+               'site_filters': [], 'constructor_filters': [], 'equipment_filters': []}
+    old_kernel = diaman_help.kernels['fr_STA']
+    old_cache_key = diaman_help._get_cache_key(old_kernel, 'fr', request)
+
+    assert diaman_help._reload_kernel('fr', 'STA', save_kernel_version('STA', '20991231_2359'))
+    # A search of the retired kernel answered after the reload
+    diaman_help.response_cache.put(old_cache_key, b'{"ORDER_LIST": []}')
+
+    results = diaman_help.get_search_results('SX', 'STA', 'fuite huile', [], [], [])
+    assert len(results['ORDER_LIST']) > 0
+
+
+def test_check_reloads(histo_repo):
+    """[interface][diaman_help] Check the reload of a new version once its files are unchanged."""
+    diaman_help = make_diaman_help()
+    old_kernel = diaman_help.kernels['fr_STA']
+    assert diaman_help.check_reloads() == []
+
+    save_kernel_version('STA', '20991231_2359')
+    assert diaman_help.check_reloads() == []
+    assert diaman_help.kernels['fr_STA'] is old_kernel
+
+    assert diaman_help.check_reloads() == ['fr_STA']
+    assert diaman_help.kernels['fr_STA'].version == {
+        'DESCR_ORDER': 'vect_DESCR_ORDER_20991231_2359.pkl',
+        'COMMENT': 'vect_COMMENT_20991231_2359.pkl'}
+    assert diaman_help.reload_stats['fr_STA']['reloads'] == 1
+
+
+def test_reload_drain(histo_repo):
+    """[interface][diaman_help] Check the retirement of a reloaded kernel."""
+    diaman_help = make_diaman_help()
+    with diaman_help._use_kernel('fr', 'STA') as old_kernel:
+        assert diaman_help._reload_kernel('fr', 'STA', save_kernel_version('STA', '20991231_2359'))
+        assert diaman_help.kernels['fr_STA'] is not old_kernel
+        assert diaman_help._retired_kernels == [old_kernel]
+
+    assert old_kernel.in_flight == 0
+    assert diaman_help._retired_kernels == []
+
+
+def test_reload_failure(histo_repo):
+    """[interface][diaman_help] Check that a failed version keeps the old kernel."""
+    diaman_help = make_diaman_help()
+    old_kernel = diaman_help.kernels['fr_STA']
+    valid_filepaths = save_kernel_version('STA', '20991230_2359')
+    vect_filepaths = save_kernel_version('STA', '20991231_2359')
+    with open(vect_filepaths['COMMENT'], 'wb') as writer:
+        writer.write(b'truncated')
+
+    for _ in range(4):
+        assert diaman_help.check_reloads() == []
+    assert diaman_help.kernels['fr_STA'] is old_kernel
+    assert diaman_help.reload_stats['fr_STA']['failures'] == 1
+    results = diaman_help.get_search_results('SX', 'STA', 'fuite huile', [], [], [])
+    assert len(results['ORDER_LIST']) > 0
+
+    shutil.copy(valid_filepaths['COMMENT'], vect_filepaths['COMMENT'])
+    assert diaman_help.check_reloads() == []
+    assert diaman_help.check_reloads() == ['fr_STA']
+    assert diaman_help.reload_stats['fr_STA']['failures'] == 1
+
+
+def test_reload_watcher(histo_repo):
+    """[interface][diaman_help] Check the background reload of the new versions."""
+    diaman_help = make_diaman_help()
+    diaman_help.start_reload_watcher(reload_interval=0.01)
+    try:
+        save_kernel_version('STA', '20991231_2359')
+        for _ in range(500):
+            if diaman_help.reload_stats.get('fr_STA', {}).get('reloads'):
+                break
+            time.sleep(0.01)
+    finally:
+        diaman_help.stop_reload_watcher()
+
+    assert diaman_help.get_kernels_version()['fr_STA']['COMMENT'] == \
+        'vect_COMMENT_20991231_2359.pkl'
@@ -0,0 +1,43 @@
+import numpy as np
+
+from diaman.configuration.data import DataConfig
+from diaman.interface import serializer
+from diaman.pipeline import benchmark_search, search_pipeline
+
+
+def test_format_nested_cols(reports_sample):
+    """[interface][serializer] Check the spare parts & the medias formatted once per kernel."""
+    df_reports = reports_sample.head(100).copy()
+    df_reports.at[0, 'MEDIAS'] = [('http://doc/1', 'PDF'), ('http://doc/2', 'JPG')]
+    df_reports.at[2, 'MEDIAS'] = [('http://doc/3', 'PDF')]
+    expected_components = [[{"MATNR": component[0], "MATL_DESC": "string",
+                             "QUANTITY": component[2]} for component in components]
+                           for components in df_reports['COMPONENTS']]
+    expected_medias = [[{"DOC_URL": media[0], "DOC_TYPE": media[1]} for media in medias]
+                       for medias in df_reports['MEDIAS']]
+
+    serializer.format_nested_cols(df_reports)
+
+    assert df_reports['COMPONENTS'].tolist() == expected_components
+    assert df_reports['MEDIAS'].tolist() == expected_medias
+    assert sum(len(components) for components in expected_components) > 0
+
+
+def test_serialize_reports(kernel, reports_sample):
+    """[interface][serializer] Check the reports serialized like the legacy json round trip."""
+    search_cols = DataConfig().diaman_search_cols
+    df_reports = reports_sample.head(100).copy()
+    df_reports.at[0, 'MEDIAS'] = [('http://doc/1', 'PDF'), ('http://doc/2', 'JPG')]
+    df_reports.loc[1, ['COMMENT', 'DURA_EQUI', 'TRAFF_LIGHT']] = [None, np.nan, np.nan]
+    df_reports.loc[2, 'DURA_EQUI'] = 1 / 3
+    serializer.format_nested_cols(df_reports)
+
+    order_list = serializer.serialize_reports(df_reports, search_cols)
+    assert order_list == benchmark_search.legacy_serialize_reports(df_reports, search_cols)
+    assert order_list[0]['MEDIAS'][1] == {"DOC_URL": 'http://doc/2', "DOC_TYPE": 'JPG'}
+    assert order_list[1]['COMMENT'] == [None]
+
+    # Reports of the search results of a kernel, whose nested columns are formatted
+    df_reports = search_pipeline.make_search(kernel, 'fuite huile', [], [], [], 50)[0]
+    assert serializer.serialize_reports(df_reports, search_cols) == \
+        benchmark_search.legacy_serialize_reports(df_reports, search_cols)
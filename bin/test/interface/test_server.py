@@ -0,0 +1,169 @@
+import json
+import asyncio
+from http import HTTPStatus
+
+import pytest
+
+from diaman.configuration.data import DataConfig
+from diaman.interface.server import DiamanServer, HttpError, read_request_head
+from .test_diaman_help import make_diaman_help
+
+
+def make_server(**server_params):
+    """Instantiate a DiamanServer instance serving the fr_STA kernel."""
+    return DiamanServer(make_diaman_help(),
+                        DataConfig().server_params._replace(**server_params))
+
+
+def dispatch(server, *requests):
+    """Dispatch concurrent requests & get their status & json content."""
+    async def dispatch_all():
+        responses = await asyncio.gather(*[server._dispatch(*request) for request in requests])
+        await server.stop()
+        return responses
+
+    loop = asyncio.new_event_loop()
+    try:
+        responses = loop.run_until_complete(dispatch_all())
+    finally:
+        loop.close()
+    return [(status, json.loads(content.decode('utf-8'))) for status, content in responses]
+
+
+def search_request(search, **params):
+    """Build a search request of the fr_STA kernel."""
+    params = dict({'code_site': 'SX', 'code_shop': 'STA', 'search': search}, **params)
+    return 'POST', '/search', json.dumps(params).encode('utf-8')
+
+
+def test_search(histo_repo):
+    """[interface][server] Check the results of the searches of a micro-batch."""
+    server = make_server(batch_window=50, max_batch_size=32)
+    responses = dispatch(server, search_request('fuite huile'),
+                         search_request('coussin', site_filters=['SX']))
+
+    assert [status for status, _ in responses] == [HTTPStatus.OK, HTTPStatus.OK]
+    assert responses[0][1] == server.diaman_help.get_search_results(
+        'SX', 'STA', 'fuite huile', [], [], [])
+    assert responses[1][1] == server.diaman_help.get_search_results(
+        'SX', 'STA', 'coussin', ['SX'], [], [])
+
+
+def test_search_errors(histo_repo):
+    """[interface][server] Check that an invalid search doesn't fail its micro-batch."""
+    server = make_server(batch_window=50, max_batch_size=32)
+    responses = dispatch(server, search_request('fuite huile'),
+                         search_request('fuite huile', site_filters='SX'),
+                         search_request('fuite huile', code_site='XX'),
+                         ('GET', '/unknown', b''))
+
+    assert [status for status, _ in responses] == [HTTPStatus.OK, HTTPStatus.BAD_REQUEST,
+                                                   HTTPStatus.BAD_REQUEST, HTTPStatus.NOT_FOUND]
+
+
+def test_refine_errors(histo_repo):
+    """[interface][server] Check that the refines & bodies of wrong types are rejected."""
+    server = make_server()
+    refine_params = {'code_site': 'SX', 'code_shop': 'STA', 'search': ['fuite', 'huile']}
+    responses = dispatch(server, ('POST', '/refine', json.dumps(refine_params).encode('utf-8')),
+                         ('POST', '/refine', json.dumps({'code_site': 'SX'}).encode('utf-8')),
+                         ('POST', '/search', b'["fuite huile"]'))
+
+    assert [status for status, _ in responses] == [HTTPStatus.BAD_REQUEST] * 3
+
+
+def test_search_recency_boost(histo_repo):
+    """[interface][server] Check that the recency boost must be between 0 and 1."""
+    server = make_server(batch_window=50, max_batch_size=32)
+    responses = dispatch(server, search_request('fuite huile', recency_boost=0.5),
+                         search_request('fuite huile', recency_boost=1.5),
+                         search_request('fuite huile', recency_boost=-0.1),
+                         search_request('fuite huile', recency_boost='recent'))
+
+    assert [status for status, _ in responses] == [HTTPStatus.OK] + [HTTPStatus.BAD_REQUEST] * 3
+    assert responses[0][1] == server.diaman_help.get_search_results(
+        'SX', 'STA', 'fuite huile', [], [], [], recency_boost=0.5)
+
+
+def test_search_backpressure(histo_repo):
+    """[interface][server] Check that the requests beyond the pending limit are rejected."""
+    server = make_server(batch_window=50, max_batch_size=32, max_pending=2)
+    responses = dispatch(server, *[search_request('fuite huile') for _ in range(3)])
+
+    assert sorted(status for status, _ in responses) == [
+        HTTPStatus.OK, HTTPStatus.OK, HTTPStatus.SERVICE_UNAVAILABLE]
+    assert server.n_pending == 0
+
+
+def test_flush_full_batch(histo_repo):
+    """[interface][server] Check that the timer of a batch flushed when full is cancelled."""
+    server = make_server(batch_window=10000, max_batch_size=2)
+    responses = dispatch(server, search_request('fuite huile'), search_request('coussin'))
+
+    assert [status for status, _ in responses] == [HTTPStatus.OK, HTTPStatus.OK]
+    assert server._batch_timers == {}
+
+
+def test_health(histo_repo):
+    """[interface][server] Check the health route."""
+    server = make_server()
+    status, content = dispatch(server, ('GET', '/health', b''))[0]
+
+    assert status == HTTPStatus.OK
+    assert list(content['kernels'].keys()) == ['fr_STA']
+
+
+def test_read_request_head():
+    """[interface][server] Check the limits of the request headers."""
+    async def read(data):
+        reader = asyncio.StreamReader()
+        reader.feed_data(data)
+        reader.feed_eof()
+        return await read_request_head(reader)
+
+    loop = asyncio.new_event_loop()
+    try:
+        assert loop.run_until_complete(read(
+            b'POST /search?x=1 HTTP/1.1\r\nContent-Length: 2\r\n\r\n{}')) == (
+            'POST', '/search', {'content-length': '2'})
+        with pytest.raises(HttpError) as e:
+            loop.run_until_complete(read(b'GET /health HTTP/1.1\r\n'
+                                         + b'X-Header: value\r\n' * 101 + b'\r\n'))
+        assert e.value.status == HTTPStatus.REQUEST_HEADER_FIELDS_TOO_LARGE
+        with pytest.raises(HttpError):
+            loop.run_until_complete(read(b'GET /health HTTP/1.1\r\n'
+                                         + b'X-Header: ' + b'x' * 20000 + b'\r\n\r\n'))
+    finally:
+        loop.close()
+
+
+def test_request_rejected_before_body(histo_repo):
+    """[interface][server] Check that the too large & excess requests are rejected unread."""
+    server = make_server(host='127.0.0.1', port=0, max_body_size=1, max_pending=1)
+
+    async def send(head):
+        """Send the head of a request without its body & read the response status."""
+        reader, writer = await asyncio.open_connection(
+            *server._server.sockets[0].getsockname())
+        writer.write(head)
+        status_line = await reader.readline()
+        writer.close()
+        return int(status_line.split()[1])
+
+    async def send_all():
+        await server.start()
+        try:
+            too_large = await send(b'POST /search HTTP/1.1\r\nContent-Length: 2048\r\n\r\n')
+            server.n_pending = 1
+            excess = await send(b'POST /search HTTP/1.1\r\nContent-Length: 100\r\n\r\n')
+            server.n_pending = 0
+        finally:
+            await server.stop()
+        return too_large, excess
+
+    loop = asyncio.new_event_loop()
+    try:
+        statuses = loop.run_until_complete(send_all())
+    finally:
+        loop.close()
+    assert statuses == (HTTPStatus.REQUEST_ENTITY_TOO_LARGE, HTTPStatus.SERVICE_UNAVAILABLE)
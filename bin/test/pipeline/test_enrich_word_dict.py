@@ -0,0 +1,42 @@
+import os
+import json
+import shutil
+import jsonlines
+
+from diaman.configuration.data import DataConfig
+from diaman.domain.vectorizer import CorpusVect
+from diaman.pipeline import enrich_word_dict
+from diaman.pipeline.train_pipeline import get_preprocessing_hash
+from diaman.utils import histo
+from diaman.utils.word_dict import load_word_dict
+
+
+data_config = DataConfig('fr')
+
+
+def test_run_recorrect(histo_repo):
+    """[pipeline][enrich_word_dict] Check the correction of the corpora after the enrichment."""
+    word_dict_filepath = os.path.join(str(histo_repo), 'word_dict.json')
+    shutil.copy(data_config._word_dict_filepath, word_dict_filepath)
+    old_preprocessing_hash = get_preprocessing_hash(data_config,
+                                                    load_word_dict(word_dict_filepath))
+    histo.save_artifact('fr', 'STA', 'train_watermark',
+                        {'erdat': '2019-06-01', 'preprocessing_hash': old_preprocessing_hash})
+
+    doccano_filepath = os.path.join(str(histo_repo), 'doccano.jsonl')
+    with jsonlines.open(doccano_filepath, 'w') as writer:
+        writer.write({"text": "remise remis",
+                      "labels": [[0, 6, "CORRECT"], [7, 12, "INCORRECT"]]})
+    enrich_word_dict.run(doccano_filepath, word_dict_filepath, recorrect=True)
+
+    with open(word_dict_filepath) as reader:
+        new_word_dict = json.load(reader)
+    watermark = histo.load_artifact('fr', 'STA', 'train_watermark')
+    assert watermark['preprocessing_hash'] == get_preprocessing_hash(data_config, new_word_dict)
+
+    corpus_vect = CorpusVect('fr', 'STA', 'COMMENT')
+    corpus_vect.load()
+    tokens = {token for corpus in corpus_vect.df_preprocessed['corpus']
+              for token in corpus.split()}
+    assert 'remise' in tokens
+    assert 'remis' not in tokens
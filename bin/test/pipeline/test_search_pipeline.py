@@ -0,0 +1,149 @@
+import pytest
+import numpy as np
+import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
+
+from diaman.configuration.data import DataConfig
+from diaman.domain import preprocessing, report, vectorizer
+from diaman.interface.kernel import DiamanKernel
+from diaman.pipeline import search_pipeline
+
+
+searches = [{'search': 'fuite huile', 'site_filters': [], 'constructor_filters': [],
+             'equipment_filters': []},
+            {'search': 'coussin', 'site_filters': ['SX', 'PY'], 'constructor_filters': [],
+             'equipment_filters': [], 'n_reports': 5},
+            {'search': 'capteur presse', 'site_filters': [], 'constructor_filters': [],
+             'equipment_filters': [], 'date_from': '2018-01-01', 'recency_boost': 0.5},
+            {'search': 'presse', 'site_filters': [], 'constructor_filters': ['SCHULER', 'AIDA'],
+             'equipment_filters': [], 'date_to': '2019-01-01'}]
+
+
+def make_search(kernel, search, **kwargs):
+    """Run make_search with the parameters of a search of a batch."""
+    return search_pipeline.make_search(kernel, search['search'], search['site_filters'],
+                                       search['constructor_filters'],
+                                       search['equipment_filters'],
+                                       search.get('n_reports', 50),
+                                       date_from=search.get('date_from'),
+                                       date_to=search.get('date_to'),
+                                       recency_boost=search.get('recency_boost', 0.),
+                                       **kwargs)
+
+
+def assert_results_equal(results, expected_results):
+    """Check that two results of make_search are equal."""
+    pd.testing.assert_frame_equal(results[0], expected_results[0])
+    assert results[1:] == expected_results[1:]
+
+
+def sort_ties(df_reports):
+    """Sort the reports of the results of a search with the same sorting score
+    on their AUFNR, the order of the ties being undefined."""
+    return df_reports[['AUFNR', 'similarity', 'detail_level', 'sorting_score']] \
+        .sort_values(by=['sorting_score', 'AUFNR'], ascending=[False, True]) \
+        .reset_index(drop=True)
+
+
+@pytest.fixture
+def sharded_kernel(histo_repo):
+    """fr_STA kernel trained on the sample reports, split into 3 shards."""
+    sharded_config = DataConfig('fr')
+    sharded_config.serving_params = sharded_config.serving_params._replace(n_shards=3)
+    return DiamanKernel('fr', 'STA', data_config=sharded_config)
+
+
+def test_make_search_batch(kernel):
+    """[pipeline][search_pipeline] Check the results of the searches of a batch."""
+    results = search_pipeline.make_search_batch(kernel, searches)
+
+    assert len(results) == len(searches)
+    for search, search_results in zip(searches, results):
+        assert_results_equal(search_results, make_search(kernel, search))
+
+
+def test_make_search_batch_errors(kernel):
+    """[pipeline][search_pipeline] Check that a failed search doesn't fail its batch."""
+    bad_searches = [{'search': 'fuite huile', 'site_filters': 5, 'constructor_filters': [],
+                     'equipment_filters': []},
+                    {'search': 'zzzz', 'site_filters': [], 'constructor_filters': [],
+                     'equipment_filters': []}]
+    results = search_pipeline.make_search_batch(kernel, searches[:1] + bad_searches)
+
+    assert_results_equal(results[0], make_search(kernel, searches[0]))
+    assert isinstance(results[1], TypeError)
+    assert isinstance(results[2], ValueError)
+
+
+@pytest.mark.parametrize('date_from, date_to', [('2018-01-01', None), (None, '2018-12-31'),
+                                                ('2018-03-01', '2018-06-30')])
+def test_make_search_dates(kernel, date_from, date_to):
+    """[pipeline][search_pipeline] Check that the date index selects the reports between dates."""
+    results = search_pipeline.make_search(kernel, 'fuite huile', [], [], [], 1000,
+                                          date_from=date_from, date_to=date_to)
+
+    # Reports of the range scored among all the reports, their comment
+    # similarities being normalized over the range
+    dates = pd.to_datetime(kernel.comment_vect.df_preprocessed['ERDAT'], errors='coerce')
+    rows = np.flatnonzero(dates.between(pd.Timestamp(date_from or dates.min()),
+                                        pd.Timestamp(date_to or dates.max())))
+    inputs = preprocessing.preprocess_corpus(pd.DataFrame({'user_input': ['fuite huile']}),
+                                             'user_input', kernel.stopwords, kernel.word_dict)
+    sim_failure = vectorizer.description_similarities(kernel.description_vect, inputs)[0, rows]
+    sim_comment = vectorizer.comment_similarities(kernel.comment_vect, inputs)[0, rows]
+    sim_comment = (sim_comment - sim_comment.min()) / (sim_comment.max() - sim_comment.min())
+    similarity = np.zeros(len(dates))
+    similarity[rows] = ((1. - kernel.slider_sim_weight) * sim_failure
+                        + kernel.slider_sim_weight * sim_comment) / 2
+    df_reports = report.get_matching_reports(kernel, 'fuite huile', similarity, rows)
+    df_reports, *matching_entities = report.filter_reports(df_reports, [], [], [])
+    df_reports = report.sort_reports(df_reports, kernel.slider_coeff_detail)
+
+    assert 0 < len(results[0]) < len(dates)
+    assert set(results[0]['AUFNR']) == set(df_reports['AUFNR'])
+    df_expected = df_reports.set_index('AUFNR').loc[results[0]['AUFNR']]
+    for col in ('similarity', 'sorting_score'):
+        assert np.allclose(results[0][col], df_expected[col])
+    assert list(results[1:]) == matching_entities
+
+
+def test_make_federated_search(kernel, train_kernel, reports_sample):
+    """[pipeline][search_pipeline] Check that the reports of an outranked shop come last."""
+    # Reports of another shop, weakly matching the search in their comment only
+    unmatched = ~reports_sample['DESCR_ORDER'].fillna('').str.contains('huile|fuite') \
+        & ~reports_sample['COMMENT'].fillna('').str.contains('huile|fuite')
+    df_other = reports_sample[unmatched].head(30).assign(CODE_SHOP='MEC')
+    df_other['COMMENT'] = [comment + ' huile' * (idx + 1) if idx < 5 else comment
+                           for idx, comment in enumerate(df_other['COMMENT'].fillna(''))]
+    other_kernel = train_kernel('MEC', df_other)
+
+    results = search_pipeline.make_federated_search({'STA': kernel, 'MEC': other_kernel},
+                                                    'fuite huile', [], [], [], 10)
+
+    expected_results = search_pipeline.make_search(kernel, 'fuite huile', [], [], [], 10)
+    assert results[0]['CODE_SHOP'].tolist() == ['STA'] * 10
+    assert results[0]['AUFNR'].tolist() == expected_results[0]['AUFNR'].tolist()
+    assert results[0]['sorting_score'].tolist() == expected_results[0]['sorting_score'].tolist()
+    assert set(results[1]) == set(expected_results[1]) | set(df_other['CODE_SITE'][:5])
+
+
+@pytest.mark.parametrize('search', searches)
+def test_make_sharded_search(sharded_kernel, search):
+    """[pipeline][search_pipeline] Check the search of the shards of a kernel."""
+    # All the reports are returned, the order of the ties being undefined
+    search = dict(search, n_reports=1000)
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        results = make_search(sharded_kernel, search, executor=executor)
+    expected_results = make_search(sharded_kernel, search)
+
+    pd.testing.assert_frame_equal(sort_ties(results[0]), sort_ties(expected_results[0]))
+    assert results[1:] == expected_results[1:]
+
+
+def test_make_sharded_search_batch(sharded_kernel):
+    """[pipeline][search_pipeline] Check the batch search of the shards of a kernel."""
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        results = search_pipeline.make_search_batch(sharded_kernel, searches, executor)
+
+    for search, search_results in zip(searches, results):
+        assert_results_equal(search_results, make_search(sharded_kernel, search))
@@ -0,0 +1,344 @@
+import os
+import shutil
+import pytest
+import numpy as np
+import yaml
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from pyspark.sql import SparkSession
+
+import diaman
+from diaman.configuration.data import DataConfig
+from diaman.domain import preprocessing, report
+from diaman.domain.vectorizer import CorpusVect
+from diaman.interface import serializer
+from diaman.interface.kernel import DiamanKernel, get_last_vect_filepaths
+from diaman.pipeline import train_pipeline
+from diaman.utils import histo
+
+
+data_config = DataConfig()
+
+component_type = pa.list_(pa.struct([('MATNR', pa.string()), ('MATL_DESC', pa.string()),
+                                     ('QUANTITY', pa.string())]))
+media_type = pa.list_(pa.struct([('DOC_URL', pa.string()), ('DOC_TYPE', pa.string())]))
+
+staging_schema = ('AUFNR string, AUART string, DESCR_ORDER string, STATUS string, '
+                  'EQUNR string, DESCR_EQUI string, ERDAT date, TRAFF_LIGHT double, '
+                  'COMMENT string, '
+                  'COMPONENTS array<struct<MATNR:string,MATL_DESC:string,QUANTITY:string>>, '
+                  'DURA_EQUI float, MEDIAS array<struct<DOC_URL:string,DOC_TYPE:string>>, '
+                  'CODE_SITE string, CODE_SHOP string, CONSTRUCTOR string, RATING int, '
+                  'LANGUAGE string')
+
+
+@pytest.fixture(scope='module')
+def spark_session():
+    """Spark session in local mode, the tests being skipped without a JVM."""
+    if shutil.which('java') is None and 'JAVA_HOME' not in os.environ:
+        pytest.skip('No JVM to run Spark in local mode')
+    spark_session = SparkSession.builder.master('local[2]') \
+        .appName('diaman-test') \
+        .config('spark.sql.shuffle.partitions', 2) \
+        .getOrCreate()
+    yield spark_session
+    spark_session.stop()
+
+
+def make_raw_reports(df_reports):
+    """Get the sample reports as raw reports of the standard data, with their
+    raw column names & types."""
+    raw_columns = {col: raw_col for raw_col, col in data_config.gmt_columns.items()}
+    df_raw = df_reports.rename(columns=raw_columns)[list(data_config.gmt_columns)]
+    df_raw['ERDAT'] = pd.to_datetime(df_raw['ERDAT']).dt.date
+    df_raw['ISMNW'] = df_raw['ISMNW'].astype(str)
+    df_raw['COMPONENTS'] = [[dict(zip(['MATNR', 'MATL_DESC', 'QUANTITY'], component))
+                             for component in components]
+                            for components in df_raw['COMPONENTS']]
+    df_raw['MEDIAS'] = [[dict(zip(['DOC_URL', 'DOC_TYPE'], media)) for media in medias]
+                        for medias in df_raw['MEDIAS']]
+    return df_raw
+
+
+def write_raw_reports(df_raw, filepath, row_group_size=None):
+    """Write raw reports as a parquet file of the standard data."""
+    fields = [pa.field('COMPONENTS', component_type), pa.field('MEDIAS', media_type),
+              pa.field('ERDAT', pa.date32())]
+    fields += [pa.field(col, pa.float64() if col == 'VOR' else pa.string())
+               for col in df_raw.columns if col not in ('COMPONENTS', 'MEDIAS', 'ERDAT')]
+    schema = pa.schema(sorted(fields, key=lambda field: list(df_raw.columns).index(field.name)))
+    pq.write_table(pa.Table.from_pandas(df_raw, schema=schema, preserve_index=False),
+                   filepath, row_group_size=row_group_size)
+
+
+def test_stage_language_shops_local(tmp_path, reports_sample):
+    """[pipeline][train_pipeline] Check the filters & the dedup of the local staging."""
+    df_raw = make_raw_reports(reports_sample.head(40))
+    df_raw['BUSINESS'] = np.where(np.arange(len(df_raw)) % 2 == 0, 'STA', 'MEC')
+    df_raw.loc[30:, 'AUART'] = 'ZPRV'
+    df_raw.loc[5, 'KTEXT'] = None
+    df_raw.loc[6, 'COMMENTAIRE'] = None
+    df_raw.loc[7, 'HERST'] = ''
+    df_raw.loc[8, 'HERST'] = None
+    df_raw.loc[9, 'HERST'] = 'aida'
+    df_raw.loc[10, 'PLANT_CODE'] = 'ZZ'
+    df_raw.loc[11, 'COMPONENTS'] = [{'MATNR': 'N000911274', 'MATL_DESC': 'Pompe',
+                                     'QUANTITY': '2'}]
+
+    standard_data_path = tmp_path / 'standard'
+    (standard_data_path / 'part').mkdir(parents=True)
+    # Duplicates in the same file & in another file
+    write_raw_reports(pd.concat([df_raw, df_raw.iloc[[3]]], ignore_index=True),
+                      str(standard_data_path / 'part' / 'a.parquet'), row_group_size=10)
+    write_raw_reports(df_raw.iloc[:3], str(standard_data_path / 'b.parquet'))
+
+    staging_path = str(tmp_path / 'staging')
+    train_pipeline.stage_language_shops_local(str(standard_data_path), data_config,
+                                              staging_path)
+
+    df_kept = df_raw.drop(index=[5, 6, 10]).iloc[:27]
+    columns = train_pipeline.get_staging_columns(data_config)
+    for code_shop in ('STA', 'MEC'):
+        df_staged = train_pipeline.load_staged_language_shop(staging_path, 'fr', code_shop,
+                                                             columns)
+        df_expected = df_kept[df_kept['BUSINESS'] == code_shop].sort_values('AUFNR')
+
+        assert df_staged['AUFNR'].tolist() == df_expected['AUFNR'].tolist()
+        assert df_staged['DURA_EQUI'].dtype == np.float32
+        assert df_staged['DURA_EQUI'].tolist() == \
+            (df_expected['ISMNW'].astype(np.float32) * np.float32(60)).tolist()
+        assert df_staged['RATING'].tolist() == [-1] * len(df_expected)
+        assert df_staged['COMPONENTS'].tolist() == [
+            [tuple(component.values()) for component in components]
+            for components in df_expected['COMPONENTS']]
+
+    df_staged = pd.concat([train_pipeline.load_staged_language_shop(staging_path, 'fr',
+                                                                    code_shop, columns)
+                           for code_shop in ('STA', 'MEC')]).set_index('AUFNR')
+    constructors = df_raw.set_index('AUFNR')['HERST']
+    assert df_staged.loc[constructors.index[7], 'CONSTRUCTOR'] == 'UNKNOWN'
+    assert df_staged.loc[constructors.index[8], 'CONSTRUCTOR'] == 'UNKNOWN'
+    assert df_staged.loc[constructors.index[9], 'CONSTRUCTOR'] == 'AIDA'
+
+
+def test_stage_language_shops_local_no_files(tmp_path):
+    """[pipeline][train_pipeline] Check the local staging without standard data."""
+    with pytest.raises(FileNotFoundError):
+        train_pipeline.stage_language_shops_local(str(tmp_path), data_config,
+                                                  str(tmp_path / 'staging'))
+
+
+def test_get_preprocessing_hash(monkeypatch):
+    """[pipeline][train_pipeline] Check that the preprocessing hash changes with the version."""
+    data_config_language = DataConfig('fr')
+    preprocessing_hash = train_pipeline.get_preprocessing_hash(data_config_language)
+    assert train_pipeline.get_preprocessing_hash(data_config_language) == preprocessing_hash
+    assert train_pipeline.get_preprocessing_hash(
+        data_config_language, {'accoster': ['accostage']}) != preprocessing_hash
+
+    monkeypatch.setattr(diaman, '__version__', diaman.__version__ + '.dev0')
+    assert train_pipeline.get_preprocessing_hash(data_config_language) != preprocessing_hash
+
+
+def test_get_train_fingerprint(tmp_path, reports_sample):
+    """[pipeline][train_pipeline] Check the inputs which the train fingerprint depends on."""
+    preprocessing_hash = train_pipeline.get_preprocessing_hash(DataConfig('fr'))
+    fingerprint = train_pipeline.get_train_fingerprint(reports_sample, preprocessing_hash,
+                                                       data_config)
+
+    # Reordered reports & columns
+    df_shuffled = reports_sample.sample(frac=1, random_state=0)
+    assert train_pipeline.get_train_fingerprint(df_shuffled[df_shuffled.columns[::-1]],
+                                                preprocessing_hash, data_config) == fingerprint
+
+    # Changed report, word_dict & processing parameters
+    df_changed = reports_sample.copy()
+    df_changed.loc[0, 'COMMENT'] = 'fuite huile'
+    assert train_pipeline.get_train_fingerprint(df_changed, preprocessing_hash,
+                                                data_config) != fingerprint
+    other_hash = train_pipeline.get_preprocessing_hash(DataConfig('fr'),
+                                                       {'accoster': ['accostage']})
+    assert train_pipeline.get_train_fingerprint(reports_sample, other_hash,
+                                                data_config) != fingerprint
+
+    with open(data_config._processing_filepath) as f:
+        config = yaml.load(f.read(), Loader=yaml.FullLoader)
+    fingerprints = []
+    for section, name, value in [('train_parameters', 'max_workers', 1),
+                                 ('vect_parameters', 'max_df', 0.5)]:
+        other_config = DataConfig()
+        other_config._processing_filepath = str(tmp_path / '{}.yml'.format(name))
+        with open(other_config._processing_filepath, 'w') as f:
+            yaml.dump(dict(config, **{section: dict(config[section], **{name: value})}), f)
+        fingerprints.append(train_pipeline.get_train_fingerprint(
+            reports_sample, preprocessing_hash, other_config))
+    assert fingerprints[0] == fingerprint
+    assert fingerprints[1] != fingerprint
+
+
+def test_get_unchanged_manifest(histo_repo):
+    """[pipeline][train_pipeline] Check that a manifest is only kept with its last artifacts."""
+    vect_filepaths = get_last_vect_filepaths('fr', 'STA')
+    histo.save_artifact('fr', 'STA', 'train_manifest', {'fingerprint': 'abc',
+                                                        'vect_filepaths': vect_filepaths})
+
+    manifest = train_pipeline.get_unchanged_manifest('fr', 'STA', 'abc')
+    assert manifest['vect_filepaths'] == vect_filepaths
+    assert train_pipeline.get_unchanged_manifest('fr', 'STA', 'def') is None
+    assert train_pipeline.get_unchanged_manifest('fr', 'MEC', 'abc') is None
+
+    # Vectorizers saved after the last training
+    for corpus_col, vect_filepath in vect_filepaths.items():
+        shutil.copy(vect_filepath, os.path.join(os.path.dirname(vect_filepath),
+                                                'vect_{}_20991231_2359.pkl'.format(corpus_col)))
+    assert train_pipeline.get_unchanged_manifest('fr', 'STA', 'abc') is None
+
+    # Vectorizers of the last training removed
+    histo.save_artifact('fr', 'STA', 'train_manifest', {
+        'fingerprint': 'abc', 'vect_filepaths': get_last_vect_filepaths('fr', 'STA')})
+    assert train_pipeline.get_unchanged_manifest('fr', 'STA', 'abc') is not None
+    os.remove(get_last_vect_filepaths('fr', 'STA')['COMMENT'])
+    assert train_pipeline.get_unchanged_manifest('fr', 'STA', 'abc') is None
+
+
+def test_make_refine_topics(histo_repo, monkeypatch):
+    """[pipeline][train_pipeline] Check that unchanged refine topics aren't precomputed again."""
+    precomputed = []
+
+    def precompute_refine_topics(kernel, searches):
+        precomputed.append(searches)
+        return {search: [['huile']] for search in searches}
+
+    monkeypatch.setattr(train_pipeline.search_pipeline, 'precompute_refine_topics',
+                        precompute_refine_topics)
+    train_pipeline.make_refine_topics('fr', 'STA', ['presse', 'fuite huile'])
+    train_pipeline.make_refine_topics('fr', 'STA', ['presse', 'fuite huile'])
+    assert precomputed == [['presse', 'fuite huile']]
+    assert histo.load_artifact('fr', 'STA', 'refine_topics') == {'presse': [['huile']],
+                                                                 'fuite huile': [['huile']]}
+
+    # Changed searches, vectorizers & number of topics
+    train_pipeline.make_refine_topics('fr', 'STA', ['presse'])
+    for corpus_col, vect_filepath in get_last_vect_filepaths('fr', 'STA').items():
+        shutil.copy(vect_filepath, os.path.join(os.path.dirname(vect_filepath),
+                                                'vect_{}_20991231_2359.pkl'.format(corpus_col)))
+    train_pipeline.make_refine_topics('fr', 'STA', ['presse'])
+    histo.save_artifact('fr', 'STA', 'lda_sweep', {'n_components': 4})
+    train_pipeline.make_refine_topics('fr', 'STA', ['presse'])
+    train_pipeline.make_refine_topics('fr', 'STA', ['presse'])
+    assert precomputed == [['presse', 'fuite huile']] + [['presse']] * 3
+
+
+def test_make_train_language_shop_child_tables(histo_repo, reports_sample):
+    """[pipeline][train_pipeline] Check the child tables saved with the COMMENT vectorizer."""
+    df_reports = reports_sample.head(100).copy()
+    child_tables = report.build_child_tables(df_reports)
+    components_text = train_pipeline.get_components_text(child_tables['COMPONENTS'])
+    assert components_text.tolist() == [' ' + ' '.join(component[0] for component in components)
+                                        for components in df_reports['COMPONENTS']]
+
+    df_reports['COMMENT'] += components_text
+    train_pipeline.make_train_language_shop(df_reports, 'fr', 'STA', child_tables=child_tables)
+    comment_vect = CorpusVect('fr', 'STA', 'COMMENT')
+    comment_vect.load(get_last_vect_filepaths('fr', 'STA')['COMMENT'])
+    assert comment_vect.child_tables['COMPONENTS'][0].tolist() == \
+        child_tables['COMPONENTS'][0].tolist()
+    assert comment_vect.child_tables['MEDIAS'][1] == child_tables['MEDIAS'][1]
+
+    # The kernel formats the saved child tables like the nested columns
+    kernel = DiamanKernel('fr', 'STA')
+    assert kernel.comment_vect.child_tables is None
+    df_expected = comment_vect.df_preprocessed.copy()
+    serializer.format_nested_cols(df_expected)
+    for col in ('COMPONENTS', 'MEDIAS'):
+        assert kernel.comment_vect.df_preprocessed[col].tolist() == df_expected[col].tolist()
+
+
+def make_fake_train_outputs(df_language_shop, language, code_shop, data_config):
+    """Get the outputs of a training without training the shop, the training
+    of the PAI shop failing & the worker training the OOM shop dying."""
+    if code_shop == 'PAI':
+        raise ValueError('Training failed')
+    if code_shop == 'OOM':
+        os._exit(1)
+    return {'lda_matrix': df_language_shop['AUFNR'].tolist(), 'frequent_equipments': [],
+            'train_time': 0, 'skipped': False}
+
+
+@pytest.mark.parametrize('max_workers', [1, 2])
+def test_train_language_shops(monkeypatch, max_workers):
+    """[pipeline][train_pipeline] Check that a failed shop doesn't stop the others."""
+    monkeypatch.setattr(train_pipeline, 'make_train_outputs', make_fake_train_outputs)
+    train_config = DataConfig()
+    train_config.train_params = train_config.train_params._replace(max_workers=max_workers,
+                                                                   min_available_memory=0)
+
+    def load_language_shop(language, code_shop):
+        if code_shop == 'MEC':
+            raise OSError('Missing partition')
+        return pd.DataFrame({'AUFNR': ['{}_{}'.format(code_shop, idx) for idx in range(3)]})
+
+    language_shops = [('fr', 'STA'), ('fr', 'MEC'), ('fr', 'PAI'), ('fr', 'BSH')]
+    shop_outputs = train_pipeline.train_language_shops(language_shops, load_language_shop,
+                                                       train_config)
+
+    assert sorted(shop_outputs) == [('fr', 'BSH'), ('fr', 'STA')]
+    assert shop_outputs[('fr', 'STA')]['lda_matrix'] == ['STA_0', 'STA_1', 'STA_2']
+
+
+def test_stage_preprocessed_language_shops(tmp_path, spark_session, reports_sample):
+    """[pipeline][train_pipeline] Check the reports preprocessed & staged by Spark."""
+    df_reports = reports_sample.head(60).assign(
+        ERDAT=pd.to_datetime(reports_sample['ERDAT'].head(60)).dt.date,
+        CODE_SHOP=np.where(np.arange(60) % 2 == 0, 'STA', 'MEC'),
+        RATING=-1, LANGUAGE='fr')
+    records = [tuple(None if isinstance(value, float) and np.isnan(value) else value
+                     for value in row)
+               for row in df_reports.itertuples(index=False)]
+    df = spark_session.createDataFrame(records, schema=staging_schema)
+
+    staging_path = str(tmp_path / 'staging')
+    df = train_pipeline.preprocess_reports(spark_session, df, data_config)
+    train_pipeline.stage_language_shops(df, data_config, staging_path)
+
+    data_config_language = DataConfig('fr')
+    columns = train_pipeline.get_staging_columns(data_config)
+    for code_shop in ('STA', 'MEC'):
+        df_staged = train_pipeline.load_staged_language_shop(staging_path, 'fr', code_shop,
+                                                             columns)
+        df_expected = df_reports[df_reports['CODE_SHOP'] == code_shop] \
+            .sort_values('AUFNR').reset_index(drop=True)
+        df_expected['COMMENT'] += train_pipeline.get_components_text(
+            report.build_child_tables(df_expected)['COMPONENTS'])
+
+        assert df_staged.columns.tolist()[:len(columns)] == columns
+        assert df_staged['AUFNR'].tolist() == df_expected['AUFNR'].tolist()
+        assert df_staged['COMPONENTS'].tolist() == df_expected['COMPONENTS'].tolist()
+        for corpus_col, is_lda in preprocessing.PREPROCESSED_CORPORA:
+            expected_corpus = preprocessing.preprocess_corpus(
+                df_expected.copy(), corpus_col, data_config_language.stopwords,
+                data_config_language.word_dict, remove_numbers=is_lda, remove_small_words=is_lda)
+            assert df_staged[preprocessing.get_preprocessed_col(corpus_col, is_lda)].tolist() == \
+                expected_corpus.tolist()
+
+
+def test_train_language_shops_dead_worker(monkeypatch):
+    """[pipeline][train_pipeline] Check that a dead worker doesn't stop the other shops."""
+    monkeypatch.setattr(train_pipeline, 'make_train_outputs', make_fake_train_outputs)
+    train_config = DataConfig()
+    train_config.train_params = train_config.train_params._replace(max_workers=2,
+                                                                   min_available_memory=0)
+    loaded_shops = []
+
+    def load_language_shop(language, code_shop):
+        loaded_shops.append(code_shop)
+        return pd.DataFrame({'AUFNR': ['{}_{}'.format(code_shop, idx) for idx in range(3)]})
+
+    language_shops = [('fr', 'STA'), ('fr', 'OOM'), ('fr', 'PAI'), ('fr', 'BSH'), ('fr', 'MEC')]
+    shop_outputs = train_pipeline.train_language_shops(language_shops, load_language_shop,
+                                                       train_config)
+
+    assert sorted(shop_outputs) == [('fr', 'BSH'), ('fr', 'MEC'), ('fr', 'STA')]
+    assert shop_outputs[('fr', 'MEC')]['lda_matrix'] == ['MEC_0', 'MEC_1', 'MEC_2']
+    assert loaded_shops.count('OOM') == 2
@@ -0,0 +1,58 @@
+import os
+import time
+
+from diaman.utils.cache import ResponseCache, CorpusCache
+
+
+def test_response_cache_lru():
+    """[utils][cache] Check the eviction of the least recently used responses."""
+    cache = ResponseCache(max_memory=10)
+    cache.put(('fr_STA', 'a'), b'1234')
+    cache.put(('fr_STA', 'b'), b'1234')
+    assert cache.get(('fr_STA', 'a')) == b'1234'
+
+    cache.put(('fr_STA', 'c'), b'1234')
+    assert cache.get(('fr_STA', 'b')) is None
+    assert cache.get(('fr_STA', 'a')) == b'1234'
+    assert cache.get(('fr_STA', 'c')) == b'1234'
+
+    stats = cache.get_stats()
+    assert (stats['hits'], stats['misses'], stats['evictions']) == (3, 1, 1)
+    assert stats['memory'] == 8
+
+
+def test_response_cache_ttl():
+    """[utils][cache] Check the expiration of the responses."""
+    cache = ResponseCache(max_memory=10, ttl=0.01)
+    cache.put(('fr_STA', 'a'), b'1234')
+    time.sleep(0.02)
+    assert cache.get(('fr_STA', 'a')) is None
+    assert cache.get_stats()['size'] == 0
+
+
+def test_response_cache_invalidate():
+    """[utils][cache] Check the invalidation of the responses of a kernel."""
+    cache = ResponseCache(max_memory=100)
+    cache.put(('fr_STA', 'a'), b'1234')
+    cache.put(('fr_MEC', 'a'), b'1234')
+    cache.invalidate('fr_STA')
+    assert cache.get(('fr_STA', 'a')) is None
+    assert cache.get(('fr_MEC', 'a')) == b'1234'
+    assert cache.get_stats()['invalidations'] == 1
+
+
+def test_corpus_cache(tmpdir):
+    """[utils][cache] Check the persistence & the eviction of the preprocessed documents."""
+    filepath = os.path.join(str(tmpdir), 'corpus_cache.parquet')
+    corpus_cache = CorpusCache(filepath, 'hash', max_size=10)
+    corpus_cache.put(['Défaut', 'Fuite vérin'], ['defaut', 'fuite verin'], 'COMMENT')
+    corpus_cache.save()
+
+    corpus_cache = CorpusCache(filepath, 'hash', max_size=10)
+    corpus, found = corpus_cache.get(['Défaut', 'Fuite vérin'], 'COMMENT')
+    assert found.tolist() == [True, False]
+    assert corpus.tolist() == ['defaut', None]
+    assert corpus_cache.get(['Défaut'], 'DESCR_ORDER')[1].tolist() == [False]
+    assert corpus_cache.get_hit_rate() == 1 / 3
+
+    assert not CorpusCache(filepath, 'other_hash', max_size=10).get(['Défaut'], 'COMMENT')[1].any()
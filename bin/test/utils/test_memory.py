@@ -0,0 +1,25 @@
+import os
+import subprocess
+
+from diaman.utils import memory
+
+
+def test_get_process_memory():
+    """[utils][memory] Check the memory of the current process."""
+    process_memory = memory.get_process_memory()
+    assert 0 < process_memory['uss'] <= process_memory['pss'] <= process_memory['rss']
+
+
+def test_get_children_pids():
+    """[utils][memory] Check the child processes of the current process."""
+    child = subprocess.Popen(['sleep', '5'])
+    try:
+        assert child.pid in memory.get_children_pids(os.getpid())
+    finally:
+        child.kill()
+        child.wait()
+
+
+def test_get_available_memory():
+    """[utils][memory] Check the memory available on the machine."""
+    assert memory.get_available_memory() > 0
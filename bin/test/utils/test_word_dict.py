@@ -1,3 +1,8 @@
+import os
+import json
+import pickle
+import jsonlines
+
 from diaman.utils import word_dict
 
 
@@ -20,3 +25,72 @@ def test_merge_word_dicts():
 
     for correct_word in ref_dict:
         assert sorted(list(set(ref_dict[correct_word]))) == sorted(list(set(expected_dict[correct_word])))
+
+
+def test_indexed_word_dict():
+    """[utils][word_dict] Check the reverse index & the conflicts of the indexed dictionnary.
+
+    """
+    indexed_dict = word_dict.IndexedWordDict({"accoster": ["accostage", "acostage"],
+                                              "accostage": ["accostages"]})
+    assert indexed_dict.get_correct_word("accostage") == "accoster"
+    assert indexed_dict.get_correct_word("accostages") == "accostage"
+    assert indexed_dict.get_correct_word("accordeon") is None
+
+    indexed_dict.merge({"accostages": ["acostages"], "accordeon": ["acordeon"]})
+    assert indexed_dict.get_correct_word("acostages") == "accostage"
+    assert indexed_dict.get_conflicts() == {"accostage": ["accoster", "accostage"]}
+
+    indexed_dict.remove_correct_words()
+    assert indexed_dict.to_dict() == {"accoster": ["acostage"],
+                                      "accostage": ["accostages", "acostages"],
+                                      "accordeon": ["acordeon"]}
+    assert indexed_dict.get_conflicts() == {}
+
+
+def test_load_word_dict(tmpdir):
+    """[utils][word_dict] Check the compilation & the process-wide cache of the dictionnaries.
+
+    """
+    word_dict_filepath = os.path.join(str(tmpdir), 'word_dict.json')
+    with open(word_dict_filepath, 'w') as writer:
+        json.dump({"accoster": ["accostage", "acostage"]}, writer)
+
+    loaded_dict = word_dict.load_word_dict(word_dict_filepath)
+    assert loaded_dict == {"accoster": ["accostage", "acostage"]}
+    assert loaded_dict.corrections == {"accostage": "accoster", "acostage": "accoster"}
+    assert word_dict.load_word_dict(word_dict_filepath) is loaded_dict
+
+    compiled_filepath = word_dict.get_compiled_filepath(word_dict_filepath)
+    with open(compiled_filepath, 'rb') as reader:
+        compiled = pickle.load(reader)
+    assert compiled['version'] == word_dict.COMPILED_VERSION
+
+    with open(word_dict_filepath, 'w') as writer:
+        json.dump({"accordeon": ["acordeon"], "accoster": ["accostage"]}, writer)
+    word_dict._compiled_word_dicts.clear()
+    loaded_dict = word_dict.load_word_dict(word_dict_filepath)
+    assert loaded_dict.corrections == {"acordeon": "accordeon", "accostage": "accoster"}
+
+
+def test_word_dict_enrich(tmpdir, monkeypatch):
+    """[utils][word_dict] Check the word dictionnary before & after its enrichment.
+
+    """
+    monkeypatch.setenv('REPO', str(tmpdir))
+    word_dict_filepath = os.path.join(str(tmpdir), 'word_dict.json')
+    with open(word_dict_filepath, 'w') as writer:
+        json.dump({"accoster": ["accoster", "accostage"]}, writer)
+    doccano_filepath = os.path.join(str(tmpdir), 'doccano.jsonl')
+    with jsonlines.open(doccano_filepath, 'w') as writer:
+        writer.write({"text": "accordeon acordeon",
+                      "labels": [[0, 9, "CORRECT"], [10, 18, "INCORRECT"]]})
+
+    enriched_dict = word_dict.WordDict(word_dict_filename=word_dict_filepath)
+    assert enriched_dict.word_dict == {"accoster": ["accoster", "accostage"]}
+
+    enriched_dict.enrich(doccano_filepath)
+    expected_dict = {"accoster": ["accostage"], "accordeon": ["acordeon"]}
+    assert enriched_dict.word_dict == expected_dict
+    with open(word_dict_filepath) as reader:
+        assert json.load(reader) == expected_dict